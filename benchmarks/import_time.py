@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+"""
+    Startup benchmark: import time of automate modules measured with ``python -X importtime``
+    (Python >= 3.7). Usage::
+
+        python benchmarks/import_time.py [module ...] [--repeat N] [--top N]
+
+    Prints the median cumulative import time of each given module (default automate.system
+    and automate) and the slowest imports of the last run.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+def import_times(module):
+    """
+        Import ``module`` in a fresh interpreter and return {module name: (self us, cumulative us)}.
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-W', 'ignore', '-c', 'import %s' % module],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=['automate.system', 'automate'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        runs = [import_times(module) for i in range(args.repeat)]
+        total = statistics.median(sum(t[0] for t in run.values()) for run in runs)
+        print('%-30s %8.1f ms (median of %d runs)' % (module, total / 1000., args.repeat))
+        slowest = sorted(runs[-1].items(), key=lambda i: i[1][1], reverse=True)[:args.top]
+        for name, (self_us, cumulative_us) in slowest:
+            print('    %-40s self %7.1f ms  cumulative %7.1f ms' % (name, self_us / 1000., cumulative_us / 1000.))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+
+"""
+    Lock benchmark: cost of uncontended acquisition of :class:`automate.common.Lock` compared to
+    :class:`threading.Lock`, with lock profiling disabled and enabled. Usage::
+
+        python benchmarks/lock_overhead.py [--number N]
+"""
+
+import argparse
+import threading
+import timeit
+
+from automate.common import Lock
+from automate.lockprofile import lock_profiler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=1000000)
+    args = parser.parse_args()
+
+    def with_lock(lock):
+        def run():
+            with lock:
+                pass
+        return run
+
+    cases = [('threading.Lock', threading.Lock(), False),
+             ('Lock', Lock('benchmark'), False),
+             ('Lock (profiling enabled)', Lock('benchmark'), True)]
+    for name, lock, profiling in cases:
+        if profiling:
+            lock_profiler.enable()
+        try:
+            total = min(timeit.repeat(with_lock(lock), number=args.number, repeat=3))
+        finally:
+            lock_profiler.disable()
+        print('%-30s %8.1f ns per acquisition' % (name, total / args.number * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -21,13 +21,7 @@
 # If you like Automate, please take a look at this page:
 # http://evankelista.net/automate/
 
-
-import pkg_resources
-
-try:
-    __version__ = pkg_resources.get_distribution("automate").version
-except pkg_resources.DistributionNotFound:
-    __version__ = '(version information not available)'
+import sys
 
 from . import traits_fixes
 from .common import *
@@ -39,3 +33,36 @@ from .sensors import *
 from .services import *
 from .tools import *
 from .statusobject import *
+from .extensions import load_extensions, extension_class_names
+
+
+def _get_version():
+    import pkg_resources
+    try:
+        return pkg_resources.get_distribution("automate").version
+    except pkg_resources.DistributionNotFound:
+        return '(version information not available)'
+
+
+def __getattr__(name):
+    # Version and extension classes are resolved lazily, because both need pkg_resources and
+    # extensions import their (heavy) requirements. Star import (``from automate import *``)
+    # asks for __all__ and gets also the extension classes.
+    if name == '__version__':
+        globals()[name] = _get_version()
+        return globals()[name]
+    if name == '__all__':
+        load_extensions()
+        return [i for i in globals() if not i.startswith('_')] + extension_class_names
+    if not name.startswith('__'):
+        load_extensions()
+        for module in (services, sensors, actuators, callables):
+            if name in module.__dict__:
+                return module.__dict__[name]
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+if sys.version_info < (3, 7):
+    # Module level __getattr__ is not supported
+    __version__ = _get_version()
+    load_extensions()
@@ -22,6 +22,7 @@
 # http://evankelista.net/automate/
 
 import re
+from numbers import Number
 from traits.api import cached_property, on_trait_change, CList, Dict, Instance, Set, Event, Property
 from .common import CompareMixin, Lock, deep_iterate, Object, is_iterable, AbstractStatusObject, DictObject, SystemNotReady
 from .systemobject import SystemObject
@@ -39,6 +40,10 @@ class AbstractCallable(SystemObject, CompareMixin):
     method which defines their functionality.
     """
 
+    #: If True, the value given by :meth:`.call` is determined only by the arguments (and statuses of
+    #: StatusObjects among them), and calling has no side effects. See :meth:`.dependencies`.
+    pure = False
+
     #: Arguments given for callable are stored here
     _args = CList
 
@@ -67,6 +72,11 @@ class AbstractCallable(SystemObject, CompareMixin):
     #: This automatically depends on all the StatusObjects below the Callable tree.
     status = Property(depends_on='_args.status, _kwargs.status')
 
+    #: Compiled form of the callable: a function ``f(caller, **kwargs)`` that gives the same result as
+    #: :meth:`.call`, but with object references resolved beforehand. See :meth:`.compile`.
+    compiled = Property(transient=True,
+                        depends_on='system, _args, _args_items, _args.compiled, _kwargs, _kwargs_items, _kwargs.compiled')
+
     #: State dictionary that is used by :meth:`.call` and :meth:`.cancel` if some state variables are needed to be saved
     #: Remember to clean data in subclasses when it is no longer needed.
     state = Dict(transient=True)
@@ -96,6 +106,24 @@ class AbstractCallable(SystemObject, CompareMixin):
             raise SystemNotReady('System not ready yet -- this is normal when loading dump.')
         return self.call(None)
 
+    @cached_property
+    def _get_compiled(self):
+        if not self.system:
+            # Raising exception prevents invalid value from being cached when system is in pre-mature state
+            raise SystemNotReady('System not ready yet -- this is normal when loading dump.')
+        if self._call_overrides_compile():
+            return self.call
+        return self.compile()
+
+    def _call_overrides_compile(self):
+        # Subclass that overrides call() must not get the compiled form of its parent class
+        for cls in type(self).__mro__:
+            if 'compile' in cls.__dict__:
+                return False
+            if 'call' in cls.__dict__:
+                return True
+        return False
+
     #: Event that can be used to execute code right after callable setup. See :class:`.OfType`.
     #: Something that needs to be done manually this way, because Traits does not allow
     #: defining the order of subscribed function calls.
@@ -176,6 +204,68 @@ class AbstractCallable(SystemObject, CompareMixin):
         else:
             return value
 
+    def compile(self):
+        """
+            Give function ``f(caller, **kwargs)`` that evaluates this callable. By default, this is just
+            :meth:`.call`. Callables whose :meth:`.call` only evaluates their arguments may override this
+            and build the function from the functions given by :meth:`.compile_arg`.
+            Result of the function must be identical to the result of :meth:`.call`.
+            If a subclass overrides :meth:`.call` but not :meth:`.compile`, :attr:`.compiled`
+            is :meth:`.call` of the subclass.
+        """
+        return self.call
+
+    def compile_arg(self, value):
+        """
+            Give function ``f(caller, **kwargs)`` that is equivalent to
+            ``call_eval(value, caller, **kwargs)``, but name lookup and type checks are done already here.
+        """
+        call_eval = self.call_eval
+        value = self.name_to_system_object(value)
+        if isinstance(value, AbstractStatusObject):
+            return lambda caller, **kwargs: value.status
+        if isinstance(value, AbstractCallable):
+            func = value.compiled
+
+            def _eval(caller, **kwargs):
+                rv = func(caller, **kwargs)
+                if rv is None or isinstance(rv, Number):
+                    return rv
+                return call_eval(rv, caller, **kwargs)
+            return _eval
+        if isinstance(value, (str, Object)) or hasattr(value, 'call'):
+            # Name that is not (yet) found in namespace etc.: resolve each time
+            return lambda caller, **kwargs: call_eval(value, caller, **kwargs)
+        return lambda caller, **kwargs: value
+
+    def dependencies(self):
+        """
+            Give set of StatusObjects whose statuses alone determine the value of this callable, or
+            ``None``, if value may change also otherwise (callable is not :attr:`.pure`).
+        """
+        if not self.pure:
+            return None
+        deps = set()
+        for i in self._args + list(self._kwargs.values()):
+            arg_deps = self.arg_dependencies(i)
+            if arg_deps is None:
+                return None
+            deps |= arg_deps
+        return frozenset(deps)
+
+    def arg_dependencies(self, value):
+        """
+            Give :meth:`.dependencies` of an argument value.
+        """
+        value = self.name_to_system_object(value)
+        if isinstance(value, AbstractStatusObject):
+            return frozenset([value])
+        if isinstance(value, AbstractCallable):
+            return value.dependencies()
+        if isinstance(value, (str, Object)) or hasattr(value, 'call') or is_iterable(value):
+            return None
+        return frozenset()
+
     def _fix_list(self, lst):
         if isinstance(lst, dict):
             lst2 = list(lst.items())
@@ -323,7 +413,7 @@ class AbstractCallable(SystemObject, CompareMixin):
         return self.give_str()
 
     def _give_str(self, args, kwargs):
-        if self in self.system.namespace.reverse:
+        if self.system and self in self.system.namespace.reverse:
             return repr(self.name)
         kwstr = u', '.join(k + u'=' + repr(v) for k, v in list(kwargs.items()))
         if kwstr and args:
@@ -343,7 +433,7 @@ class AbstractCallable(SystemObject, CompareMixin):
         return re.sub('__\w*__', "", _str)
 
     def _give_str_indented(self, args, kwargs, tags):
-        if self in self.system.namespace.reverse:
+        if self.system and self in self.system.namespace.reverse:
             rv = repr(self.name)
 
         def indent(o_str):
@@ -353,7 +443,7 @@ class AbstractCallable(SystemObject, CompareMixin):
             return '\n'.join(n_strs)
 
         def indented_str(obj, no_repr=False, no_color=False):
-            if hasattr(obj, 'give_str_indented') and not obj in self.system.namespace.reverse:
+            if hasattr(obj, 'give_str_indented') and not (self.system and obj in self.system.namespace.reverse):
                 rv = obj.give_str_indented(tags)
             else:
                 rv = str(obj if no_repr else repr(obj))
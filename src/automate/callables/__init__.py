@@ -22,3 +22,6 @@
 # http://evankelista.net/automate/
 
 from .builtin_callables import *
+
+from ..extensions import extension_getattr as _extension_getattr
+__getattr__ = _extension_getattr(__name__)
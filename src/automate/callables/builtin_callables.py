@@ -26,12 +26,12 @@ import datetime
 
 import re
 import statistics
-import threading
 import xmlrpc.client
 import socket
 import subprocess
 import time
 import collections
+from numbers import Number
 
 from http.client import HTTPException
 
@@ -40,7 +40,7 @@ from traits.api import (CList, Any, Property, Set, Bool, Event, CBool, on_trait_
 from automate.callable import AbstractCallable
 from automate.common import deep_iterate, get_modules_all
 from automate.statusobject import StatusObject
-from automate.common import (threaded, thread_start, is_iterable)
+from automate.common import (thread_start, is_iterable)
 
 
 class Empty(AbstractCallable):
@@ -542,10 +542,11 @@ class Delay(AbstractRunner):
 
             self.logger.info("Scheduling %s", self)
             delay = self.call_eval(self.delay, caller, **kwargs)
-            timer = threading.Timer(delay, None)
-            timer.function = threaded(self.system, self._run, caller, timer, **kwargs)
             time_after_delay = datetime.datetime.now() + datetime.timedelta(seconds=delay)
-            timer.name = "Timer for %s timed at %s (%d sek)" % (self, time_after_delay, delay)
+            timer = self.system.scheduler.timer(
+                delay, self._run, kwargs=kwargs,
+                name="Timer for %s timed at %s (%d sek)" % (self, time_after_delay, delay))
+            timer.args = (caller, timer)
             timer.start()
             timers.append(timer)
 
@@ -632,6 +633,8 @@ class IfElse(AbstractCallable):
         IfElse(x, y)
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         if self.call_eval(self.objects[0], caller, **kwargs):
             return self.call_eval(self.objects[1], caller, **kwargs)
@@ -640,6 +643,18 @@ class IfElse(AbstractCallable):
         else:
             return False
 
+    def compile(self):
+        if len(self.objects) < 2:
+            return self.call
+        cond, then = self.compile_arg(self.objects[0]), self.compile_arg(self.objects[1])
+        otherwise = self.compile_arg(self.objects[2]) if len(self.objects) > 2 else lambda caller, **kwargs: False
+
+        def _ifelse(caller=None, **kwargs):
+            if cond(caller, **kwargs):
+                return then(caller, **kwargs)
+            return otherwise(caller, **kwargs)
+        return _ifelse
+
     def _give_triggers(self):
         return self.objects[1:]
 
@@ -735,12 +750,24 @@ class Min(AbstractMathematical):
         # evaluated as number (Callables, Statusobjects etc).
      """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         val = float("inf")
         for i in self.objects:
             val = min(val, self.call_eval(i, caller, **kwargs))
         return val
 
+    def compile(self):
+        funcs = [self.compile_arg(i) for i in self.objects]
+
+        def _min(caller=None, **kwargs):
+            val = float("inf")
+            for func in funcs:
+                val = min(val, func(caller, **kwargs))
+            return val
+        return _min
+
 
 class Max(AbstractMathematical):
 
@@ -753,12 +780,24 @@ class Max(AbstractMathematical):
         # evaluated as number (Callables, Statusobjects etc).
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         val = -float("inf")
         for i in self.objects:
             val = max(val, self.call_eval(i, caller, **kwargs))
         return val
 
+    def compile(self):
+        funcs = [self.compile_arg(i) for i in self.objects]
+
+        def _max(caller=None, **kwargs):
+            val = -float("inf")
+            for func in funcs:
+                val = max(val, func(caller, **kwargs))
+            return val
+        return _max
+
 
 class Sum(AbstractMathematical):
 
@@ -771,12 +810,24 @@ class Sum(AbstractMathematical):
         # evaluated as number (Callables, Statusobjects etc).
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         _sum = 0.0
         for i in self.objects:
             _sum += self.call_eval(i, caller, **kwargs)
         return _sum
 
+    def compile(self):
+        funcs = [self.compile_arg(i) for i in self.objects]
+
+        def _sum_(caller=None, **kwargs):
+            _sum = 0.0
+            for func in funcs:
+                _sum += func(caller, **kwargs)
+            return _sum
+        return _sum_
+
 
 class Product(AbstractMathematical):
 
@@ -790,12 +841,24 @@ class Product(AbstractMathematical):
 
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         _sum = 1.0
         for i in self.objects:
             _sum *= self.call_eval(i, caller, **kwargs)
         return _sum
 
+    def compile(self):
+        funcs = [self.compile_arg(i) for i in self.objects]
+
+        def _product(caller=None, **kwargs):
+            _sum = 1.0
+            for func in funcs:
+                _sum *= func(caller, **kwargs)
+            return _sum
+        return _product
+
 
 class Mult(Product):
 
@@ -814,6 +877,8 @@ class Division(AbstractMathematical):
 
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         if len(self.objects) != 2:
             raise RuntimeError('Wrong amount of arguments')
@@ -823,6 +888,17 @@ class Division(AbstractMathematical):
         _val2 = self.call_eval(obj2, caller, **kwargs)
         return _val1 / _val2
 
+    def compile(self):
+        if len(self.objects) != 2:
+            return self.call
+        func1, func2 = (self.compile_arg(i) for i in self.objects)
+
+        def _division(caller=None, **kwargs):
+            _val1 = func1(caller, **kwargs)
+            _val2 = func2(caller, **kwargs)
+            return _val1 / _val2
+        return _division
+
 
 class Div(Division):
 
@@ -838,6 +914,72 @@ class AbstractLogical(AbstractMathematical):
 
     """Abstract class for logic operations (:class:`.And`, :class:`.Or` etc.) """
 
+    def compile_counting(self, ordered, decisive):
+        """
+            Build function that evaluates :class:`.And` or :class:`.Or` incrementally. Truth values of
+            children are cached per caller, together with the count of children whose truth value equals to
+            ``decisive``. If the function is called with ``changed_triggers`` (set of StatusObjects that
+            have changed since previous call by the same caller), only children that depend on those
+            are evaluated again.
+
+            If children are not all :attr:`.pure`, or caller is not triggered by all of their
+            dependencies, or their values are not plain numbers, ``ordered`` (normal, non-incremental
+            evaluation function) is used instead.
+        """
+        objs = [self.name_to_system_object(i) for i in self.objects]
+        deps = [self.arg_dependencies(i) for i in objs]
+        if not objs or None in deps:
+            return ordered
+
+        is_callable = [isinstance(i, AbstractCallable) for i in objs]
+        funcs = [i.compiled if c else self.compile_arg(i) for i, c in zip(objs, is_callable)]
+        all_deps = frozenset().union(*deps)
+        by_trigger = collections.defaultdict(list)
+        for idx, obj_deps in enumerate(deps):
+            for t in obj_deps:
+                by_trigger[t].append(idx)
+
+        # Per caller: [truth values of children, count of decisive values], or False if not applicable
+        states = {}
+
+        def _counting(caller=None, changed_triggers=None, **kwargs):
+            state = states.get(caller)
+            if changed_triggers is None or state is None:
+                if not all_deps <= getattr(caller, 'actual_triggers', frozenset()):
+                    return ordered(caller, **kwargs)
+                state = [[None] * len(funcs), 0]
+                indices = range(len(funcs))
+                changed_triggers = None
+            elif state is False:
+                return ordered(caller, **kwargs)
+            else:
+                indices = {idx for t in changed_triggers for idx in by_trigger.get(t, ())}
+
+            values, count = state
+            try:
+                for idx in indices:
+                    if is_callable[idx]:
+                        val = funcs[idx](caller, changed_triggers=changed_triggers, **kwargs)
+                        if not (val is None or isinstance(val, Number)):
+                            raise ValueError('Value %r not suitable for counting' % (val,))
+                    else:
+                        val = funcs[idx](caller, **kwargs)
+                        if is_iterable(val):
+                            raise ValueError('Value %r not suitable for counting' % (val,))
+                    truth = bool(val)
+                    if values[idx] is not None:
+                        count -= values[idx] == decisive
+                    values[idx] = truth
+                    count += truth == decisive
+            except Exception:
+                states[caller] = False
+                return ordered(caller, **kwargs)
+
+            state[1] = count
+            states[caller] = state
+            return decisive if count else not decisive
+        return _counting
+
 
 class Anything(AbstractLogical):
 
@@ -848,9 +990,14 @@ class Anything(AbstractLogical):
         Anything(x,y,z...)
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         return True
 
+    def compile(self):
+        return lambda caller=None, **kwargs: True
+
 
 class Or(AbstractLogical):
 
@@ -861,17 +1008,33 @@ class Or(AbstractLogical):
         Or(x,y,z...) # gives truth value of x or y or z or ,,,
     """
 
+    pure = True
+
+    def _any(self, values, caller, **kwargs):
+        for i in values:
+            val = self.call_eval(i, caller, **kwargs)
+            if is_iterable(val):
+                val = self._any(val, caller, **kwargs)
+            if val:
+                return True
+        return False
+
     def call(self, caller=None, **kwargs):
-        def _or(list):
-            for i in list:
-                val = self.call_eval(i, caller, **kwargs)
+        return self._any(self.objects, caller, **kwargs)
+
+    def compile(self):
+        funcs = [self.compile_arg(i) for i in self.objects]
+        _any = self._any
+
+        def _or(caller=None, **kwargs):
+            for func in funcs:
+                val = func(caller, **kwargs)
                 if is_iterable(val):
-                    val = _or(val)
+                    val = _any(val, caller, **kwargs)
                 if val:
                     return True
             return False
-
-        return _or(self.objects)
+        return self.compile_counting(_or, decisive=True)
 
 
 class And(AbstractLogical):
@@ -884,16 +1047,33 @@ class And(AbstractLogical):
 
     """
 
+    pure = True
+
+    def _all(self, values, caller, **kwargs):
+        for i in values:
+            val = self.call_eval(i, caller, **kwargs)
+            if is_iterable(val):
+                val = self._all(val, caller, **kwargs)
+            if not val:
+                return False
+        return True
+
     def call(self, caller=None, **kwargs):
-        def _and(list):
-            for i in list:
-                val = self.call_eval(i, caller, **kwargs)
+        return self._all(self.objects, caller, **kwargs)
+
+    def compile(self):
+        funcs = [self.compile_arg(i) for i in self.objects]
+        _all = self._all
+
+        def _and(caller=None, **kwargs):
+            for func in funcs:
+                val = func(caller, **kwargs)
                 if is_iterable(val):
-                    val = _and(val)
+                    val = _all(val, caller, **kwargs)
                 if not val:
                     return False
             return True
-        return _and(self.objects)
+        return self.compile_counting(_and, decisive=False)
 
 
 class Neg(AbstractLogical):
@@ -905,11 +1085,19 @@ class Neg(AbstractLogical):
         Neg(x) # returns -x
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         if len(self.objects) != 1:
             raise RuntimeError('Too many arguments')
         return -self.call_eval(self.obj, caller, **kwargs)
 
+    def compile(self):
+        if len(self.objects) != 1:
+            return self.call
+        func = self.compile_arg(self.obj)
+        return lambda caller=None, **kwargs: -func(caller, **kwargs)
+
 
 class Inverse(AbstractLogical):
 
@@ -920,11 +1108,19 @@ class Inverse(AbstractLogical):
         Inv(x) # returns 1/x
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         if len(self.objects) != 1:
             raise RuntimeError('Too many arguments')
         return 1./self.call_eval(self.obj, caller, **kwargs)
 
+    def compile(self):
+        if len(self.objects) != 1:
+            return self.call
+        func = self.compile_arg(self.obj)
+        return lambda caller=None, **kwargs: 1./func(caller, **kwargs)
+
 
 class Inv(Inverse):
 
@@ -940,11 +1136,19 @@ class Not(AbstractLogical):
         Not(x) # returns not x
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         if len(self.objects) != 1:
             raise RuntimeError('Too many arguments')
         return not self.call_eval(self.obj, caller, **kwargs)
 
+    def compile(self):
+        if len(self.objects) != 1:
+            return self.call
+        func = self.compile_arg(self.obj)
+        return lambda caller=None, **kwargs: not func(caller, **kwargs)
+
 
 class Equal(AbstractLogical):
 
@@ -955,9 +1159,15 @@ class Equal(AbstractLogical):
         Equal(x, y) # returns truth value of x == y
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         return self.call_eval(self.obj, caller, **kwargs) == self.call_eval(self.value, caller, **kwargs)
 
+    def compile(self):
+        func1, func2 = self.compile_arg(self.obj), self.compile_arg(self.value)
+        return lambda caller=None, **kwargs: func1(caller, **kwargs) == func2(caller, **kwargs)
+
 
 class Less(AbstractLogical):
 
@@ -968,6 +1178,8 @@ class Less(AbstractLogical):
         Less(x,y) # returns truth value of x < y
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         a = self.call_eval(self.obj, caller, **kwargs)
         b = self.call_eval(self.value, caller, **kwargs)
@@ -977,6 +1189,19 @@ class Less(AbstractLogical):
             rv = False
         return rv
 
+    def compile(self):
+        func1, func2 = self.compile_arg(self.obj), self.compile_arg(self.value)
+
+        def _less(caller=None, **kwargs):
+            a = func1(caller, **kwargs)
+            b = func2(caller, **kwargs)
+            try:
+                rv = a < b
+            except TypeError:
+                rv = False
+            return rv
+        return _less
+
 class More(AbstractLogical):
 
     """Condition: is x > y
@@ -987,6 +1212,8 @@ class More(AbstractLogical):
 
     """
 
+    pure = True
+
     def call(self, caller=None, **kwargs):
         a = self.call_eval(self.obj, caller, **kwargs)
         b = self.call_eval(self.value, caller, **kwargs)
@@ -996,6 +1223,19 @@ class More(AbstractLogical):
             rv = False
         return rv
 
+    def compile(self):
+        func1, func2 = self.compile_arg(self.obj), self.compile_arg(self.value)
+
+        def _more(caller=None, **kwargs):
+            a = func1(caller, **kwargs)
+            b = func2(caller, **kwargs)
+            try:
+                rv = a > b
+            except TypeError:
+                rv = False
+            return rv
+        return _more
+
 
 class Value(AbstractLogical):
 
@@ -1008,11 +1248,16 @@ class Value(AbstractLogical):
                  # as a condition of Program condition attributes.
 
     """
+
+    pure = True
     _args = CList
 
     def call(self, caller=None, **kwargs):
         return self.call_eval(self.obj, caller, **kwargs)
 
+    def compile(self):
+        return self.compile_arg(self.obj)
+
 
 class Average(AbstractLogical):
 
@@ -1350,9 +1595,9 @@ class While(AbstractRunner):
         with self._lock:
             state = self.get_state(caller)
             threads = state.get_or_create('threads', [])
-            t = threading.Timer(0., None)
-            t.function = threaded(self.system, self._run, caller, t, **kwargs)
-            t.name = 'Thread for %s' % self
+            t = self.system.scheduler.timer(0., self._run, kwargs=kwargs, name='Thread for %s' % self,
+                                            dedicated_thread=True)
+            t.args = (caller, t)
             t._cancel_while = False
             threads.append(t)
             t.start()
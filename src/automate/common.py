@@ -25,12 +25,16 @@ from copy import copy
 import logging
 import re
 import keyword
+import sys
 import threading
+import time
 from collections import Iterable
 from functools import wraps
 
 from traits.api import CSet, HasStrictTraits, Unicode, TraitType
 
+from .lockprofile import lock_profiler
+
 logger = logging.getLogger(__name__)
 
 class AbstractStatusObject(object):
@@ -128,44 +132,46 @@ def has_baseclass(v, s):
 
 class Lock(object):
 
-    """Lock object (similar to threading.Lock) that can print some debug information"""
-    context = None
+    """
+        Lock object (similar to threading.Lock). Uncontended acquisition costs only as much as
+        acquisition of the underlying :class:`threading.Lock`. When
+        :data:`~automate.lockprofile.lock_profiler` is enabled, contended acquisitions are
+        recorded by it.
+    """
 
     def __init__(self, name="Unnamed lock", silent=False):
-        self.logger = logging.getLogger('automate.common.Lock')
         self.name = name
         self.lock = threading.Lock()
-        self.context_lock = threading.Lock()
+        #: Do not sample stacks of threads that wait for this lock
         self.silent = silent
 
     def acquire(self, wait=0):
         return self.__enter__()
 
     def release(self):
-        return self.__exit__(None, None, None)
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
 
     def __enter__(self):
-        import traceback
-        if self.lock.acquire(False):
-            pass
-        else:
-            self.logger.debug("WAITING for lock %s", self.name)
-            with self.context_lock:
-                if not self.silent and self.context:
-                    current_context = traceback.format_stack()
-                    self.logger.debug("Current context:\n %s", "".join(current_context))
-                    self.logger.debug("The context, when lock was acquired\n %s", "".join(self.context))
-            self.lock.acquire()
-            self.logger.debug("OK, gone through %s", self.name)
+        if not self.lock.acquire(False):
+            self._wait()
 
-        with self.context_lock:
-            self.context = traceback.format_stack()
+    def _wait(self):
+        if not lock_profiler.enabled:
+            self.lock.acquire()
+            return
+        t0 = time.perf_counter()
+        self.lock.acquire()
+        lock_profiler.record(self.name, time.perf_counter() - t0, None if self.silent else sys._getframe(2))
 
     def __exit__(self, type, value, tb):
-        with self.context_lock:
-            self.context = None
         self.lock.release()
 
+    def __repr__(self):
+        return '<Lock %s>' % self.name
+
 
 class _nomutex(object):
 
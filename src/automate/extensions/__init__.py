@@ -14,3 +14,72 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import sys
+import threading
+
+logger = logging.getLogger('automate.extensions')
+
+#: Names of the classes that have been registered by :func:`load_extensions`
+extension_class_names = []
+
+_loaded = False
+_load_lock = threading.RLock()
+
+
+def load_extensions():
+    """
+        Load classes of installed extensions (entry point group 'automate.extension') and register
+        them to :mod:`automate.services`, :mod:`~automate.sensors`, :mod:`~automate.actuators` and
+        :mod:`~automate.callables`. Extensions are loaded only once, on first access to a name that
+        is not found in those modules (see :func:`extension_getattr`) or when a System initializes
+        its services.
+    """
+    global _loaded
+    with _load_lock:
+        if _loaded:
+            return
+        _loaded = True
+
+        import pkg_resources
+        from automate import services, sensors, actuators, callables
+        from automate.service import AbstractService
+        from automate.statusobject import AbstractSensor, AbstractActuator
+        from automate.callable import AbstractCallable
+
+        for entry_point in pkg_resources.iter_entry_points('automate.extension'):
+            logger.debug('Loading extension %s', entry_point)
+            try:
+                ext_classes = entry_point.load(require=False)
+            except ImportError:
+                logger.info('Loading extension %s failed. Perhaps missing requirements? Skipping.', entry_point)
+                continue
+            for ext_class in ext_classes:
+                logger.debug('... %s', ext_class.__name__)
+                if issubclass(ext_class, AbstractService):
+                    setattr(services, ext_class.__name__, ext_class)
+                elif issubclass(ext_class, AbstractSensor):
+                    setattr(sensors, ext_class.__name__, ext_class)
+                elif issubclass(ext_class, AbstractActuator):
+                    setattr(actuators, ext_class.__name__, ext_class)
+                elif issubclass(ext_class, AbstractCallable):
+                    setattr(callables, ext_class.__name__, ext_class)
+                else:
+                    continue
+                extension_class_names.append(ext_class.__name__)
+
+
+def extension_getattr(module_name):
+    """
+        Create module level ``__getattr__`` (PEP 562) for module where extension classes are
+        registered: extensions are loaded when a name is not found in the module.
+    """
+    def __getattr__(name):
+        if not name.startswith('__'):
+            load_extensions()
+            module_dict = sys.modules[module_name].__dict__
+            if name in module_dict:
+                return module_dict[name]
+        raise AttributeError('module %r has no attribute %r' % (module_name, name))
+    return __getattr__
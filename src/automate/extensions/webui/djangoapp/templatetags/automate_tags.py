@@ -74,13 +74,15 @@ def name_sort(l):
     return sorted(list(l), key=operator.attrgetter('class_name', 'name'))
 
 
-def active_color(obj, value, changing=None, display=None, program=False):
+def active_color(obj, value, changing=None, display=None, program=False, quarantined=False):
     if isinstance(obj, tuple):
         id = u'program_status_for_actuator'
     else:
         id = u'object_status_' + obj.name
     if program:
         id = u'program_active_' + obj.name
+    if quarantined:
+        id += u' status_quarantined'
 
     if display is None:
         display = value
@@ -123,7 +125,8 @@ def object_status(obj):
     if isinstance(obj, Program):
         return active_color(obj, obj.active, False)
     if isinstance(obj, StatusObject):
-        return active_color(obj, obj.status, obj.changing, display=obj.get_status_display())
+        return active_color(obj, obj.status, obj.changing, display=obj.get_status_display(),
+                            quarantined=obj.quarantined)
     else:
         return active_color(obj, obj.get_status_display(), False)
 
@@ -41,11 +41,14 @@ urlpatterns = [
     url('^custom/(\w*)$', views.custom, name='custom'),
     url('^uml/system.svg$', views.puml_svg, name='puml_svg'),
     url('^history.json/object/(\w*)$', views.history_json, name='history_json'),
+    url('^history.json/objects$', views.history_grid_json, name='history_grid_json'),
     url('^uml/system.puml$', views.puml_raw, name='puml_raw'),
     url('^uml$', views.plantuml, name='plantuml'),
 
     url('^system$', views.system_view, name='system'),
     url("^threads$", views.threads, name='threads'),
+    url("^startup.json$", views.startup_json, name='startup_json'),
+    url("^locks.json$", views.locks_json, name='locks_json'),
 
     url('^tag/([\w:]*)', views.single_tag, name='single_tag'),
 
@@ -21,6 +21,8 @@
 # If you like Automate, please take a look at this page:
 # http://evankelista.net/automate/
 
+import json
+import logging
 import threading
 from datetime import datetime, timedelta
 
@@ -31,7 +33,8 @@ except ImportError:
 
 from django.contrib import messages
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect, Http404, HttpResponse, JsonResponse
+from django.http import (HttpResponseRedirect, Http404, HttpResponse, JsonResponse, HttpResponseBadRequest,
+                         StreamingHttpResponse)
 from django.shortcuts import render, redirect
 from django.template import Template, RequestContext
 from django.utils.http import urlencode
@@ -40,6 +43,8 @@ from django.utils.safestring import mark_safe
 from functools import wraps
 from automate.statusobject import AbstractActuator
 from automate.statusobject import AbstractSensor
+from automate.history import DOWNSAMPLING_METHODS
+from automate.lockprofile import lock_profiler
 from .forms import LoginForm, CmdForm, FORMTYPES, QUICK_EDITS, TextForm
 
 
@@ -146,13 +151,76 @@ def custom(request, name):
         raise Http404
 
 
+#: Responses with more data points than this are streamed in chunks
+HISTORY_STREAMING_THRESHOLD = 10000
+
+#: Maximum number of grid points in history_grid_json responses
+HISTORY_GRID_MAX_POINTS = 10000
+
+
+def _data_points(times, statuses):
+    if hasattr(times, 'astype'):
+        return list(zip((times * 1000).astype('int64').tolist(), statuses.tolist()))
+    return [(int(t*1000), s) for t, s in zip(times, statuses)]
+
+
+def _stream_data_points(times, statuses, chunk_size=HISTORY_STREAMING_THRESHOLD):
+    # Data points are converted and encoded one chunk at a time
+    yield '['
+    for i in range(0, len(times), chunk_size):
+        chunk = _data_points(times[i:i + chunk_size], statuses[i:i + chunk_size])
+        yield (',' if i else '') + json.dumps(chunk)[1:-1]
+    yield ']'
+
+
 @require_login
 def history_json(request, name):
+    """
+        History of object as [[time_ms, status], ...]. Optional GET parameters: ``start`` and
+        ``end`` (milliseconds since epoch), ``max_points`` and ``method`` (downsampling method,
+        'lttb' or 'minmax').
+    """
     obj = service.system.namespace[name]
     if not hasattr(obj, 'history'):
         raise Http404
-    data_points = [(int(t*1000), float(s or 0)) for t, s in obj.history]
-    return JsonResponse(data_points, safe=False)
+    try:
+        t_a, t_b = (float(request.GET[key]) / 1000. if request.GET.get(key) else None
+                    for key in ('start', 'end'))
+        max_points = int(request.GET.get('max_points') or 0)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid start, end or max_points')
+    method = request.GET.get('method', 'lttb')
+    if method not in DOWNSAMPLING_METHODS:
+        return HttpResponseBadRequest('Unknown method %s' % method)
+    times, statuses = obj.history_points(t_a, t_b, max_points, method)
+    if len(times) > HISTORY_STREAMING_THRESHOLD:
+        return StreamingHttpResponse(_stream_data_points(times, statuses), content_type='application/json')
+    return JsonResponse(_data_points(times, statuses), safe=False)
+
+
+@require_login
+def history_grid_json(request):
+    """
+        Histories of several objects resampled to a common time grid, as
+        {"times": [time_ms, ...], "series": {name: [status, ...], ...}}. GET parameters: ``names``
+        (comma separated), ``start`` and ``end`` (milliseconds since epoch) and either ``step``
+        (seconds) or ``max_points``. Grid has at most :data:`HISTORY_GRID_MAX_POINTS` points.
+    """
+    names = [i for i in request.GET.get('names', '').split(',') if i]
+    if not all(hasattr(service.system.namespace.get(name), 'history') for name in names):
+        raise Http404
+    try:
+        t_a = float(request.GET['start']) / 1000.
+        t_b = float(request.GET['end']) / 1000. if request.GET.get('end') else None
+        step = float(request.GET['step']) if request.GET.get('step') else None
+        max_points = min(int(request.GET.get('max_points') or HISTORY_GRID_MAX_POINTS), HISTORY_GRID_MAX_POINTS)
+        grid, series = service.system.history_grid(names, t_a, t_b, step, max_points)
+    except (KeyError, ValueError) as e:
+        return HttpResponseBadRequest('Invalid parameters: %s' % e)
+    except TypeError as e:
+        return HttpResponse(str(e), status=422, content_type='text/plain')
+    return JsonResponse({'times': (grid * 1000).astype('int64').tolist(),
+                         'series': {name: values.tolist() for name, values in series.items()}})
 
 
 @require_login
@@ -184,7 +252,38 @@ def system_view(request):
 def threads(request):
     threads = [(t.name, t) for t in threading.enumerate()]
     threads.sort(key=lambda x: x[0])
-    return render(request, 'views/threads.html', {'threads': threads})
+    scheduled_calls = [(c.name, c) for c in service.system.scheduler.pending]
+    return render(request, 'views/threads.html', {'threads': threads, 'scheduled_calls': scheduled_calls,
+                                                  'startup_report': service.system.startup_report,
+                                                  'lock_profiler': lock_profiler,
+                                                  'quarantined': sorted(obj.name for obj in service.system.objects
+                                                                        if getattr(obj, 'quarantined', False))})
+
+
+@require_login
+def locks_json(request):
+    """
+        Lock contention report (see :class:`~automate.lockprofile.LockProfiler`). GET parameter
+        ``n`` gives the number of top waiters that are listed per lock (default 5).
+    """
+    try:
+        n = int(request.GET.get('n') or 5)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid n')
+    return JsonResponse({'enabled': lock_profiler.enabled, 'locks': lock_profiler.report(n)})
+
+
+@require_login
+def startup_json(request):
+    """
+        System startup report (see :class:`~automate.startup.StartupReport`). GET parameter
+        ``n`` gives the number of slowest objects that are listed (default 10).
+    """
+    try:
+        n = int(request.GET.get('n') or 10)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid n')
+    return JsonResponse(service.system.startup_report.as_dict(n))
 
 
 @require_login
@@ -268,9 +367,12 @@ def info_panel(request, name):
         textform = TextForm({'status': obj.status, 'name': obj.name},
                             source=source) if obj.data_type in ['str', 'unicode'] else None
 
+        triggered_programs = service.system.get_triggered_programs(obj)
+
         return render(request, 'info_panel.html',
                       {'i': obj, 'source': source, 'info_items': info_items,
-                       'callables': callables, 'textform': textform})
+                       'callables': callables, 'textform': textform,
+                       'triggered_programs': triggered_programs})
     else:
         raise Http404
 
@@ -390,6 +492,10 @@ def new(request, type):
 
 @require_login
 def console(request):
+    """
+        Log console. Optional GET parameters: ``lines`` (default 100), ``level`` (name or number,
+        for example ``WARNING``) and ``name`` (part of logger name, for example ``ArduinoService``).
+    """
     textarea = False
     if request.method == 'POST':
         cmdform = CmdForm(request.POST, textarea=True)
@@ -403,7 +509,16 @@ def console(request):
         textarea = request.GET.get('textarea', False)
         cmdform = CmdForm(textarea=textarea)
 
-    log = mark_safe(service.system.request_service('LogStoreService').lastlog(lines=100))
+    try:
+        lines = int(request.GET.get('lines') or 100)
+        level = request.GET.get('level') or logging.NOTSET
+        level = int(level) if str(level).isdigit() else logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            raise ValueError(level)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid lines or level')
+    log = mark_safe(service.system.request_service('LogStoreService').lastlog(
+        lines=lines, level=level, name=request.GET.get('name') or None))
     return render(request, 'views/console.html', dict(log=log, cmdform=cmdform, textarea=textarea))
 
 
@@ -452,7 +567,7 @@ def reload_service(request, id_):
 def cancel_thread(request, id_):
     id_ = int(id_)
     found = False
-    for t in threading.enumerate():
+    for t in threading.enumerate() + service.system.scheduler.pending:
         if id(t) == id_:
             found = True
             try:
@@ -79,7 +79,8 @@ function plot(object_name) {
         plotters[object_name].push(plot);
     }
 
-    $.getJSON("/history.json/object/" + object_name, function(data_points) {
+    var max_points = Math.max(Math.round(targets.width() || 0), 100);
+    $.getJSON("/history.json/object/" + object_name, {max_points: max_points}, function(data_points) {
         plot_data[object_name] = data_points;
         $.each(plotters[object_name], function(i, plotter) {
             plotter.setData(get_data(data_points));
@@ -146,6 +147,7 @@ function object_status_changed(obj)
         }
     }
 
+    status_element.toggleClass('status_quarantined', Boolean(obj['quarantined']));
     status_element.html(status_str);
     $(':input[name="name"][value="' + name + '"]').parent().find('#id_status').val(status);
     var sliders = $('.slider_sensor_'+name);
@@ -148,10 +148,10 @@ class WebService(TornadoService):
 
         super().setup()
         if not self.slave:
-            self.system.request_service('LogStoreService').on_trait_change(self.push_log, 'most_recent_line')
+            self.system.request_service('LogStoreService').subscribe_lines(self.push_log)
 
             self.system.on_trait_change(self.update_sockets, 'objects.status, objects.changing, objects.active, '
-                                        'objects.program_status_items')
+                                        'objects.quarantined, objects.program_status_items')
 
     def get_websocket(service):
         if service.slave:
@@ -284,13 +284,14 @@ class WebService(TornadoService):
                 if obj.name in s.subscribed_objects:
                     if attribute == 'active':
                         s.write_json(action='program_active', name=obj.name, active=obj.active)
-                    elif attribute in ['status', 'changing']:
+                    elif attribute in ['status', 'changing', 'quarantined']:
                         s.write_json(action='object_status',
                                      name=obj.name,
                                      status=obj.status,
                                      time=int(1000*time.time()),
                                      display=obj.get_status_display(),
-                                     changing=obj.changing)
+                                     changing=obj.changing,
+                                     quarantined=obj.quarantined)
 
     def get_wsgi_application(self):
         from django.core.wsgi import get_wsgi_application
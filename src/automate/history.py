@@ -0,0 +1,998 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+import os
+from collections import deque, namedtuple
+import struct
+import threading
+import weakref
+from bisect import bisect_left, bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class _CopyOnWrite:
+
+    """
+        Mixin for containers that give snapshots (see :meth:`snapshot`) which share their storage.
+        Container calls :meth:`_shared` before it modifies data that may be shared with a snapshot,
+        and copies the data if it is.
+    """
+
+    # Weak reference to the latest snapshot
+    _snapshot = None
+
+    def snapshot(self):
+        """
+            Frozen copy of the container, taken in constant time. Storage is shared with the
+            container until the container modifies data that the snapshot sees, at which point
+            the container takes a copy of its own (copy-on-write).
+        """
+        rv = object.__new__(type(self))
+        rv.__dict__.update(self.__dict__)
+        rv._snapshot = None
+        self._snapshot = weakref.ref(rv)
+        return rv
+
+    def _shared(self):
+        """Is storage shared with a snapshot that is still in use"""
+        shared = self._snapshot is not None and self._snapshot() is not None
+        self._snapshot = None
+        return shared
+
+
+class NumericHistory:
+
+    """
+        Base class for histories of numeric StatusObjects. Subclasses support the parts of
+        :class:`collections.deque` interface that are used with histories (append, extend, pop, len,
+        indexing and iteration over ``(timestamp, status)`` tuples). In addition they give arrays
+        :attr:`times` and :attr:`statuses` and time based queries :meth:`bisect`, :meth:`window` and
+        :meth:`integral`.
+    """
+
+    maxlen = 0
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __repr__(self):
+        return '%s(%r, maxlen=%d)' % (self.__class__.__name__, list(self), self.maxlen)
+
+
+class ObjectHistory(_CopyOnWrite):
+
+    """
+        Status history of StatusObjects with statuses of any type (and of numeric StatusObjects,
+        if NumPy is not available). Supports the same parts of :class:`collections.deque`
+        interface as :class:`NumericHistory`, but stores timestamps and statuses in two parallel
+        lists, so that :meth:`bisect` is a binary search and :meth:`window` a slice.
+
+        Dropped entries are removed from the beginning of the lists only when their number
+        exceeds 1/4 of maxlen.
+    """
+
+    # End of entries in the lists (None: end of lists). Set in snapshots, as entries that are
+    # appended after the snapshot are in the same lists.
+    _stop = None
+
+    def __init__(self, maxlen, data=()):
+        self.maxlen = maxlen
+        self._times, self._values = [], []
+        self._start = 0
+        self.extend(data)
+
+    def snapshot(self):
+        rv = super().snapshot()
+        rv._stop = len(self._times)
+        return rv
+
+    @property
+    def times(self):
+        """List of timestamps"""
+        return self._times[self._start:self._stop]
+
+    @property
+    def statuses(self):
+        """List of statuses"""
+        return self._values[self._start:self._stop]
+
+    def bisect(self, t, side='right'):
+        """
+            Binary search in timestamps: number of entries with timestamp <= t (side='right')
+            or < t (side='left').
+        """
+        end = len(self._times) if self._stop is None else self._stop
+        return (bisect_right if side == 'right' else bisect_left)(self._times, t, self._start, end) - self._start
+
+    def window(self, t_a, t_b):
+        """Lists of timestamps and statuses of entries with t_a <= timestamp <= t_b"""
+        start, end = self._start + self.bisect(t_a, 'left'), self._start + self.bisect(t_b, 'right')
+        return self._times[start:end], self._values[start:end]
+
+    def append(self, item):
+        if not self.maxlen:
+            return
+        t, status = item
+        self._times.append(t)
+        self._values.append(status)
+        if len(self) > self.maxlen:
+            self._start += 1
+            if self._start > max(16, self.maxlen // 4):
+                # New lists, as the old ones may be shared with a snapshot
+                self._times, self._values = self._times[self._start:], self._values[self._start:]
+                self._start = 0
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def pop(self):
+        if not len(self):
+            raise IndexError('pop from an empty history')
+        if self._shared():
+            self._times, self._values = self._times[self._start:], self._values[self._start:]
+            self._start = 0
+        return self._times.pop(), self._values.pop()
+
+    def clear(self):
+        self._times, self._values = [], []
+        self._start = 0
+
+    def __len__(self):
+        return (len(self._times) if self._stop is None else self._stop) - self._start
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return list(self)[idx]
+        n = len(self)
+        if idx < 0:
+            idx += n
+        if not 0 <= idx < n:
+            raise IndexError('history index out of range')
+        idx += self._start
+        return self._times[idx], self._values[idx]
+
+    def __iter__(self):
+        return zip(self.times, self.statuses)
+
+    def __reversed__(self):
+        return zip(reversed(self.times), reversed(self.statuses))
+
+    def __repr__(self):
+        return '%s(%r, maxlen=%d)' % (self.__class__.__name__, list(self), self.maxlen)
+
+    def __getstate__(self):
+        return {'maxlen': self.maxlen, 'times': self.times, 'statuses': self.statuses}
+
+    def __setstate__(self, state):
+        self.maxlen = state['maxlen']
+        self._times, self._values = list(state['times']), list(state['statuses'])
+        self._start = 0
+
+
+class RingHistory(_CopyOnWrite, NumericHistory):
+
+    """
+        Status history of numeric StatusObjects. Stores (timestamp, status) pairs in preallocated
+        NumPy arrays (float64 timestamps and a value column of given dtype), i.e. 16 bytes per entry,
+        plus float64 running integral of the status (see :meth:`integral`).
+
+        Arrays :attr:`times` and :attr:`statuses` are read-only views to the buffer, i.e. they are
+        given without copying.
+
+        To keep the views contiguous, entries are moved to the beginning of the buffer when its end is
+        reached. Buffer has some extra space (1/4 of maxlen) so that this happens only seldom.
+
+        :meth:`snapshot` shares the buffer: appends write after the entries of the snapshot, and
+        the buffer is copied before entries are moved or overwritten.
+    """
+
+    def __init__(self, maxlen, dtype='float64', data=()):
+        self.maxlen = maxlen
+        self._allocate(dtype)
+        self.extend(data)
+
+    def _allocate(self, dtype):
+        capacity = self.maxlen + max(16, self.maxlen // 4)
+        self._times = np.empty(capacity, dtype='float64')
+        self._values = np.empty(capacity, dtype=dtype)
+        # _cumulative[i] is integral of status from the first entry to _times[i]
+        self._cumulative = np.empty(capacity, dtype='float64')
+        self._start = self._end = 0
+
+    @property
+    def times(self):
+        """Array of timestamps (read-only view)"""
+        view = self._times[self._start:self._end]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def statuses(self):
+        """Array of statuses (read-only view)"""
+        view = self._values[self._start:self._end]
+        view.flags.writeable = False
+        return view
+
+    def bisect(self, t, side='right'):
+        """
+            Binary search in timestamps: number of entries with timestamp <= t (side='right')
+            or < t (side='left').
+        """
+        return int(np.searchsorted(self.times, t, side))
+
+    def window(self, t_a, t_b):
+        """Views of timestamps and statuses of entries with t_a <= timestamp <= t_b"""
+        start, end = self.bisect(t_a, 'left'), self.bisect(t_b, 'right')
+        return self.times[start:end], self.statuses[start:end]
+
+    def integral(self, t_a, t_b):
+        """
+            Integral of status (step function; 0 before the first entry) from t_a to t_b.
+            Two binary searches and a lookup to the running integral, independent of the
+            number of entries in between.
+        """
+        i_a, i_b = self.bisect(t_a), self.bisect(t_b)
+        s_a = self._values[self._start + i_a - 1] if i_a else 0.
+        if i_a >= i_b:
+            return float(s_a * (t_b - t_a))
+        first, last = self._start + i_a, self._start + i_b - 1
+        return float(s_a * (self._times[first] - t_a)
+                     + self._cumulative[last] - self._cumulative[first]
+                     + self._values[last] * (t_b - self._times[last]))
+
+    def _detach(self):
+        # Copy the buffer if it is shared with a snapshot
+        if self._shared():
+            self._times, self._values, self._cumulative = (self._times.copy(), self._values.copy(),
+                                                          self._cumulative.copy())
+
+    def append(self, item):
+        if not self.maxlen:
+            return
+        if self._end == len(self._times):
+            self._detach()
+            n = self._end - self._start
+            self._times[:n] = self._times[self._start:self._end]
+            self._values[:n] = self._values[self._start:self._end]
+            self._cumulative[:n] = self._cumulative[self._start:self._end] - self._cumulative[self._start]
+            self._start, self._end = 0, n
+        t, status = item
+        self._values[self._end] = status
+        self._times[self._end] = t
+        if self._end > self._start:
+            prev = self._end - 1
+            self._cumulative[self._end] = (self._cumulative[prev]
+                                           + self._values[prev] * (t - self._times[prev]))
+        else:
+            self._cumulative[self._end] = 0.
+        self._end += 1
+        if self._end - self._start > self.maxlen:
+            self._start += 1
+
+    def pop(self):
+        if not len(self):
+            raise IndexError('pop from an empty history')
+        self._detach()
+        self._end -= 1
+        return self._times[self._end].item(), self._values[self._end].item()
+
+    def clear(self):
+        self._detach()
+        self._start = self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return list(self)[idx]
+        n = len(self)
+        if idx < 0:
+            idx += n
+        if not 0 <= idx < n:
+            raise IndexError('history index out of range')
+        idx += self._start
+        return self._times[idx].item(), self._values[idx].item()
+
+    def __iter__(self):
+        return zip(self.times.tolist(), self.statuses.tolist())
+
+    def __reversed__(self):
+        return zip(reversed(self.times.tolist()), reversed(self.statuses.tolist()))
+
+    def __getstate__(self):
+        return {'maxlen': self.maxlen, 'dtype': self._values.dtype.str,
+                'times': self.times.copy(), 'statuses': self.statuses.copy()}
+
+    def __setstate__(self, state):
+        self.maxlen = state['maxlen']
+        self._allocate(state['dtype'])
+        n = len(state['times'])
+        self._times[:n] = state['times']
+        self._values[:n] = state['statuses']
+        self._end = n
+        if n:
+            self._cumulative[0] = 0.
+            np.cumsum(self._values[:n - 1] * np.diff(self._times[:n]), out=self._cumulative[1:n])
+
+
+_MASK64 = (1 << 64) - 1
+
+# Delta-of-delta buckets of timestamp encoding: (control bits, number of value bits)
+_DOD_BUCKETS = (('10', 7), ('110', 9), ('1110', 12), ('1111', 64))
+
+
+def _signed_bits(value, n):
+    return format(value & ((1 << n) - 1), '0%db' % n)
+
+
+def _encode_chunk(ticks, values):
+    """
+        Encode timestamps (integer ticks) with delta-of-delta encoding and float64 values
+        by XORing them with the previous value (as in Facebook's Gorilla).
+    """
+    bits = [_signed_bits(ticks[0], 64)]
+    prev_delta = 0
+    for prev, tick in zip(ticks, ticks[1:]):
+        delta = tick - prev
+        dod = delta - prev_delta
+        prev_delta = delta
+        if dod == 0:
+            bits.append('0')
+            continue
+        for control, n in _DOD_BUCKETS:
+            if -(1 << (n - 1)) <= dod < (1 << (n - 1)):
+                bits.append(control + _signed_bits(dod, n))
+                break
+
+    words = np.asarray(values, dtype='float64').view('uint64').tolist()
+    bits.append(format(words[0], '064b'))
+    prev_leading, prev_trailing = -1, -1
+    for prev, word in zip(words, words[1:]):
+        xor = prev ^ word
+        if xor == 0:
+            bits.append('0')
+            continue
+        leading = min(64 - xor.bit_length(), 31)
+        trailing = (xor & -xor).bit_length() - 1
+        if prev_leading >= 0 and leading >= prev_leading and trailing >= prev_trailing:
+            length = 64 - prev_leading - prev_trailing
+            bits.append('10' + format(xor >> prev_trailing, '0%db' % length))
+        else:
+            length = 64 - leading - trailing
+            bits.append('11' + format(leading, '05b') + format(length - 1, '06b')
+                        + format(xor >> trailing, '0%db' % length))
+            prev_leading, prev_trailing = leading, trailing
+
+    bitstring = ''.join(bits)
+    bitstring += '0' * (-len(bitstring) % 8)
+    return int(bitstring, 2).to_bytes(len(bitstring) // 8, 'big')
+
+
+def _decode_chunk(data, count):
+    """Decode chunk encoded by :func:`_encode_chunk`. Returns lists of ticks and values."""
+    bits = format(int.from_bytes(data, 'big'), '0%db' % (len(data) * 8))
+
+    def signed(value, n):
+        return value - (1 << n) if value >= 1 << (n - 1) else value
+
+    tick = signed(int(bits[:64], 2), 64)
+    pos = 64
+    ticks = [tick]
+    delta = 0
+    for i in range(count - 1):
+        if bits[pos] == '0':
+            pos += 1
+        else:
+            for control, n in _DOD_BUCKETS:
+                if bits.startswith(control, pos):
+                    pos += len(control)
+                    delta += signed(int(bits[pos:pos + n], 2), n)
+                    pos += n
+                    break
+        tick += delta
+        ticks.append(tick)
+
+    word = int(bits[pos:pos + 64], 2)
+    pos += 64
+    words = [word]
+    leading = trailing = 0
+    for i in range(count - 1):
+        if bits[pos] == '0':
+            pos += 1
+        else:
+            if bits[pos + 1] == '1':
+                leading = int(bits[pos + 2:pos + 7], 2)
+                length = int(bits[pos + 7:pos + 13], 2) + 1
+                trailing = 64 - leading - length
+                pos += 13
+            else:
+                pos += 2
+            length = 64 - leading - trailing
+            word ^= int(bits[pos:pos + length], 2) << trailing
+            pos += length
+        words.append(word)
+    return ticks, np.array(words, dtype='uint64').view('float64').tolist()
+
+
+#: Encoded chunk of CompressedHistory, with summary of its contents
+_Chunk = namedtuple('_Chunk', 'first_time last_time last_status integral count data')
+
+
+class CompressedHistory(NumericHistory):
+
+    """
+        Compressed status history of numeric StatusObjects. Entries are collected to an
+        uncompressed tail, and when it is full (``chunk_size`` entries), it is encoded into a chunk:
+        timestamps with delta-of-delta encoding, statuses by XORing float64 bits with the previous
+        status. Slowly changing statuses of regularly polled sensors take typically 1-2 bytes per
+        entry.
+
+        Timestamps are stored as integer multiples of ``resolution`` seconds (default 1 ms), i.e.
+        they are rounded. Chunks hold time range and integral of their entries, so time range
+        queries (:meth:`bisect`, :meth:`window`, :meth:`integral`) decode only the chunks at the
+        ends of the range. Oldest chunk is removed when there are more than ``maxlen`` entries
+        (entries in it are skipped until then). The two most recently decoded chunks are cached,
+        so that repeated lookups of the first entries (such as ``history[0]``) do not decode the
+        first chunk again. The last entry is held by the chunk itself.
+    """
+
+    # Cache of decoded chunks: tuples (chunk, times, values)
+    _decoded = ()
+
+    def __init__(self, maxlen, dtype='float64', data=(), chunk_size=512, resolution=0.001):
+        self.maxlen = maxlen
+        self.dtype = np.dtype(dtype).str
+        self.chunk_size = chunk_size
+        self.resolution = resolution
+        self._scale = round(1 / resolution)  # ticks per second
+        self.clear()
+        self.extend(data)
+
+    def clear(self):
+        self._chunks = []
+        self._decoded = ()
+        self._tail_ticks = []
+        self._tail_values = []
+        self._skip = 0  # Number of removed entries in the beginning of the first chunk
+        self._len = 0
+
+    @property
+    def nbytes(self):
+        """Size of encoded chunks, in bytes"""
+        return sum(len(chunk.data) for chunk in self._chunks)
+
+    def _value(self, value):
+        return int(value) if self.dtype[1] == 'i' else value
+
+    def append(self, item):
+        if not self.maxlen:
+            return
+        t, status = item
+        self._tail_ticks.append(round(t * self._scale))
+        self._tail_values.append(float(status))
+        self._len += 1
+        if len(self._tail_ticks) >= self.chunk_size:
+            self._compress_tail()
+        while self._len > self.maxlen:
+            if self._chunks:
+                self._skip += 1
+                if self._skip == self._chunks[0].count:
+                    del self._chunks[0]
+                    self._skip = 0
+            else:
+                del self._tail_ticks[0], self._tail_values[0]
+            self._len -= 1
+
+    def _compress_tail(self):
+        ticks, values = self._tail_ticks, self._tail_values
+        times = [tick / self._scale for tick in ticks]
+        integral = sum(value * (t2 - t1) for value, t1, t2 in zip(values, times, times[1:]))
+        self._chunks.append(_Chunk(times[0], times[-1], values[-1], integral, len(ticks),
+                                   _encode_chunk(ticks, values)))
+        self._tail_ticks, self._tail_values = [], []
+
+    def _pieces(self):
+        """
+            Iterate (chunk, skip) for chunks and (None, 0) for the tail.
+        """
+        for i, chunk in enumerate(self._chunks):
+            yield chunk, self._skip if i == 0 else 0
+        if self._tail_ticks:
+            yield None, 0
+
+    def _chunk_data(self, chunk):
+        # Timestamps and values of chunk (None for the tail)
+        if chunk is None:
+            return [tick / self._scale for tick in self._tail_ticks], self._tail_values
+        for cached, times, values in self._decoded:
+            if cached is chunk:
+                return times, values
+        ticks, values = _decode_chunk(chunk.data, chunk.count)
+        times = [tick / self._scale for tick in ticks]
+        self._decoded = ((chunk, times, values),) + self._decoded[:1]
+        return times, values
+
+    def _decode(self, chunk, skip=0):
+        times, values = self._chunk_data(chunk)
+        return times[skip:], values[skip:]
+
+    def pop(self):
+        if not self._len:
+            raise IndexError('pop from an empty history')
+        if not self._tail_ticks:
+            chunk = self._chunks.pop()
+            self._decoded = tuple(i for i in self._decoded if i[0] is not chunk)
+            ticks, values = _decode_chunk(chunk.data, chunk.count)
+            skip = self._skip if not self._chunks else 0
+            self._tail_ticks, self._tail_values = ticks[skip:], values[skip:]
+            if not self._chunks:
+                self._skip = 0
+        self._len -= 1
+        return self._tail_ticks.pop() / self._scale, self._value(self._tail_values.pop())
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return list(self)[idx]
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError('history index out of range')
+        if idx == self._len - 1:
+            if self._tail_ticks:
+                return self._tail_ticks[-1] / self._scale, self._value(self._tail_values[-1])
+            chunk = self._chunks[-1]
+            return chunk.last_time, self._value(chunk.last_status)
+        for chunk, skip in self._pieces():
+            count = (chunk.count if chunk else len(self._tail_ticks)) - skip
+            if idx < count:
+                if chunk is None:
+                    return self._tail_ticks[idx] / self._scale, self._value(self._tail_values[idx])
+                times, values = self._chunk_data(chunk)
+                return times[skip + idx], self._value(values[skip + idx])
+            idx -= count
+
+    def __iter__(self):
+        for chunk, skip in self._pieces():
+            times, values = self._decode(chunk, skip)
+            yield from zip(times, map(self._value, values))
+
+    def __reversed__(self):
+        for chunk, skip in reversed(list(self._pieces())):
+            times, values = self._decode(chunk, skip)
+            yield from zip(reversed(times), map(self._value, reversed(values)))
+
+    @property
+    def times(self):
+        """Array of timestamps. Decodes the whole history, range queries use :meth:`window`."""
+        return np.array([t for chunk, skip in self._pieces() for t in self._decode(chunk, skip)[0]],
+                        dtype='float64')
+
+    @property
+    def statuses(self):
+        """Array of statuses. Decodes the whole history, range queries use :meth:`window`."""
+        return np.array([v for chunk, skip in self._pieces() for v in self._decode(chunk, skip)[1]],
+                        dtype=self.dtype)
+
+    def bisect(self, t, side='right'):
+        """
+            Number of entries with timestamp <= t (side='right') or < t (side='left').
+        """
+        index = 0
+        for chunk, skip in self._pieces():
+            if chunk and not skip and (chunk.last_time < t or side == 'right' and chunk.last_time == t):
+                index += chunk.count
+                continue
+            times = self._decode(chunk, skip)[0]
+            found = int(np.searchsorted(times, t, side))
+            index += found
+            if found < len(times):
+                break
+        return index
+
+    def window(self, t_a, t_b):
+        """Arrays of timestamps and statuses of entries with t_a <= timestamp <= t_b"""
+        times, values = [], []
+        for chunk, skip in self._pieces():
+            if chunk and chunk.last_time < t_a:
+                continue
+            if chunk and chunk.first_time > t_b:
+                break
+            chunk_times, chunk_values = self._decode(chunk, skip)
+            start = bisect_left(chunk_times, t_a)
+            end = bisect_right(chunk_times, t_b)
+            times.extend(chunk_times[start:end])
+            values.extend(chunk_values[start:end])
+        return np.array(times, dtype='float64'), np.array(values, dtype=self.dtype)
+
+    def integral(self, t_a, t_b):
+        """
+            Integral of status (step function; 0 before the first entry) from t_a to t_b.
+            Chunks that are completely within the range are not decoded.
+        """
+        total = 0.
+        t_prev, s_prev = t_a, 0.
+        for chunk, skip in self._pieces():
+            if chunk and chunk.last_time <= t_a:
+                s_prev = chunk.last_status
+                continue
+            if chunk and chunk.first_time > t_b:
+                break
+            if chunk and not skip and t_a <= chunk.first_time and chunk.last_time <= t_b:
+                total += s_prev * (chunk.first_time - t_prev) + chunk.integral
+                t_prev, s_prev = chunk.last_time, chunk.last_status
+                continue
+            for t, s in zip(*self._decode(chunk, skip)):
+                if t <= t_a:
+                    s_prev = s
+                elif t <= t_b:
+                    total += s_prev * (t - t_prev)
+                    t_prev, s_prev = t, s
+                else:
+                    break
+        return total + s_prev * (t_b - t_prev)
+
+    def snapshot(self):
+        """
+            Frozen copy of the history. Chunks are immutable, so only the list of them and the
+            uncompressed tail are copied.
+        """
+        rv = object.__new__(type(self))
+        rv.__dict__.update(self.__getstate__())
+        return rv
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_decoded', None)
+        state['_tail_ticks'] = list(self._tail_ticks)
+        state['_tail_values'] = list(self._tail_values)
+        state['_chunks'] = list(self._chunks)
+        return state
+
+
+class RollupTier(_CopyOnWrite):
+
+    """
+        Aggregates of status history in fixed-length time buckets: number of status changes,
+        minimum, maximum and integral of status (as a step function) within each bucket.
+        Updated incrementally by :meth:`add`. At most ``length`` most recent buckets are kept.
+        Only the last bucket is modified, so :meth:`snapshot` shares the older ones.
+    """
+
+    def __init__(self, seconds, length):
+        self.seconds = seconds
+        self.length = length
+        #: Buckets: lists [start time, count, min, max, integral, time of min, time of max]
+        self.buckets = deque(maxlen=length)
+        #: True if old buckets have been dropped, i.e. tier does not cover all the history
+        self.dropped = False
+        self._last = None
+
+    @property
+    def start(self):
+        """Start time of the first bucket"""
+        return self.buckets[0][0] if self.buckets else None
+
+    def _bucket(self, t):
+        start = t - t % self.seconds
+        if not self.buckets or self.buckets[-1][0] < start:
+            if len(self.buckets) == self.length:
+                self.dropped = True
+            self.buckets.append([start, 0, float('inf'), float('-inf'), 0., start, start])
+        return self.buckets[-1]
+
+    @staticmethod
+    def _update_extrema(bucket, t, status):
+        # Minimum and maximum, with the time when status first reached them
+        if status < bucket[2]:
+            bucket[2], bucket[5] = status, t
+        if status > bucket[3]:
+            bucket[3], bucket[6] = status, t
+
+    def _advance(self, t_from, t_to, status):
+        # Add integral of constant status from t_from to t_to
+        t_from = max(t_from, t_to - self.seconds * self.length)
+        t = t_from
+        while t < t_to:
+            bucket = self._bucket(t)
+            end = min(bucket[0] + self.seconds, t_to)
+            self._update_extrema(bucket, t, status)
+            bucket[4] += status * (end - t)
+            t = end
+
+    def add(self, t, status):
+        """Add status change at time t"""
+        if self._shared():
+            self.buckets = deque(self.buckets, maxlen=self.length)
+            if self.buckets:
+                self.buckets[-1] = list(self.buckets[-1])
+        if self._last is not None:
+            t_prev, s_prev = self._last
+            self._advance(t_prev, t, s_prev)
+        bucket = self._bucket(t)
+        if self._last is None or t > self._last[0]:
+            bucket[1] += 1
+        self._update_extrema(bucket, t, status)
+        self._last = t, status
+
+    def _covered(self, bucket):
+        # Time range of bucket that integral has been accumulated for
+        end = bucket[0] + self.seconds
+        if bucket is self.buckets[-1] and self._last:
+            end = min(end, self._last[0])
+        return bucket[0], end
+
+    def integral(self, t_a, t_b):
+        """
+            Integral of status from t_a to t_b. Within buckets that are partially in the range,
+            status is taken as the bucket mean.
+        """
+        total = 0.
+        for bucket in self.buckets:
+            start, end = self._covered(bucket)
+            if end <= t_a:
+                continue
+            if start >= t_b:
+                break
+            if end > start:
+                overlap = min(end, t_b) - max(start, t_a)
+                total += bucket[4] * overlap / (end - start)
+        if self._last and t_b > self._last[0]:
+            t_last, s_last = self._last
+            total += s_last * (t_b - max(t_last, t_a))
+        return total
+
+    def _overlapping(self, t_a, t_b):
+        for bucket in self.buckets:
+            if bucket[0] + self.seconds <= t_a:
+                continue
+            if bucket[0] > t_b:
+                break
+            yield bucket
+
+    def window(self, t_a, t_b):
+        """
+            Buckets that overlap range from t_a to t_b, as tuples
+            ``(start time, count, min, max, mean)``.
+        """
+        rv = []
+        for bucket in self._overlapping(t_a, t_b):
+            start, end = self._covered(bucket)
+            mean = bucket[4] / (end - start) if end > start else bucket[3]
+            rv.append((bucket[0], bucket[1], bucket[2], bucket[3], mean))
+        return rv
+
+    def extrema(self, t_a, t_b):
+        """
+            Minimums and maximums of buckets that overlap range from t_a to t_b, as
+            ``(timestamp, status)`` pairs in the order they occurred. Timestamp is the time when
+            status first reached the value within the bucket. Buckets with constant status give
+            only one pair.
+        """
+        rv = []
+        for bucket in self._overlapping(t_a, t_b):
+            points = sorted({(bucket[5], bucket[2]), (bucket[6], bucket[3])})
+            rv.extend(points if bucket[2] != bucket[3] else points[:1])
+        return rv
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_snapshot', None)
+        state['buckets'] = deque((list(i) for i in self.buckets), maxlen=self.length)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for bucket in self.buckets:
+            if len(bucket) == 5:
+                # Saved before times of minimum and maximum were recorded
+                bucket.extend((bucket[0], bucket[0]))
+
+
+def downsample_lttb(times, values, max_points):
+    """
+        Downsample series to ``max_points`` points with Largest-Triangle-Three-Buckets algorithm,
+        which keeps the visual shape of the series. First and last points are always kept.
+    """
+    n = len(times)
+    if max_points >= n or max_points < 3:
+        return times, values
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    selected = [0]
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_t = times[edges[i + 1]:edges[i + 2]].mean()
+            next_v = values[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_t, next_v = times[-1], values[-1]
+        prev_t, prev_v = times[selected[-1]], values[selected[-1]]
+        area = np.abs((prev_t - next_t) * (values[start:end] - prev_v)
+                      - (prev_t - times[start:end]) * (next_v - prev_v))
+        selected.append(start + int(np.argmax(area)))
+    selected.append(n - 1)
+    return times[selected], values[selected]
+
+
+def downsample_minmax(times, values, max_points):
+    """
+        Downsample series to at most ``max_points`` points by keeping minimum and maximum
+        of each of ``max_points // 2`` buckets of consecutive points, in time order.
+    """
+    n = len(times)
+    if max_points >= n or max_points < 2:
+        return times, values
+    edges = np.linspace(0, n, max_points // 2 + 1).astype(int)
+    selected = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            bucket = values[start:end]
+            selected.extend(sorted({start + int(np.argmin(bucket)), start + int(np.argmax(bucket))}))
+    return times[selected], values[selected]
+
+
+#: Downsampling methods for :meth:`~automate.statusobject.StatusObject.history_points`
+DOWNSAMPLING_METHODS = {'lttb': downsample_lttb, 'minmax': downsample_minmax}
+
+
+class SegmentedSeries:
+
+    """
+        On-disk (timestamp, status) series of one object, used by
+        :class:`~automate.services.historystore.HistoryStoreService`.
+
+        Samples are appended to segment files (raw little-endian float64 pairs, 16 bytes per
+        sample) in a directory. Segment file is named by its first timestamp and a new one is
+        started after ``segment_size`` samples. Full (cold) segments are read through memory maps,
+        so only pages that queries touch are loaded in memory.
+
+        Sample with the same timestamp as the latest one replaces it (in-memory history overwrites
+        samples like that, see :attr:`~automate.statusobject.StatusObject.history_frequency`).
+    """
+
+    record = struct.Struct('<dd')
+
+    def __init__(self, directory, segment_size=100000):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(i for i in os.listdir(directory) if i.endswith('.seg'))
+        self._starts = [float(i[:-4]) for i in self._segments]
+        self._maps = {}
+        self._file = None
+        self._count = 0
+        self._last_time = None
+        while self._segments:
+            path = self._path(self._segments[-1])
+            self._count = os.path.getsize(path) // self.record.size
+            if self._count:
+                break
+            # Segment was created, but writing was interrupted before its first sample
+            os.remove(path)
+            self._segments.pop()
+            self._starts.pop()
+        if self._segments:
+            with open(path, 'rb') as file:
+                file.seek((self._count - 1) * self.record.size)
+                self._last_time = self.record.unpack(file.read(self.record.size))[0]
+            if self._count < segment_size:
+                self._file = open(path, 'ab')
+                # Drop incomplete record, if writing was interrupted
+                self._file.truncate(self._count * self.record.size)
+
+    @staticmethod
+    def _dtype():
+        return np.dtype([('time', '<f8'), ('status', '<f8')])
+
+    def _path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def append(self, t, status):
+        data = self.record.pack(t, status)
+        with self.lock:
+            if t == self._last_time:
+                # Overwrite the latest sample in place (file size is not changed, as cold
+                # segments may be memory-mapped)
+                if self._file:
+                    self._file.flush()
+                with open(self._path(self._segments[-1]), 'r+b') as file:
+                    file.seek((self._count - 1) * self.record.size)
+                    file.write(data)
+                return
+            self._last_time = t
+            if self._file is None or self._count >= self.segment_size:
+                if self._file:
+                    self._file.close()
+                segment = '%020.6f.seg' % t
+                self._segments.append(segment)
+                self._starts.append(t)
+                self._file = open(self._path(segment), 'ab')
+                self._count = 0
+            self._file.write(data)
+            self._count += 1
+
+    def close(self):
+        with self.lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+            self._maps.clear()
+
+    def _segment_data(self, index):
+        segment = self._segments[index]
+        if index == len(self._segments) - 1 and self._file:
+            # Hot segment that is still being written
+            self._file.flush()
+            return np.fromfile(self._path(segment), dtype=self._dtype())
+        data = self._maps.get(segment)
+        if data is None:
+            data = self._maps[segment] = np.memmap(self._path(segment), dtype=self._dtype(), mode='r')
+        return data
+
+    def window(self, t_a, t_b):
+        """Arrays of timestamps and statuses of samples with t_a <= timestamp <= t_b"""
+        with self.lock:
+            first = max(bisect_right(self._starts, t_a) - 1, 0)
+            last = bisect_right(self._starts, t_b)
+            parts = []
+            for index in range(first, last):
+                data = self._segment_data(index)
+                times = data['time']
+                parts.append(data[np.searchsorted(times, t_a, 'left'):np.searchsorted(times, t_b, 'right')])
+        if not parts:
+            return np.empty(0), np.empty(0)
+        data = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return data['time'], data['status']
+
+    def status_at_time(self, T):
+        with self.lock:
+            for index in range(bisect_right(self._starts, T) - 1, -1, -1):
+                data = self._segment_data(index)
+                pos = np.searchsorted(data['time'], T, 'right') - 1
+                if pos >= 0:
+                    return data['status'][pos].item()
+            return 0.
+
+    def integral(self, t_a, t_b):
+        """Integral of status (step function; 0 before the first sample) from t_a to t_b."""
+        times, statuses = self.window(t_a, t_b)
+        knots = np.concatenate(([t_a], times, [t_b]))
+        values = np.concatenate(([self.status_at_time(t_a)], statuses))
+        return float(np.dot(values, np.diff(knots)))
+
+    def __len__(self):
+        with self.lock:
+            if not self._segments:
+                return 0
+            full = sum(os.path.getsize(self._path(i)) for i in self._segments[:-1]) // self.record.size
+            return full + self._count
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+import itertools
+import logging
+import os
+import pickle
+import threading
+
+logger = logging.getLogger('automate.journal')
+
+
+class StateJournal:
+
+    """
+        Append-only journal of status changes, used with :attr:`System.state_journal`.
+
+        Each status change is appended to the journal file as a small pickled record
+        ``(name, timestamp, status)``. When :meth:`System.save_state` takes a snapshot,
+        journal is rotated (see :meth:`rotate`) and the rotated part is removed after the
+        checkpoint is written. :meth:`System.load_state_file` replays both parts on top of
+        the checkpoint.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        #: Number of records written since the last checkpoint
+        self.num_records = 0
+        self._file = open(filename, 'ab')
+
+    def record(self, name, timestamp, status):
+        data = pickle.dumps((name, timestamp, status), pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if self._file.closed:
+                return
+            self._file.write(data)
+            self._file.flush()
+            self.num_records += 1
+
+    @property
+    def rotated_filename(self):
+        return self.filename + '.old'
+
+    def rotate(self):
+        """
+            Move records written so far to :attr:`rotated_filename` and continue with an empty
+            journal. Call with :attr:`lock` held, when taking a snapshot for checkpoint.
+            If previous rotated journal still exists (its checkpoint was not written),
+            records are appended to it.
+        """
+        self._file.close()
+        if os.path.isfile(self.rotated_filename):
+            with open(self.rotated_filename, 'ab') as rotated, open(self.filename, 'rb') as current:
+                rotated.write(current.read())
+            os.remove(self.filename)
+        else:
+            os.rename(self.filename, self.rotated_filename)
+        self._file = open(self.filename, 'ab')
+        self.num_records = 0
+
+    def remove_rotated(self):
+        """Remove rotated journal. Call after checkpoint is written."""
+        try:
+            os.remove(self.rotated_filename)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        with self.lock:
+            self._file.close()
+
+    @staticmethod
+    def read(filename):
+        """
+            Iterate records of journal file. Incomplete record at the end of the file (if writing
+            was interrupted) is ignored.
+        """
+        if not os.path.isfile(filename):
+            return
+        with open(filename, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+                except (pickle.UnpicklingError, ValueError, AttributeError, IndexError) as e:
+                    logger.warning('Journal %s ends with incomplete record (%s), ignoring it', filename, e)
+                    return
+
+    @staticmethod
+    def replay(filename, obj_list, config):
+        """
+            Apply journal records (rotated journal first, if it exists) to objects loaded
+            from checkpoint and to config dictionary.
+        """
+        # Objects loaded from dump are not yet initialized: their traits are
+        # in the state dictionary (see SystemObject.__setstate__)
+        states = {}
+        for obj in obj_list:
+            name, state = obj._passed_arguments
+            states[state.get('name')] = state
+        count = 0
+        records = itertools.chain(StateJournal.read(filename + '.old'), StateJournal.read(filename))
+        for name, timestamp, status in records:
+            count += 1
+            if name in config:
+                config[name] = status
+            state = states.get(name)
+            if state is None:
+                continue
+            state['_status'] = status
+            state['_last_changed'] = timestamp
+            history = state.get('history')
+            if history is not None and status is not None:
+                if history and history[-1][0] == timestamp:
+                    history.pop()
+                history.append((timestamp, status))
+        if count:
+            logger.info('Replayed %d status changes from journal %s', count, filename)
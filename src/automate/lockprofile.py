@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+import bisect
+import os
+import threading
+import traceback
+
+
+class LockStats:
+
+    """
+        Contention statistics of locks with the same name
+    """
+
+    def __init__(self, name, num_buckets):
+        self.name = name
+        #: Number of contended acquisitions
+        self.count = 0
+        #: Total and maximum wait time, in seconds
+        self.total = 0.
+        self.max = 0.
+        #: Number of waits per bucket of :attr:`LockProfiler.buckets`
+        self.histogram = [0] * num_buckets
+        #: Sampled stacks of waiting threads, mapped to [number of samples, total wait time]
+        self.waiters = {}
+
+    def top_waiters(self, n=5):
+        return sorted(self.waiters.items(), key=lambda i: i[1][1], reverse=True)[:n]
+
+
+class LockProfiler:
+
+    """
+        Contention profiler of :class:`~automate.common.Lock` objects, available as
+        ``automate.lockprofile.lock_profiler``.
+
+        When enabled, each acquisition that has to wait records its wait time in a histogram
+        per lock name, and stack of the waiting thread is sampled on every
+        :attr:`sample_interval`'th contention. Uncontended acquisitions are not recorded, so
+        profiling has no cost unless locks are contended. Enabled by
+        :attr:`System.lock_profiling <automate.system.System.lock_profiling>`.
+    """
+
+    #: Upper bounds (in seconds) of wait time histogram buckets. Last bucket is unbounded.
+    buckets = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.)
+
+    def __init__(self, sample_interval=1, stack_depth=4):
+        #: Is profiling enabled
+        self.enabled = False
+        #: Stack of the waiting thread is sampled on every sample_interval'th contention of a lock
+        self.sample_interval = sample_interval
+        #: Number of frames in sampled stacks
+        self.stack_depth = stack_depth
+        #: :class:`LockStats` by lock name
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def enable(self, sample_interval=None):
+        if sample_interval is not None:
+            self.sample_interval = max(1, sample_interval)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def record(self, name, wait, frame=None):
+        """
+            Record a contended acquisition of lock ``name`` that waited ``wait`` seconds.
+            ``frame`` is the frame of the waiting code, used when stack is sampled.
+        """
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = LockStats(name, len(self.buckets) + 1)
+            stats.count += 1
+            stats.total += wait
+            stats.max = max(stats.max, wait)
+            stats.histogram[bisect.bisect_left(self.buckets, wait)] += 1
+            if frame is None or stats.count % self.sample_interval:
+                return
+        stack = tuple('%s:%d %s' % (os.path.basename(f.filename), f.lineno, f.name)
+                      for f in traceback.extract_stack(frame, limit=self.stack_depth))
+        with self._lock:
+            waiter = stats.waiters.setdefault(stack, [0, 0.])
+            waiter[0] += 1
+            waiter[1] += wait
+
+    def report(self, n=5):
+        """
+            Statistics of all contended locks, sorted by total wait time, as a list of dictionaries
+            (JSON serializable). ``n`` gives the number of top waiters listed per lock.
+        """
+        with self._lock:
+            stats = sorted(self.stats.values(), key=lambda s: s.total, reverse=True)
+            return [{'name': s.name,
+                     'count': s.count,
+                     'total': s.total,
+                     'max': s.max,
+                     'histogram': list(zip(self.buckets + (None,), s.histogram)),
+                     'waiters': [{'stack': list(stack), 'count': count, 'total': total}
+                                 for stack, (count, total) in s.top_waiters(n)]}
+                    for s in stats]
+
+    def format(self, n=5):
+        """
+            Report as text
+        """
+        lines = []
+        for lock in self.report(n):
+            lines.append('%s: %d waits, total %.6f s, max %.6f s' % (lock['name'], lock['count'],
+                                                                       lock['total'], lock['max']))
+            lines.append('  ' + '  '.join('%s: %d' % ('<%gs' % bound if bound else 'more', count)
+                                          for bound, count in lock['histogram']))
+            for waiter in lock['waiters']:
+                lines.append('  %d waits, %.6f s:' % (waiter['count'], waiter['total']))
+                lines.extend('    ' + frame for frame in waiter['stack'])
+        return '\n'.join(lines) if lines else 'No lock contention recorded'
+
+
+lock_profiler = LockProfiler()
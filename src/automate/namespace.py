@@ -57,10 +57,12 @@ class Namespace(dict):
         return objs
 
     def set_system(self, load_state=None):
-        if load_state:
-            objs = [(i._passed_arguments[1]['name'], i, []) for i in load_state]
-        else:
-            objs = self.give_systemobjects(self.system)
+        report = self.system.startup_report
+        with report.phase('collect objects'):
+            if load_state:
+                objs = [(i._passed_arguments[1]['name'], i, []) for i in load_state]
+            else:
+                objs = self.give_systemobjects(self.system)
 
         def order(x):
             if isinstance(x[1], AbstractCallable):
@@ -76,27 +78,31 @@ class Namespace(dict):
 
         self.system.logger.info('Setup obj.system and names in namespace')
 
-        for name, obj, groups in objs:
-            obj.system = self.system
-            if name in self:
-                raise NameError('%s already in namespace!' % name)
-            self[name] = obj
+        with report.phase('names'):
+            for name, obj, groups in objs:
+                obj.system = self.system
+                if name in self:
+                    raise NameError('%s already in namespace!' % name)
+                self[name] = obj
 
         self.logger.info('Set up system and groups into object tags')
-        for name, obj, groups in objs:
-            obj.setup_system(self.system, name, load_state=load_state)
-
-            if not load_state:
-                is_groups = False
-                for g in groups:
-                    obj.tags.add(g)
-                    if g.startswith('group:'):
-                        is_groups = True
-                if not is_groups:
-                    obj.tags.add('group:root')
+        with report.phase('setup_system'):
+            for name, obj, groups in objs:
+                with report.time_object('setup_system', name):
+                    obj.setup_system(self.system, name, load_state=load_state)
+
+                if not load_state:
+                    is_groups = False
+                    for g in groups:
+                        obj.tags.add(g)
+                        if g.startswith('group:'):
+                            is_groups = True
+                    if not is_groups:
+                        obj.tags.add('group:root')
 
         # flush, so that sensor default initial statuses are up to date
-        self.system.worker_thread.manual_flush()
+        with report.phase('initial flush'):
+            self.system.manual_flush()
 
         self.system.logger.info('Setup callables. This activates program features.')
 
@@ -111,8 +117,10 @@ class Namespace(dict):
 
         objs.sort(key=order, reverse=True)
 
-        for name, obj, groups in objs:
-            obj.setup_callables()
+        with report.phase('setup_callables'), self.system.bulk_wiring():
+            for name, obj, groups in objs:
+                with report.time_object('setup_callables', name):
+                    obj.setup_callables()
 
     def __repr__(self):
         return "%s(%s)" % (type(self).__name__, super().__repr__())
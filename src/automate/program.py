@@ -90,14 +90,23 @@ class ProgrammableSystemObject(SystemObject):
 
     _trigger_lock = Instance(Lock, transient=True)
 
+    # Triggers that have changed since each condition was evaluated last time (None: not known,
+    # condition needs to be evaluated completely). Used in incremental evaluation of conditions.
+    _changed_triggers = Instance(dict, transient=True)
+
     def __init__(self, *args, **kwargs):
         self._trigger_lock = Lock('triggerlock')
+        self._reset_changed_triggers()
         super().__init__(*args, **kwargs)
 
     def __setstate__(self, *args, **kwargs):
         self._trigger_lock = Lock('triggerlock')
+        self._reset_changed_triggers()
         return super().__setstate__(*args, **kwargs)
 
+    def _reset_changed_triggers(self):
+        self._changed_triggers = {'active_condition': None, 'update_condition': None}
+
     #: (read-only property) Set of triggers, that cause this Program conditions to be checked
     #: (and actions to be executed). This data is updated from custom triggers list, conditions and actions.
     actual_triggers = Property(trait=CSet(trait=Instance(AbstractStatusObject)),
@@ -180,14 +189,13 @@ class ProgrammableSystemObject(SystemObject):
         if old == new:
             return
         self.logger.debug('Actual triggers changed by %s: %s->%s', name, old, new)
-        for t in old - new:
-            self.logger.debug("Removing trigger %s", t)
-            t.on_trait_change(self.trigger_status_changed, "status", remove=True)
-
-        for t in new - old:
-            self.logger.debug("Adding trigger %s", t)
-            t.on_trait_change(self.trigger_status_changed, "status")
+        if self.system.defer_program(self, old_triggers=old):
+            return
+        # Status changes of triggers are dispatched to trigger_status_changed by System
+        self.system.update_trigger_index(self, old - new, new - old)
 
+        self._reset_changed_triggers()
+        self.system.link_worker_shards(self, new - old)
         old_active = self.active
         self.active = bool(self.active_condition.call(self))
         if self.active != old_active:
@@ -200,6 +208,10 @@ class ProgrammableSystemObject(SystemObject):
         if old is None:
             old = set()
         self.logger.debug('Actual targets changed %s->%s', old, new)
+        if self.system.defer_program(self, old_targets=old):
+            return
+        self.system.update_target_index(self, old - new, new - old)
+        self.system.link_worker_shards(self, new - old)
         old_active = self.active
         new_active = self.active = bool(self.active_condition.call(self))
         if new_active != old_active:
@@ -216,12 +228,7 @@ class ProgrammableSystemObject(SystemObject):
         if new_active:
             for t in self.actual_targets:
                 t.activate_program(self)
-            self.on_activate.setup_callable_system(self.system)
-            self.on_activate.call(self, trigger=trigger, action='activate')
-            if bool(self.update_condition.call(self, trigger=trigger)):
-                self.on_update.setup_callable_system(self.system)
-                self.on_update.cancel(self)
-                self.on_update.call(self, trigger=trigger, action='update')
+            self.run_activation_actions(trigger)
         else:
             self.on_deactivate.setup_callable_system(self.system)
             self.on_deactivate.call(self, trigger=trigger, action='deactivate')
@@ -230,23 +237,58 @@ class ProgrammableSystemObject(SystemObject):
             for t in self.actual_targets:
                 t.deactivate_program(self)
 
+    def run_activation_actions(self, trigger=None):
+        """
+            Run on_activate action and, if update_condition is ``True``, on_update action.
+            Called when program has been activated and pushed to the program stacks of its targets.
+        """
+        self.on_activate.setup_callable_system(self.system)
+        self.on_activate.call(self, trigger=trigger, action='activate')
+        if bool(self.update_condition.call(self, trigger=trigger)):
+            self.on_update.setup_callable_system(self.system)
+            self.on_update.cancel(self)
+            self.on_update.call(self, trigger=trigger, action='update')
+
     def trigger_status_changed(self, obj, name, old, new):
         self.logger.debug("Trigger status changed from %s %s: %s->%s", obj, name, old, new)
+        for changed in self._changed_triggers.values():
+            if changed is not None:
+                changed.add(obj)
+        if self.system.get_worker(self).defer_trigger(self, obj):
+            self.logger.debug("Evaluation deferred to the end of worker batch")
+            return
+        self.evaluate_conditions(obj)
+
+    def evaluate_conditions(self, trigger=None):
+        """
+            Evaluate active and update conditions and run actions accordingly. Called when
+            status of a trigger has changed. Conditions are evaluated with their compiled form
+            (see :attr:`~automate.callable.AbstractCallable.compiled`), and only the parts that
+            depend on changed triggers are re-evaluated (see
+            :meth:`~automate.callables.builtin_callables.AbstractLogical.compile_counting`).
+        """
         with self._trigger_lock:
             old_active = self.active
-            new_active = self.active = bool(self.active_condition.call(self, trigger=obj))
+            new_active = self.active = self._evaluate_condition('active_condition', trigger)
             if new_active != old_active:
-                self.update_activation(new_active, trigger=obj)
+                self.update_activation(new_active, trigger=trigger)
             if old_active == new_active == True:
-                if bool(self.update_condition.call(self, trigger=obj)):
+                if self._evaluate_condition('update_condition', trigger):
                     self.on_update.cancel(self)
-                    self.on_update.call(self, trigger=obj, action='update')
+                    self.on_update.call(self, trigger=trigger, action='update')
         self.logger.debug("Trigger status changing ready")
 
+    def _evaluate_condition(self, name, trigger):
+        changed = self._changed_triggers[name]
+        self._changed_triggers[name] = set()
+        return bool(getattr(self, name).compiled(self, trigger=trigger, changed_triggers=changed))
+
     @on_trait_change("active_condition, on_activate, on_deactivate")
     def _update_activation_actions(self, name, new):
         self.logger.debug('Update activation actions %s', name)
         getattr(self, name).setup_callable_system(self.system)
+        if self.system.defer_program(self):
+            return
 
         if name == 'active_condition':
             old_active = self.active
@@ -262,6 +304,8 @@ class ProgrammableSystemObject(SystemObject):
     def _update_update_actions(self, name, new):
         self.logger.debug('Update update actions %s', name)
         getattr(self, name).setup_callable_system(self.system)
+        if self.system.defer_program(self, update=True):
+            return
 
         if self.active and bool(self.update_condition.call(self)):
             self.on_update.cancel(self)
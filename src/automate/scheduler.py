@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+import datetime
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+from .common import threaded
+
+
+class ScheduledCall:
+
+    """
+        Cancellable handle of a delayed function call. Interface is compatible with
+        :class:`threading.Timer` (:meth:`.start`, :meth:`.cancel`, :meth:`.is_alive`),
+        but no thread is reserved while waiting.
+    """
+
+    PENDING, RUNNING, DONE, CANCELLED = range(4)
+
+    def __init__(self, scheduler, interval, function, args=None, kwargs=None, name='',
+                 dedicated_thread=False):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.function = function
+        self.args = args if args is not None else ()
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.name = name or 'ScheduledCall for %s' % getattr(function, '__name__', function)
+        self.dedicated_thread = dedicated_thread
+        self.when = None
+        self.next_action = None
+        self._state = None
+        self._seq = None
+
+    def start(self):
+        self.scheduler._add(self)
+        return self
+
+    def cancel(self):
+        return self.scheduler._cancel(self)
+
+    @property
+    def cancelled(self):
+        return self._state == self.CANCELLED
+
+    def is_alive(self):
+        return self._state in (self.PENDING, self.RUNNING)
+
+    def run(self):
+        threaded(self.scheduler.system, self.function, *self.args, **self.kwargs)()
+
+    def __lt__(self, other):
+        return (self.when, self._seq) < (other.when, other._seq)
+
+    def __repr__(self):
+        return '<ScheduledCall %s at %s>' % (self.name, self.next_action)
+
+
+class Scheduler:
+
+    """
+        System-wide timer service. Delayed calls are kept in a heap that is
+        driven by a single thread. Due calls are executed by a small pool of
+        executor threads (or in a thread of their own, if ``dedicated_thread`` is
+        requested for long-running calls).
+    """
+
+    #: Cancelled entries are removed from heap lazily. Heap is compacted when at least
+    #: this many of them have been accumulated (and they are majority of the heap).
+    compact_threshold = 100
+
+    def __init__(self, system, num_threads=8):
+        self.system = system
+        self.logger = system.logger.getChild('Scheduler')
+        self.num_threads = num_threads
+        self._heap = []
+        self._num_cancelled = 0
+        self._counter = itertools.count()
+        self._cond = threading.Condition(threading.Lock())
+        self._jobs = queue.Queue()
+        self._stop_now = False
+        self._started = False
+        self._thread = None
+        self._executors = []
+
+    def timer(self, interval, function, args=None, kwargs=None, name='', dedicated_thread=False):
+        """
+            Create a :class:`.ScheduledCall` that is not yet started (like :class:`threading.Timer`).
+        """
+        return ScheduledCall(self, interval, function, args, kwargs, name, dedicated_thread)
+
+    def call_later(self, interval, function, args=None, kwargs=None, name='', dedicated_thread=False):
+        """
+            Schedule ``function(*args, **kwargs)`` to be called after ``interval`` seconds.
+            Returns cancellable :class:`.ScheduledCall` handle.
+        """
+        return self.timer(interval, function, args, kwargs, name, dedicated_thread).start()
+
+    @property
+    def pending(self):
+        """
+            Sorted list of calls that are waiting for their time.
+        """
+        with self._cond:
+            return sorted(i for i in self._heap if i._state == ScheduledCall.PENDING)
+
+    def start(self):
+        self._started = True
+        for i in range(self.num_threads):
+            t = threading.Thread(target=self._executor_loop, name='Scheduler executor %d' % (i + 1))
+            t.daemon = True
+            t.start()
+            self._executors.append(t)
+        self._thread = threading.Thread(target=self._scheduler_loop, name='Scheduler thread')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def cancel_all(self):
+        with self._cond:
+            for call in self._heap:
+                if call._state == ScheduledCall.PENDING:
+                    call._state = ScheduledCall.CANCELLED
+            self._heap.clear()
+            self._num_cancelled = 0
+            self._cond.notify()
+        self.logger.debug('All scheduled calls cancelled')
+
+    def stop(self):
+        self.logger.debug('Stopping scheduler')
+        with self._cond:
+            self._stop_now = True
+            self._cond.notify()
+        self.cancel_all()
+        for i in self._executors:
+            self._jobs.put(None)
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.logger.debug('Scheduler stopped')
+
+    def _add(self, call):
+        with self._cond:
+            if self._stop_now:
+                self.logger.debug('Scheduler stopped, not scheduling %s', call.name)
+                call._state = ScheduledCall.CANCELLED
+                return
+            call.when = time.monotonic() + call.interval
+            call.next_action = datetime.datetime.now() + datetime.timedelta(seconds=call.interval)
+            call._seq = next(self._counter)
+            call._state = ScheduledCall.PENDING
+            heapq.heappush(self._heap, call)
+            if self._heap[0] is call:
+                self._cond.notify()
+
+    def _cancel(self, call):
+        with self._cond:
+            if call._state != ScheduledCall.PENDING:
+                return False
+            call._state = ScheduledCall.CANCELLED
+            self._num_cancelled += 1
+            if (self._num_cancelled > self.compact_threshold
+                    and self._num_cancelled > len(self._heap) // 2):
+                self._heap = [i for i in self._heap if i._state != ScheduledCall.CANCELLED]
+                heapq.heapify(self._heap)
+                self._num_cancelled = 0
+            return True
+
+    def _scheduler_loop(self):
+        self.logger.debug('Scheduler thread starting')
+        with self._cond:
+            while not self._stop_now:
+                now = time.monotonic()
+                while self._heap and self._heap[0].when <= now:
+                    call = heapq.heappop(self._heap)
+                    if call._state == ScheduledCall.CANCELLED:
+                        self._num_cancelled = max(0, self._num_cancelled - 1)
+                        continue
+                    self._dispatch(call)
+                timeout = self._heap[0].when - now if self._heap else None
+                self._cond.wait(timeout)
+        self.logger.debug('Scheduler thread exiting')
+
+    def _dispatch(self, call):
+        if call.dedicated_thread:
+            call._state = ScheduledCall.RUNNING
+            t = threading.Thread(target=self._run_call, args=(call,), name=call.name)
+            t.start()
+        else:
+            self._jobs.put(call)
+
+    def _run_call(self, call):
+        try:
+            call.run()
+        finally:
+            call._state = ScheduledCall.DONE
+
+    def _executor_loop(self):
+        while True:
+            call = self._jobs.get()
+            if call is None:
+                break
+            with self._cond:
+                if call._state != ScheduledCall.PENDING:
+                    continue
+                call._state = ScheduledCall.RUNNING
+            self._run_call(call)
@@ -39,7 +39,7 @@ from croniter import croniter
 from traits.api import Any, CInt, CFloat, Unicode, CUnicode, CBool, Instance, CStr, Int, Property
 
 from automate.common import get_modules_all, LogicStr
-from automate.common import threaded, Lock
+from automate.common import Lock
 from automate.statusobject import AbstractSensor
 from automate.callables import Value
 from automate.callable import AbstractCallable
@@ -220,9 +220,9 @@ class CronTimerSensor(AbstractSensor):
 
         delay = next_update_time - now + timedelta(seconds=5)
         self.logger.info('Setting timer to %s, %s seconds, at %s', delay, delay.seconds, now+delay)
-        self._update_timer = threading.Timer(delay.seconds, threaded(self.system, self.update_status,))
-        self._update_timer.name = ("Timer for TimerSensor %s at %s (%s seconds)" % (self.name, now + delay, delay.seconds))
-        self._update_timer.start()
+        self._update_timer = self.system.scheduler.call_later(
+            delay.seconds, self.update_status,
+            name="Timer for TimerSensor %s at %s (%s seconds)" % (self.name, now + delay, delay.seconds))
 
     def cleanup(self):
         with self._timerlock:
@@ -305,10 +305,10 @@ class AbstractPollingSensor(AbstractSensor):
             self._pollthread.cancel()
         if self.poll_active:
             self.update_status()
-            self._pollthread = threading.Timer(self.interval, threaded(self.system, self._restart))
             time_after_interval = datetime.now() + timedelta(seconds=self.interval)
-            self._pollthread.name = "PollingSensor: %s next poll at %s (%.2f sek)" % (self.name, time_after_interval, self.interval)
-            self._pollthread.start()
+            self._pollthread = self.system.scheduler.call_later(
+                self.interval, self._restart,
+                name="PollingSensor: %s next poll at %s (%.2f sek)" % (self.name, time_after_interval, self.interval))
 
     def update_status(self):
         pass
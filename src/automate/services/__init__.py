@@ -25,3 +25,7 @@ from .logstore import LogStoreService
 from .statussaver import StatusSaverService
 from .textui import TextUIService
 from .plantumlserv import PlantUMLService
+from .historystore import HistoryStoreService
+
+from ..extensions import extension_getattr as _extension_getattr
+__getattr__ = _extension_getattr(__name__)
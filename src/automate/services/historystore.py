@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+import os
+
+from traits.api import CInt, Str, List
+
+from automate.service import AbstractUserService
+from automate.history import NumericHistory, SegmentedSeries, np
+
+__all__ = ['HistoryStoreService']
+
+
+class HistoryStoreService(AbstractUserService):
+
+    """
+        Stores status history of numeric StatusObjects on disk, in segmented append-only files
+        (one directory per object, see :class:`~automate.history.SegmentedSeries`).
+
+        In-memory :attr:`~automate.statusobject.StatusObject.history` (limited by history_length)
+        works as the hot tail. :meth:`~automate.statusobject.StatusObject.status_at_time`,
+        :meth:`~automate.statusobject.StatusObject.integral` and
+        :meth:`~automate.statusobject.StatusObject.history_window` read from the store when the
+        requested time is older than the in-memory history. Requires NumPy.
+    """
+
+    #: Directory where history is stored. Default: System.filename + '.history'
+    directory = Str
+
+    #: Number of samples per segment file
+    segment_size = CInt(100000)
+
+    _stored_objects = List(transient=True)
+
+    def setup(self):
+        if np is None:
+            raise RuntimeError('HistoryStoreService requires NumPy')
+        if not self.directory:
+            if not self.system.filename:
+                raise RuntimeError('HistoryStoreService needs either directory or System.filename')
+            self.directory = self.system.filename + '.history'
+        for obj in self.system.objects_sorted:
+            if isinstance(getattr(obj, 'history', None), NumericHistory):
+                obj.history_store = SegmentedSeries(os.path.join(self.directory, obj.name), self.segment_size)
+                self._stored_objects.append(obj)
+        self.logger.info('Storing history of %d objects in %s', len(self._stored_objects), self.directory)
+
+    def cleanup(self):
+        for obj in self._stored_objects:
+            store, obj.history_store = obj.history_store, None
+            if store:
+                store.close()
+        self._stored_objects = []
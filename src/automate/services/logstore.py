@@ -21,16 +21,113 @@
 # If you like Automate, please take a look at this page:
 # http://evankelista.net/automate/
 
+import heapq
 import logging
-import logging.handlers
+from collections import defaultdict, deque
 
-from traits.api import Any, Int, Str, Unicode
+from traits.api import Any, Dict, Int, Str, Unicode
 from colorlog import ColoredFormatter
 import ansiconv
 
 from automate.service import AbstractUserService
 
-__all__ = ['LogStoreService']
+__all__ = ['LogStoreService', 'LogRing']
+
+
+class LogRing(logging.Handler):
+
+    """
+        Logging handler that keeps the latest ``capacity`` records in a ring buffer, with indices
+        by level and by logger name, so that for example latest warnings of a service can be
+        found without scanning the whole buffer. Records are rendered only when requested, and
+        rendered lines are cached per record.
+    """
+
+    def __init__(self, capacity):
+        super().__init__()
+        self.capacity = capacity
+        self._records = [None] * capacity
+        # Number of records added so far. Record number i is in slot i % capacity.
+        self._count = 0
+        # Numbers of records in the buffer, by level and by logger name
+        self._by_level = defaultdict(deque)
+        self._by_name = defaultdict(deque)
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def emit(self, record):
+        num = self._count
+        slot = num % self.capacity
+        old = self._records[slot]
+        if old is not None:
+            # Oldest record is first in its indices
+            self._pop_index(self._by_level, old.levelno)
+            self._pop_index(self._by_name, old.name)
+        record._rendered = {}
+        self._records[slot] = record
+        self._by_level[record.levelno].append(num)
+        self._by_name[record.name].append(num)
+        self._count = num + 1
+
+    @staticmethod
+    def _pop_index(index, key):
+        nums = index[key]
+        nums.popleft()
+        if not nums:
+            del index[key]
+
+    @staticmethod
+    def _name_matches(logger_name, name):
+        # Name matches whole components of logger name: 'ArduinoService' matches
+        # 'automate.mysys.ArduinoService.0', and so does 'mysys.ArduinoService'
+        return ('.%s.' % name) in ('.%s.' % logger_name)
+
+    def records(self, n=20, level=logging.NOTSET, name=None):
+        """
+            Give latest ``n`` records (oldest first) whose level is at least ``level`` and whose
+            logger name contains ``name`` as whole dot-separated components.
+        """
+        with self.lock:
+            count = self._count
+            if level <= logging.NOTSET and not name:
+                first = max(count - len(self), count - n)
+                nums = range(first, count)
+            else:
+                indices = []
+                if level > logging.NOTSET:
+                    indices.append([nums for levelno, nums in self._by_level.items() if levelno >= level])
+                if name:
+                    indices.append([nums for logger_name, nums in self._by_name.items()
+                                    if self._name_matches(logger_name, name)])
+                # Iterate the smaller index, and check the other condition per record
+                smallest = min(indices, key=lambda i: sum(len(nums) for nums in i))
+                nums = []
+                for num in heapq.merge(*(reversed(i) for i in smallest), reverse=True):
+                    if len(nums) >= n:
+                        break
+                    record = self._records[num % self.capacity]
+                    if record.levelno >= level and (not name or self._name_matches(record.name, name)):
+                        nums.append(num)
+                nums.reverse()
+            return [self._records[num % self.capacity] for num in nums]
+
+    @staticmethod
+    def render(record, formatter, html=True):
+        """
+            Render record with formatter (ColoredFormatter), either as HTML or as plain text.
+            Result is cached in the record, by format string of the formatter.
+        """
+        key = (formatter._fmt, formatter.datefmt, html)
+        line = record._rendered.get(key)
+        if line is None:
+            line = formatter.format(record)
+            if html:
+                line = ansiconv.to_html(LogStoreService.html_fix(line))
+            else:
+                line = ansiconv.to_plain(line)
+            record._rendered[key] = line
+        return line
 
 
 class LogStoreService(AbstractUserService):
@@ -43,11 +140,11 @@ class LogStoreService(AbstractUserService):
     #: Log level
     log_level = Int(logging.INFO)
 
-    #: Log length
-    log_length = Int(100)
+    #: Number of log records that are kept in memory (see :class:`LogRing`)
+    log_length = Int(1000)
 
-    #: The most recent log line is always updated here.
-    #:t Subscription to this attribute can be used to follow new log entries.
+    #: The most recent log line (HTML) is updated here while there are subscribers
+    #: (see :meth:`subscribe_lines`).
     most_recent_line = Unicode
 
     format = Str('%(log_color)s%(asctime)s %(name)s %(message)s %(reset)s')
@@ -55,6 +152,8 @@ class LogStoreService(AbstractUserService):
     time_format = Str('%H:%M:%S')
 
     _loghandler = Any
+    _formatters = Dict(transient=True)
+    _line_subscribers = Int(transient=True)
 
     def _log_level_changed(self, new):
         self._loghandler.setLevel(new)
@@ -63,37 +162,47 @@ class LogStoreService(AbstractUserService):
     def html_fix(s):
         return s.replace('<', '&lt;').replace('>', '&gt;')
 
-    def setup(service):
-        html_formatter = ColoredFormatter(service.html_format, datefmt='%H:%M:%S')
+    def subscribe_lines(self, handler):
+        """
+            Follow new log entries: ``handler(new)`` is called with each new log line (HTML).
+            Log lines are rendered for :attr:`most_recent_line` only while there are subscribers.
+        """
+        self.on_trait_change(handler, 'most_recent_line')
+        self._line_subscribers += 1
+
+    def unsubscribe_lines(self, handler):
+        self.on_trait_change(handler, 'most_recent_line', remove=True)
+        self._line_subscribers = max(self._line_subscribers - 1, 0)
 
-        class MyBufferingHandler(logging.handlers.BufferingHandler):
+    def get_formatter(self, format):
+        formatter = self._formatters.get(format)
+        if formatter is None:
+            formatter = self._formatters[format] = ColoredFormatter(format, datefmt=self.time_format)
+        return formatter
 
-            def flush(self):
-                del self.buffer[:int(.25 * self.capacity)]
+    def setup(service):
+        class LogStoreHandler(LogRing):
 
             def emit(self, record):
                 super().emit(record)
-                service.most_recent_line = ansiconv.to_html(service.html_fix(html_formatter.format(record))) + '\n'
+                # Record is rendered here only for the subscribers of most_recent_line
+                if service._line_subscribers:
+                    html_formatter = service.get_formatter(service.html_format)
+                    service.most_recent_line = self.render(record, html_formatter) + '\n'
 
-        service._loghandler = loghandler = MyBufferingHandler(service.log_length)
+        service._loghandler = loghandler = LogStoreHandler(service.log_length)
         loghandler.setLevel(service.log_level)
-        loghandler.setFormatter(ColoredFormatter(service.format, datefmt=service.time_format))
-        service.system.logger.addHandler(loghandler)
-
-    def lastlog(self, lines=20, format='', html=True):
-        handler = self._loghandler
-        if format:
-            formatter = ColoredFormatter(format, datefmt=self.time_format)
-        else:
-            formatter = ColoredFormatter(self.html_format if html else self.format, datefmt=self.time_format)
-
-        rv = u'\n'.join([formatter.format(i) for i in handler.buffer[-lines:]])
-
-        if html:
-            rv = ansiconv.to_html(self.html_fix(rv))
-        else:
-            rv = ansiconv.to_plain(rv)
-        return rv
+        service.system.add_log_handler(loghandler)
+
+    def lastlog(self, lines=20, format='', html=True, level=logging.NOTSET, name=None):
+        """
+            Give latest ``lines`` log lines, as HTML or plain text. If ``level`` or ``name`` are
+            given, only records whose level is at least ``level``, or whose logger name contains
+            ``name`` (for example ``'ArduinoService'``), are included.
+        """
+        formatter = self.get_formatter(format or (self.html_format if html else self.format))
+        records = self._loghandler.records(lines, level=level, name=name)
+        return u'\n'.join(LogRing.render(record, formatter, html) for record in records)
 
     def cleanup(self):
         return
@@ -21,8 +21,6 @@
 # If you like Automate, please take a look at this page:
 # http://evankelista.net/automate/
 
-from threading import Timer
-
 from traits.api import Any, CBool, CFloat
 
 from automate.service import AbstractUserService
@@ -38,7 +36,8 @@ class StatusSaverService(AbstractUserService):
 
     autoload = True
 
-    #: Dump saving interval, in seconds. Default 30 minutes.
+    #: Dump saving interval, in seconds. Default 30 minutes. With System.state_journal, this is
+    #: the interval of journal compaction, and saving is skipped if journal is empty.
     dump_interval = CFloat(30 * 60)
 
     _exit = CBool(False)
@@ -51,10 +50,14 @@ class StatusSaverService(AbstractUserService):
                 self.save_system_periodically()
 
     def save_system_periodically(self):
-        self.logger.debug('Saving system state')
-        self.system.save_state()
-        self._timer = Timer(self.dump_interval, self.save_system_periodically)
-        self._timer.start()
+        journal = self.system.journal
+        if journal and not journal.num_records:
+            self.logger.debug('No status changes in journal, no need to save system state')
+        else:
+            self.logger.debug('Saving system state')
+            self.system.save_state()
+        self._timer = self.system.scheduler.call_later(self.dump_interval, self.save_system_periodically,
+                                                       name='StatusSaverService periodic save')
 
     def exit_save(self):
         self.system.save_state()
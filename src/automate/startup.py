@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# (c) 2015 Tuomas Airaksinen
+#
+# This file is part of Automate.
+#
+# Automate is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Automate is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Automate.  If not, see <http://www.gnu.org/licenses/>.
+#
+# ------------------------------------------------------------------
+#
+# If you like Automate, please take a look at this page:
+# http://evankelista.net/automate/
+
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class StartupReport:
+
+    """
+        Timing of :class:`~automate.system.System` initialization, available in
+        :attr:`System.startup_report <automate.system.System.startup_report>`.
+
+        Records wall time of each initialization phase, time spent in ``setup_system`` and
+        ``setup_callables`` per object and counts of objects and trigger/target links that were
+        set up. :meth:`as_dict` gives the report as a structured dictionary and :meth:`format`
+        as text.
+    """
+
+    #: Phases that are timed per object
+    OBJECT_PHASES = ('setup_system', 'setup_callables')
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = OrderedDict()
+        self.object_times = {phase: {} for phase in self.OBJECT_PHASES}
+        self.counts = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        """
+            Context manager that adds the time spent inside it to phase ``name``.
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.) + time.perf_counter() - t0
+
+    @contextmanager
+    def time_object(self, phase, name):
+        """
+            Context manager that adds the time spent inside it to object ``name`` in
+            per-object phase ``phase``.
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            times = self.object_times[phase]
+            times[name] = times.get(name, 0.) + time.perf_counter() - t0
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+    def slowest(self, phase, n=10):
+        """
+            List of ``n`` (name, seconds) pairs of the slowest objects in per-object phase ``phase``.
+        """
+        return sorted(self.object_times[phase].items(), key=lambda i: i[1], reverse=True)[:n]
+
+    def as_dict(self, n=10):
+        """
+            Report as a dictionary (JSON serializable)
+        """
+        return {'started': self.started,
+                'total': self.total,
+                'phases': list(self.phases.items()),
+                'slowest': {phase: self.slowest(phase, n) for phase in self.OBJECT_PHASES},
+                'counts': dict(self.counts)}
+
+    def format(self, n=10):
+        """
+            Report as text
+        """
+        lines = ['Startup took %.3f s' % self.total]
+        lines.extend('  %-30s %8.3f s' % i for i in self.phases.items())
+        for phase in self.OBJECT_PHASES:
+            lines.append('Slowest objects in %s:' % phase)
+            lines.extend('  %-30s %8.3f s' % i for i in self.slowest(phase, n))
+        lines.append('Counts:')
+        lines.extend('  %-30s %8d' % i for i in self.counts.items())
+        return '\n'.join(lines)
@@ -24,21 +24,22 @@
 import logging
 import operator
 import statistics
-import threading
 import time
 import sys
-import collections
 
 import datetime
-from functools import lru_cache
 from numbers import Number
 
 from traits.api import (cached_property, Any, CBool, Instance, Dict, Str, CFloat,
-                        List, Enum, Bool, Property, Event, CInt)
+                        List, Enum, Bool, Property, Event, CInt, Tuple)
 from traits.trait_errors import TraitError
+from traits.trait_types import BaseFloat, BaseInt
 
 from .common import Lock, AbstractStatusObject, CompareMixin, nomutex
-from .worker import StatusWorkerTask, DummyStatusWorkerTask
+from .worker import StatusWorkerTask, StatusChangeTask
+from .scheduler import ScheduledCall
+from .history import (NumericHistory, ObjectHistory, RingHistory, CompressedHistory, RollupTier,
+                      DOWNSAMPLING_METHODS, np)
 from .program import ProgrammableSystemObject, DefaultProgram
 from .systemobject import SystemObject
 
@@ -71,9 +72,17 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
     #: (property) Is delayed change taking place at the moment?
     changing = Property(trait=Bool, transient=True, depends_on='_timed_action, _queued_job')
 
-    # Deque of history, which consists of tuples (timestamp, status), read only
+    #: Is object quarantined because of too frequent status changes (see
+    #: :attr:`~automate.system.System.oscillation_limit`)? Its changes then do not trigger programs.
+    quarantined = CBool(False, transient=True)
+
+    # History, which consists of tuples (timestamp, status), read only. ObjectHistory, or for
+    # numeric statuses RingHistory (or CompressedHistory) if NumPy is available.
     history = Any()  # transient=True)
 
+    #: On-disk history (:class:`~automate.history.SegmentedSeries`), set by HistoryStoreService
+    history_store = Any(transient=True)
+
     #: Transpose of history (timesstamps, statuses)
     history_transpose = Property(transient=True)
 
@@ -83,6 +92,19 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
     #: How often new values are saved to history, in seconds
     history_frequency = CFloat(0)
 
+    #: Rollup tiers of history, as a list of (bucket length in seconds, number of buckets), for example
+    #: ``[(60, 1440), (3600, 24*365)]``. Each tier keeps number of changes, min, max and integral of
+    #: numeric status per bucket (see :class:`~automate.history.RollupTier`). Long-range
+    #: :meth:`integral` and :meth:`average` read them instead of raw history.
+    history_rollups = List(Tuple(CFloat, CInt))
+
+    #: :class:`~automate.history.RollupTier` instances of :attr:`history_rollups` (read-only)
+    rollups = List
+
+    #: Store history of numeric status compressed (see :class:`~automate.history.CompressedHistory`).
+    #: Timestamps are then rounded to milliseconds.
+    history_compression = CBool(False)
+
     #: Show stdev seconds (0 to disable)
     show_stdev_seconds = CInt(0)
 
@@ -92,8 +114,8 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
             return True
         return False
 
-    # Thread of currently running action
-    _timed_action = Instance(threading.Timer, transient=True)
+    # Scheduled call of currently running action
+    _timed_action = Instance(ScheduledCall, transient=True)
 
     # Reference of status change job that is in the worker queue is saved here
     _queued_job = Instance(StatusWorkerTask, transient=True)
@@ -119,7 +141,9 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
     data_type = Str(transient=True)
 
     def _get_history_transpose(self):
-        return list(zip(*self.history)) if self.history else [[0], [0]]
+        if not self.history:
+            return [[0], [0]]
+        return self.history.times, self.history.statuses
 
     @property
     def times(self):
@@ -133,20 +157,88 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
     def statuses(self):
         return self.history_transpose[1]
 
+    def _history_index(self, T, side='right'):
+        """
+            Number of history entries with timestamp <= T (side='right') or < T (side='left').
+        """
+        return self.history.bisect(T, side) if self.history is not None else 0
+
+    def _in_history_store(self, T):
+        # Is time T older than in-memory history, but available in history_store
+        return self.history_store is not None and (not self.history or T < self.history[0][0])
+
+    def history_window(self, t_a=None, t_b=None):
+        """
+            Timestamps and statuses of history entries with t_a <= timestamp <= t_b. Reads
+            from :attr:`history_store` if window starts before in-memory history. Without t_a,
+            window starts from the beginning of in-memory history.
+        """
+        t_a, t_b = self._window_times(t_a, t_b)
+        if self._in_history_store(t_a):
+            return self.history_store.window(t_a, t_b)
+        if self.history is None:
+            return [], []
+        return self.history.window(t_a, t_b)
+
+    def history_points(self, t_a=None, t_b=None, max_points=0, method='lttb'):
+        """
+            Timestamps and statuses (as float arrays) between t_a and t_b for plotting, at most
+            ``max_points`` of them (0 for no limit), downsampled by given method (see
+            :data:`~automate.history.DOWNSAMPLING_METHODS`). Ranges that begin before in-memory
+            history are read from rollup tiers (bucket means at bucket start times, or minimums
+            and maximums at the times they occurred with 'minmax' method), if there are any.
+            Without t_a, range starts from the beginning of in-memory history.
+        """
+        t_a, t_b = self._window_times(t_a, t_b)
+        rollup = self.select_rollup(t_a, t_b, min_buckets=max_points or 100)
+        if rollup:
+            if method == 'minmax':
+                points = rollup.extrema(t_a, t_b)
+                times, statuses = [t for t, s in points], [s for t, s in points]
+            else:
+                buckets = rollup.window(t_a, t_b)
+                times, statuses = [b[0] for b in buckets], [b[4] for b in buckets]
+        else:
+            times, statuses = self.history_window(t_a, t_b)
+        if np is None:
+            return list(times), [float(s or 0) for s in statuses]
+        times = np.asarray(times, dtype='float64')
+        statuses = self._float_statuses(statuses)
+        if max_points:
+            times, statuses = DOWNSAMPLING_METHODS[method](times, statuses, max_points)
+        return times, statuses
+
+    @staticmethod
+    def _float_statuses(statuses):
+        if isinstance(statuses, np.ndarray):
+            return statuses.astype('float64')
+        return np.array([float(s or 0) for s in statuses], dtype='float64')
+
+    def history_resample(self, grid):
+        """
+            Statuses (float array) at times given in sorted array ``grid``, with the same step-hold
+            semantics as :meth:`status_at_time`. Computed with a single history window query
+            and :func:`numpy.searchsorted`.
+        """
+        grid = np.asarray(grid, dtype='float64')
+        if not len(grid):
+            return np.zeros(0)
+        times, statuses = self.history_window(grid[0], grid[-1])
+        # Status that holds before the first grid point, then the changes within the grid
+        times = np.concatenate(([-np.inf], np.asarray(times, dtype='float64')))
+        statuses = np.concatenate((self._float_statuses([self.status_at_time(grid[0])]),
+                                   self._float_statuses(statuses)))
+        return statuses[np.searchsorted(times, grid, side='right') - 1]
+
     def status_at_time(self, T):
         if isinstance(T, datetime.datetime):
             T = T.timestamp()
-        t_max = 0
-        times, statuses = self.history_transpose
-        if T < times[0]:
+        if self._in_history_store(T):
+            return self.history_store.status_at_time(T)
+        t_index = self._history_index(T)
+        if t_index == 0:
             return 0.
-        for t in times:
-            if t <= T:
-                t_max = t
-            else:
-                break
-        t_index = times.index(t_max)
-        return statuses[t_index]
+        return self.history[t_index - 1][1]
 
     @staticmethod
     def _convert_times(t_a, t_b):
@@ -162,15 +254,46 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
 
         return t_a, t_b
 
-    @lru_cache()
+    def _window_times(self, t_a, t_b):
+        # Windows without start time cover in-memory history, not all of history_store
+        if t_a is None and self.history:
+            t_a = self.history[0][0]
+        return self._convert_times(t_a, t_b)
+
+    def select_rollup(self, t_a, t_b, min_buckets=100):
+        """
+            Select the coarsest rollup tier that covers time t_a and has at least ``min_buckets``
+            buckets between t_a and t_b (or the finest one that covers t_a, if none has).
+            Buckets are counted from the data that tier has, i.e. from its first bucket if t_a
+            is earlier. Returns None if range is within in-memory history, or if no tier covers it.
+        """
+        if self.history and t_a >= self.history[0][0]:
+            return None
+        tiers = [i for i in self.rollups if i.buckets and (not i.dropped or i.start <= t_a)]
+        if not tiers:
+            return None
+        sufficient = [i for i in tiers if i.seconds * min_buckets <= t_b - max(t_a, i.start)]
+        if sufficient:
+            return max(sufficient, key=lambda i: i.seconds)
+        return min(tiers, key=lambda i: i.seconds)
+
     def integral(self, t_a=None, t_b=None):
-        self.logger.debug('Calculating integral for %s', self)
         t_a, t_b = self._convert_times(t_a, t_b)
-        history = ((t, s) for t, s in self.history if t_a <= t <= t_b and isinstance(s, Number))
-        t_prev = t_a
+        rollup = self.select_rollup(t_a, t_b)
+        if rollup:
+            # Rollup tier until the beginning of in-memory history, raw history after that
+            t_m = min(max(self.history[0][0], t_a), t_b) if self.history else t_b
+            return rollup.integral(t_a, t_m) + (self.integral(t_m, t_b) if t_m < t_b else 0.)
+        if self._in_history_store(t_a):
+            return self.history_store.integral(t_a, t_b)
+        if isinstance(self.history, NumericHistory):
+            return self.history.integral(t_a, t_b)
+
         s_prev = self.status_at_time(t_a)
         if not isinstance(s_prev, Number):
             s_prev = 0.
+        history = ((t, s) for t, s in zip(*self.history.window(t_a, t_b)) if isinstance(s, Number))
+        t_prev = t_a
         s_sum = 0.
         for t, s in history:
             s_sum += s_prev * (t-t_prev)
@@ -185,8 +308,12 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
         return self.integral(t_a, t_b) / (t_b-t_a)
 
     def stdev(self, t: int=10) -> float:
-        values = []
         now = time.time()
+        if isinstance(self.history, NumericHistory):
+            values = self.history.window(now - t, now)[1]
+            return float(np.std(values, ddof=1)) if len(values) > 1 else 0.0
+
+        values = []
         for t_, value in reversed(self.history):
             if t_ < now - t:
                 break
@@ -201,8 +328,37 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
         self._status_lock = Lock('statuslock')
         super().__setstate__(*args, **kwargs)
 
+    def _new_history(self, data=()):
+        """
+            Create history container for this object. Objects with numeric status type
+            store history in :class:`~automate.history.RingHistory` or, if
+            :attr:`history_compression` is set, :class:`~automate.history.CompressedHistory`
+            (if NumPy is available), others in :class:`~automate.history.ObjectHistory`.
+        """
+        data = list(data or [])[-self.history_length:]
+        if np is not None:
+            status_trait = self.trait('_status').trait_type
+            history_class = CompressedHistory if self.history_compression else RingHistory
+            if isinstance(status_trait, BaseFloat):
+                return history_class(self.history_length, 'float64', data)
+            if isinstance(status_trait, BaseInt):
+                return history_class(self.history_length, 'int64', data)
+        return ObjectHistory(self.history_length, data)
+
     def _history_length_changed(self, new_value):
-        self.history = collections.deque(list(self.history or [])[-new_value:], maxlen=new_value)
+        self.history = self._new_history(self.history)
+
+    def _history_compression_changed(self, new_value):
+        self.history = self._new_history(self.history)
+
+    def _history_rollups_changed(self, new_value):
+        # Keep existing tiers (for example loaded from state), if configuration is not changed
+        if [(i.seconds, i.length) for i in self.rollups] != [tuple(i) for i in new_value]:
+            self.rollups = [RollupTier(seconds, length) for seconds, length in new_value]
+
+    def _history_changed(self, new_value):
+        if new_value is not None and not isinstance(new_value, (NumericHistory, ObjectHistory)):
+            self.history = self._new_history(new_value)
 
     @property
     def is_program(self):
@@ -252,8 +408,7 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
 
     def setup_system(self, *args, **kwargs):
         super().setup_system(*args, **kwargs)
-        if not self.history:
-            self.history = collections.deque(maxlen=self.history_length)
+        self.history = self._new_history(self.history)
         self.data_type = self._status.__class__.__name__
 
     def set_status(self, new_status, origin=None, force=False):
@@ -279,6 +434,14 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
             When program controlling this object activates, it calls this function.
         """
 
+    def activate_programs(self, programs):
+        """
+            Activate several programs at once. Used when deferred programs are activated
+            (see :meth:`~automate.system.System.bulk_wiring`).
+        """
+        for program in programs:
+            self.activate_program(program)
+
     def deactivate_program(self, program):
         """
             When program controlling this object deactivates, it calls this function.
@@ -321,9 +484,21 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
                         self.history.pop()
                         change_time = last_time
                 if status is not None:
-                    self.history.append((change_time, status))
-                    self.integral.cache_clear()
+                    try:
+                        self.history.append((change_time, status))
+                    except (TypeError, ValueError, OverflowError):
+                        # Status does not fit into typed history buffer
+                        self.history = ObjectHistory(self.history_length, self.history)
+                        self.history.append((change_time, status))
+                    if self.history_store is not None and isinstance(self.history, NumericHistory):
+                        self.history_store.append(change_time, status)
+                    if self.rollups and isinstance(status, Number):
+                        for tier in self.rollups:
+                            tier.add(change_time, status)
                 self._status = status
+                journal = self.system.journal
+                if journal and not self.trait('_status').transient:
+                    journal.record(self.name, change_time, status)
         except TraitError as e:
             self.logger.warning('Wrong type of status %s was passed to %s. Error: %s', status, self, e)
 
@@ -333,9 +508,10 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
             with self._status_lock if with_statuslock else nomutex:
                 if status != self._status:
                     self._queued_job = StatusWorkerTask(func=self._set_real_status, args=(status, prog), object=self)
-                    self.system.worker_thread.put(self._queued_job)
+                    self.system.get_worker(self).put(self._queued_job)
         else:
-            self.system.worker_thread.put(DummyStatusWorkerTask(self._set_real_status, status, prog))
+            self.system.get_worker(self).put(StatusChangeTask(self, self._set_real_status, (status, prog),
+                                                           coalescable=False))
 
     def _are_delays_active(self, new_status):
         try:
@@ -363,7 +539,8 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
         This does not directly change status, but adds change request
         to queue.
         """
-        self.system.worker_thread.put(DummyStatusWorkerTask(self._request_status_change_in_queue, status, force=force))
+        self.system.get_worker(self).put(StatusChangeTask(self, self._request_status_change_in_queue, (status,),
+                                                       dict(force=force)))
 
     @property
     def next_scheduled_action(self):
@@ -419,12 +596,10 @@ class StatusObject(AbstractStatusObject, ProgrammableSystemObject, CompareMixin)
                 time_after_delay = datetime.datetime.now() + datetime.timedelta(seconds=delaytime)
                 self.logger.debug("Scheduling safety/change_delay timer for %f sek. Now %s. Going to change to %s.",
                        delaytime, self._status, status)
-                self._timed_action = threading.Timer(delaytime, timer_func,
-                                                     args=(self._add_statuschange_to_queue, status,
-                                                     getattr(self, "program", None), False))
-                self._timed_action.name = "Safety/change_delay for %s timed at %s (%f sek)" % (self.name, time_after_delay, delaytime)
-                self._timed_action.next_action = time_after_delay
-                self._timed_action.start()
+                self._timed_action = self.system.scheduler.call_later(
+                    delaytime, timer_func,
+                    args=(self._add_statuschange_to_queue, status, getattr(self, "program", None), False),
+                    name="Safety/change_delay for %s timed at %s (%f sek)" % (self.name, time_after_delay, delaytime))
                 return False
 
 
@@ -466,8 +641,9 @@ class AbstractSensor(StatusObject):
         if self.reset_delay:
             if self._reset_timer and self._reset_timer.is_alive():
                 self._reset_timer.cancel()
-            self._reset_timer = threading.Timer(self.reset_delay, lambda: self.set_status(self.default))
-            self._reset_timer.start()
+            self._reset_timer = self.system.scheduler.call_later(
+                self.reset_delay, lambda: self.set_status(self.default),
+                name="Reset delay for %s (%f sek)" % (self.name, self.reset_delay))
 
     def set_status(self, status, origin=None, force=False):
         """
@@ -588,6 +764,17 @@ class AbstractActuator(StatusObject):
             self.program_stack.append(program)
             self._update_program_stack()
 
+    def activate_programs(self, programs):
+        """
+            Activate several programs at once: program stack is sorted (and status updated) only once.
+        """
+        self.logger.debug("activate_programs %s", programs)
+        with self._program_lock:
+            new_programs = [p for p in programs if p not in self.program_stack]
+            if new_programs:
+                self.program_stack.extend(new_programs)
+                self._update_program_stack()
+
     def deactivate_program(self, program):
         """
             Called by program, when it is deactivated.
@@ -21,31 +21,35 @@
 # If you like Automate, please take a look at this page:
 # http://evankelista.net/automate/
 
-from collections import defaultdict
-
-from raven.handlers.logging import SentryHandler
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
 
+import queue
 import threading
+import time
+import copy
+import copyreg
 import operator
 import os
 import logging
 import pickle
-import pkg_resources
 import argparse
 
-import raven
-
-from traits.api import (CStr, Instance, CBool, CList, Property, CInt, CUnicode, Event, CSet, Str, cached_property,
-                        on_trait_change)
+from traits.api import (CStr, Instance, CBool, CFloat, CList, Property, CInt, CUnicode, Event, CSet, Str,
+                        cached_property, on_trait_change)
 
-from .common import (SystemBase, ExitException, has_baseclass, Object)
+from .common import (SystemBase, ExitException, has_baseclass, Object, Lock, SystemNotReady)
 from .namespace import Namespace
 from .service import AbstractService, AbstractUserService, AbstractSystemService
-from .statusobject import AbstractSensor, AbstractActuator
+from .statusobject import StatusObject, AbstractSensor, AbstractActuator
 from .systemobject import SystemObject
-from .worker import StatusWorkerThread
-from .callable import AbstractCallable
-from . import __version__
+from .worker import StatusWorkerThread, DummyStatusWorkerTask
+from .journal import StateJournal
+from .history import NumericHistory, ObjectHistory, RollupTier, np
+from .extensions import load_extensions
+from .startup import StartupReport
+from .lockprofile import lock_profiler
+from .scheduler import Scheduler
 
 import typing
 
@@ -56,11 +60,6 @@ STATEFILE_VERSION = 1
 
 import sys
 
-if sys.version_info >= (3, 0):
-    TimerClass = threading.Timer
-else:
-    TimerClass = threading._Timer
-
 def get_autoload_services():
     import automate.services
     return (i for i in list(automate.services.__dict__.values()) if has_baseclass(i, AbstractService) and i.autoload)
@@ -71,6 +70,45 @@ def get_service_by_name(name):
     return getattr(automate.services, name)
 
 
+def _snapshot_reduce(obj):
+    """
+        Pickle reduction of a SystemObject, taken beforehand. Small mutable containers in the
+        state are copied, and histories and rollup tiers replaced by their copy-on-write snapshots,
+        so that the reduction stays as it is while the object keeps on changing.
+    """
+    func, args, state = obj.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+    for key, value in state.items():
+        if isinstance(value, list):
+            state[key] = [i.snapshot() if isinstance(i, RollupTier) else i for i in value]
+        elif isinstance(value, set):
+            state[key] = set(value)
+        elif isinstance(value, dict):
+            state[key] = dict(value)
+        elif isinstance(value, (NumericHistory, ObjectHistory)):
+            state[key] = value.snapshot()
+    return func, args, state
+
+
+class _SnapshotPickler(pickle.Pickler):
+
+    """
+        Pickler that uses reductions from snapshot ({id(obj): (obj, reduction)}) for SystemObjects,
+        instead of reading their current state.
+    """
+
+    def __init__(self, file, snapshot):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.snapshot = snapshot
+        self.dispatch_table = copyreg.dispatch_table.copy()
+        for obj, reduction in snapshot.values():
+            self.dispatch_table[type(obj)] = self._reduce
+
+    def _reduce(self, obj):
+        if id(obj) in self.snapshot:
+            return self.snapshot[id(obj)][1]
+        return obj.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+
+
 class System(SystemBase):
     #: Name of the system (shown in WEB UI for example)
     name = CStr
@@ -95,7 +133,7 @@ class System(SystemBase):
     raven_dsn = Str
 
     #: Raven client (is created automatically if raven_dsn is set and this is left empty)
-    raven_client = Instance(raven.Client, transient=True)
+    raven_client = Instance('raven.Client', transient=True)
 
     #: Format string of the log handler that writes to stdout
     log_format = Str('%(asctime)s %(log_color)s%(name)s%(reset)s %(message)s')
@@ -106,6 +144,19 @@ class System(SystemBase):
     #: Log level of System logger
     log_level = CInt(logging.INFO, transient=True)
 
+    #: Hand log records of the system over to a listener thread through a queue. Handlers (stream,
+    #: logfile, Sentry and those added by :meth:`add_log_handler`, such as LogStoreService) then
+    #: format the records in the listener thread instead of the thread that logs them (such as
+    #: worker thread). Records are not formatted before queuing, so arguments of log calls are
+    #: formatted when the listener handles the record.
+    async_logging = CBool(False)
+
+    #: Listener thread of :attr:`async_logging` (read-only)
+    log_listener = Instance('logging.handlers.QueueListener', transient=True)
+
+    # Handler that passes records from the listener thread to the actual handlers
+    _log_dispatcher = Instance(logging.Handler, transient=True)
+
     @on_trait_change('log_level', post_init=True)
     def log_level_changed(self, new):
         self.logger.setLevel(new)
@@ -122,9 +173,56 @@ class System(SystemBase):
     #: List of servicenames that are desired to be avoided (even if normally autoloaded).
     exclude_services = CSet(trait=Str)
 
-    #: Reference to the worker thread (read-only)
+    #: Reference to the (first) worker thread (read-only)
     worker_thread = Instance(StatusWorkerThread, transient=True)
 
+    #: List of all worker threads (read-only)
+    workers = CList(trait=Instance(StatusWorkerThread), transient=True)
+
+    #: Number of status worker threads. If more than 1, objects are divided between workers by
+    #: connected components of program trigger/target graph: independent groups of objects are
+    #: processed in parallel, and objects that interact are always processed by the same worker.
+    worker_threads = CInt(1)
+
+    # Dictionary that maps objects to their worker threads (None until objects are set up)
+    _worker_shards = Instance(dict, transient=True)
+
+    # Union-find structure of worker shards: parent links, and members of each root
+    _shard_parent = Instance(dict, transient=True)
+    _shard_members = Instance(dict, transient=True)
+
+    # Reverse indices from StatusObjects to programs that have them in their actual_triggers /
+    # actual_targets. Values are dicts (used as ordered sets) that are replaced, not modified.
+    _triggered_programs = Instance(dict, transient=True)
+    _targeting_programs = Instance(dict, transient=True)
+    _dependency_lock = Instance(Lock, transient=True)
+
+    # Programs whose wiring and activation are deferred by bulk_wiring (None when not in bulk
+    # wiring mode). Values are dicts of program state before the first deferred change.
+    _deferred_programs = Instance(dict, transient=True)
+
+    # Propagation ranks of programs and objects (see get_propagation_rank), None if not computed
+    _propagation_ranks = Instance(dict, transient=True)
+
+    #: Feedback loops of the trigger/target graph, as lists of object names (read-only, see
+    #: :meth:`find_feedback_loops`). Updated when programs are wired.
+    feedback_loops = CList(transient=True)
+
+    # Check feedback loops whenever reverse indices are updated (enabled after initialization)
+    _check_loops = CBool(False, transient=True)
+
+    # Feedback loop check is queued in the worker, but not yet run
+    _loop_check_pending = CBool(False, transient=True)
+
+    #: Reference to the scheduler that runs all delayed actions and timers (read-only)
+    scheduler = Instance(Scheduler, transient=True)
+
+    #: Timing of System initialization phases (see :class:`~automate.startup.StartupReport`)
+    startup_report = Instance(StartupReport, transient=True)
+
+    #: Number of threads that scheduler uses to execute delayed actions
+    scheduler_threads = CInt(8)
+
     #: System namespace (read-only)
     namespace = Instance(Namespace)
 
@@ -184,6 +282,20 @@ class System(SystemBase):
     #: Number of state backup files
     num_state_backups = CInt(5)
 
+    #: Append each status change to a journal file (:attr:`filename` + '.journal'). Then
+    #: :meth:`save_state` is needed only for compacting the journal to a new checkpoint,
+    #: and :meth:`load_or_create` replays the journal on top of the checkpoint.
+    state_journal = CBool(False)
+
+    #: Reference to the state journal, if :attr:`state_journal` is enabled (read-only)
+    journal = Instance(StateJournal, transient=True)
+
+    #: Time (in seconds) that worker threads were paused while taking the latest state snapshot
+    #: in :meth:`save_state` (read-only)
+    last_snapshot_pause = CFloat(transient=True)
+
+    _state_saver = Instance(threading.Thread, transient=True)
+
     @cached_property
     def _get_all_tags(self):
         newset = set([])
@@ -196,6 +308,36 @@ class System(SystemBase):
     #: Enable experimental two-phase queue handling technique (not recommended)
     two_phase_queue = CBool(False)
 
+    #: Keep at most one pending status change per object in the worker queue. Later changes
+    #: overwrite the pending value, so intermediate values of rapidly changing objects are skipped.
+    coalesce_status_changes = CBool(False)
+
+    #: Maximum number of status changes that worker processes at once (0 means all that are
+    #: waiting in the queue). If other than 1, programs are evaluated only once per batch,
+    #: after all status changes of the batch are applied.
+    worker_batch_size = CInt(1)
+
+    #: Propagate status changes in waves: programs triggered by a status change are evaluated in
+    #: topological order of the trigger/target graph, at most once per wave, and the status changes
+    #: that they cause are applied before programs later in the order are evaluated. This avoids
+    #: evaluating programs with intermediate ("glitch") statuses. See
+    #: StatusWorkerThread.num_saved_evaluations.
+    ordered_propagation = CBool(False)
+
+    #: Maximum number of status changes per second of an object that triggers programs (0: no limit).
+    #: If an object changes more often, for example because it is in a feedback loop, it is
+    #: quarantined: its status changes do not trigger programs for :attr:`oscillation_quarantine`
+    #: seconds. After that, programs are triggered once with its latest status.
+    oscillation_limit = CInt(0)
+
+    #: Duration of the quarantine of oscillating objects, in seconds (see :attr:`oscillation_limit`)
+    oscillation_quarantine = CFloat(10.)
+
+    #: Record contention of locks (wait time histograms and sampled stacks of waiting threads) in
+    #: :data:`~automate.lockprofile.lock_profiler`. Profiling is process-wide and stays enabled
+    #: until disabled by ``lock_profiler.disable()``.
+    lock_profiling = CBool(False)
+
     @classmethod
     def load_or_create(cls, filename=None, no_input=False, create_new=False, **kwargs):
         """
@@ -220,12 +362,7 @@ class System(SystemBase):
             return time_savefile > time_program
 
         def load_pickle():
-            with open(filename, 'rb') as of:
-                statefile_version, data = pickle.load(of)
-
-            if statefile_version != STATEFILE_VERSION:
-                raise RuntimeError(f'Wrong statefile version, please remove state file {filename}')
-            return data
+            return cls.load_state_file(filename)
 
         def load():
             print('Loading %s' % filename)
@@ -260,28 +397,119 @@ class System(SystemBase):
         else:
             return create()
 
-    def save_state(self):
+    @staticmethod
+    def load_state_file(filename):
+        """
+            Load objects and config from a dump file. If there is a state journal next to
+            the dump file, its status changes are applied on top of the loaded state.
+        """
+        with open(filename, 'rb') as of:
+            statefile_version, data = pickle.load(of)
+
+        if statefile_version != STATEFILE_VERSION:
+            raise RuntimeError(f'Wrong statefile version, please remove state file {filename}')
+        obj_list, config = data
+        StateJournal.replay(filename + '.journal', obj_list, config)
+        return obj_list, config
+
+    def save_state(self, wait=False):
         """
-            Save state of the system to a dump file :attr:`System.filename`
+            Save state of the system to a dump file :attr:`System.filename`.
+
+            Worker threads are paused (see :meth:`pause_workers`) only while a snapshot of the
+            objects is taken (see :attr:`last_snapshot_pause`). Histories are not copied for the
+            snapshot, but shared with it copy-on-write. Snapshot is written to the file in a
+            background thread, unless ``wait`` is True. If :attr:`state_journal` is enabled,
+            journal records that are included in the snapshot are removed after it is written.
         """
         if not self.filename:
             self.logger.error('Filename not specified. Could not save state')
             return
+        self.wait_state_saved()
         self.logger.debug('Saving system state to %s', self.filename)
-        for i in reversed(range(self.num_state_backups)):
-            fname = self.filename if i == 0 else '%s.%d' % (self.filename, i)
-            new_fname = '%s.%d' % (self.filename, i+1)
-            try:
-                os.rename(fname, new_fname)
-            except FileNotFoundError:
-                pass
 
-        with open(self.filename, 'wb') as file, self.worker_thread.queue.mutex:
+        with ExitStack() as stack:
+            stack.enter_context(self.pause_workers())
+            start_time = time.time()
+            if self.journal:
+                stack.enter_context(self.journal.lock)
+            snapshot = {id(obj): (obj, _snapshot_reduce(obj)) for obj in self.objects}
             obj_list = list(self.objects)
             config = {obj.name: obj.status for obj in obj_list
                       if getattr(obj, 'user_editable', False)}
-            data = obj_list, config
-            pickle.dump((STATEFILE_VERSION, data), file, pickle.HIGHEST_PROTOCOL)
+            if self.journal:
+                self.journal.rotate()
+            self.last_snapshot_pause = time.time() - start_time
+        self.logger.debug('Snapshot of %d objects taken in %.2f ms', len(obj_list), self.last_snapshot_pause*1000)
+
+        self._state_saver = threading.Thread(target=self._write_state, args=((obj_list, config), snapshot),
+                                             name='State saver thread')
+        self._state_saver.start()
+        if wait:
+            self.wait_state_saved()
+
+    @contextmanager
+    def pause_workers(self):
+        """
+            Context manager that pauses worker threads: each running worker finishes the jobs
+            that are in its queue when entering, and then waits until the context is exited. Thus
+            no job is being run while in the context. Worker thread that enters the context does
+            not wait for itself.
+        """
+        resume = threading.Event()
+        paused = []
+        # Pause jobs are put while no objects are being moved between workers (see _move_to_worker)
+        with self._dependency_lock:
+            for worker in self.workers:
+                if worker.is_alive() and worker is not threading.current_thread():
+                    event = threading.Event()
+                    worker.queue.put(DummyStatusWorkerTask(self._pause_worker, event, resume))
+                    paused.append((worker, event))
+        try:
+            for worker, event in paused:
+                while not event.wait(0.1) and worker.is_alive():
+                    pass
+            yield
+        finally:
+            resume.set()
+
+    @staticmethod
+    def _pause_worker(paused, resume):
+        paused.set()
+        resume.wait()
+
+    def wait_state_saved(self):
+        """
+            Wait until state dump started by :meth:`save_state` is written to the file.
+        """
+        if self._state_saver:
+            self._state_saver.join()
+            self._state_saver = None
+
+    def _write_state(self, data, snapshot):
+        tmp_filename = self.filename + '.tmp'
+        try:
+            with open(tmp_filename, 'wb') as file:
+                _SnapshotPickler(file, snapshot).dump((STATEFILE_VERSION, data))
+                file.flush()
+                os.fsync(file.fileno())
+
+            for i in reversed(range(self.num_state_backups)):
+                fname = self.filename if i == 0 else '%s.%d' % (self.filename, i)
+                new_fname = '%s.%d' % (self.filename, i+1)
+                try:
+                    os.rename(fname, new_fname)
+                except FileNotFoundError:
+                    pass
+            os.replace(tmp_filename, self.filename)
+        except Exception as e:
+            if self.raven_client:
+                self.raven_client.captureException()
+            self.logger.exception('Saving system state to %s failed: %s', self.filename, e)
+            return
+        if self.journal:
+            self.journal.remove_rotated()
+        self.logger.debug('System state saved to %s', self.filename)
 
     @property
     def cmd_namespace(self):
@@ -336,11 +564,484 @@ class System(SystemBase):
         """
         return set(self.services_by_name.keys())
 
+    def history_grid(self, names, t_a, t_b=None, step=None, max_points=10000):
+        """
+            Histories of several objects resampled to a common time grid ``t_a, t_a + step, ...,
+            t_b`` with step-hold semantics (see :meth:`~automate.statusobject.StatusObject.status_at_time`).
+            Returns tuple (grid, {name: statuses}) of NumPy arrays. Requires NumPy.
+
+            If ``step`` is not given, grid has ``max_points`` points. ValueError is raised if step
+            is not positive or grid would have more than ``max_points`` points, and TypeError if
+            status history of an object is not numeric.
+        """
+        if np is None:
+            raise RuntimeError('NumPy is required for history_grid')
+        t_a, t_b = StatusObject._convert_times(t_a, t_b)
+        if step is None:
+            step = max(t_b - t_a, 0) / max(max_points - 1, 1) or 1.
+        if not step > 0:
+            raise ValueError('Step must be positive')
+        num_points = max(int((t_b - t_a) // step) + 1, 0)
+        if num_points > max_points:
+            raise ValueError('Grid would have %d points, more than max_points (%d)' % (num_points, max_points))
+        grid = t_a + step * np.arange(num_points)
+        series = {}
+        for name in names:
+            try:
+                series[name] = self.namespace[name].history_resample(grid)
+            except (TypeError, ValueError):
+                raise TypeError('Status history of %s is not numeric' % name)
+        return grid, series
+
     def flush(self):
         """
-            Flush the worker queue. Usefull in unit tests.
+            Flush the worker queues (and log queue, see :attr:`async_logging`). Usefull in unit tests.
         """
-        self.worker_thread.flush()
+        while True:
+            for worker in self.workers:
+                worker.flush()
+            # Workers may have put new jobs to the queues that were already flushed
+            if not any(worker.queue.unfinished_tasks for worker in self.workers):
+                break
+        self.flush_logs()
+
+    def manual_flush(self):
+        """
+            Process jobs of all worker queues in the current thread (before worker threads are started).
+        """
+        if self.worker_thread.is_alive():
+            self.logger.error('Worker thread is running, cannot flush manually')
+            return
+        while any(worker.queue.queue for worker in self.workers):
+            for worker in self.workers:
+                worker.manual_flush()
+
+    def get_worker(self, obj):
+        """
+            Give the worker thread that processes status changes of given object
+        """
+        shards = self._worker_shards
+        if not shards:
+            return self.worker_thread
+        return shards.get(obj, self.worker_thread)
+
+    def update_worker_shards(self):
+        """
+            Divide objects between worker threads by connected components of the graph formed by
+            programs and their actual triggers and targets. Called in the initialization, when
+            worker queues are empty. After that, shards are updated incrementally by
+            :meth:`link_worker_shards`.
+        """
+        if self._worker_shards is None or len(self.workers) < 2:
+            return
+
+        self._shard_parent = {}
+        self._shard_members = {}
+        for obj in self.objects_sorted:
+            self._shard_root(obj)
+            for other in getattr(obj, 'actual_triggers', set()) | getattr(obj, 'actual_targets', set()):
+                self._join_shards(obj, other)
+
+        components = [self._shard_members[obj] for obj in self.objects_sorted if obj in self._shard_members]
+        loads = [0] * len(self.workers)
+        shards = {}
+        for component in sorted(components, key=len, reverse=True):
+            idx = loads.index(min(loads))
+            loads[idx] += len(component)
+            for obj in component:
+                shards[obj] = self.workers[idx]
+
+        self._worker_shards = shards
+        self.logger.debug('Divided %d objects in %d components between %d workers',
+                          len(shards), len(components), len(self.workers))
+
+    def link_worker_shards(self, program, objects):
+        """
+            Join ``objects`` into the worker shard of ``program``. Called when program gets new
+            triggers or targets. Shards are not split when links are removed, so objects keep their
+            workers unless shards of different workers are joined. Then objects of the smaller shard
+            are moved to the worker of the larger one (see :meth:`_move_to_worker`).
+        """
+        if not self._worker_shards or len(self.workers) < 2:
+            return
+        with self._dependency_lock:
+            for obj in objects:
+                moved = self._join_shards(program, obj)
+                if moved:
+                    root = self._shard_root(program)
+                    self._move_to_worker(moved, self.get_worker(root))
+
+    def _shard_root(self, obj):
+        parent = self._shard_parent
+        root = parent.get(obj)
+        if root is None:
+            parent[obj] = root = obj
+            self._shard_members[obj] = [obj]
+        while root is not parent[root]:
+            root = parent[root]
+        while obj is not root:
+            parent[obj], obj = root, parent[obj]
+        return root
+
+    def _join_shards(self, obj_a, obj_b):
+        # Join shards of obj_a and obj_b. Give list of objects whose worker changes.
+        root_a, root_b = self._shard_root(obj_a), self._shard_root(obj_b)
+        if root_a is root_b:
+            return []
+        members = self._shard_members
+        if len(members[root_a]) < len(members[root_b]):
+            root_a, root_b = root_b, root_a
+        self._shard_parent[root_b] = root_a
+        moved = members.pop(root_b)
+        members[root_a].extend(moved)
+        if self._worker_shards is None:
+            return []
+        worker = self.get_worker(root_a)
+        return [obj for obj in moved if self.get_worker(obj) is not worker]
+
+    def _move_to_worker(self, objects, worker):
+        """
+            Move objects to another worker. Jobs of the objects that are already queued in their
+            previous worker are processed before new jobs: new worker first waits until previous
+            worker has processed its queue up to the move. If worker threads are not running,
+            queued jobs are moved to the new worker instead.
+        """
+        by_worker = defaultdict(list)
+        for obj in objects:
+            by_worker[self.get_worker(obj)].append(obj)
+        for old, moved in by_worker.items():
+            shards = dict(self._worker_shards)
+            shards.update((obj, worker) for obj in moved)
+            if old.is_alive() and worker.is_alive():
+                barrier = threading.Event()
+                worker.queue.put(DummyStatusWorkerTask(barrier.wait))
+                self._worker_shards = shards
+                old.queue.put(DummyStatusWorkerTask(barrier.set))
+            else:
+                self._worker_shards = shards
+                old.move_jobs(set(moved), worker)
+            self.logger.debug('Moved %d objects from %s to %s', len(moved), old.name, worker.name)
+
+    def get_triggered_programs(self, obj):
+        """
+            Give list of programs whose conditions and actions are triggered by the status changes of
+            given object.
+        """
+        return list(self._triggered_programs.get(obj, ()))
+
+    def get_targeting_programs(self, obj):
+        """
+            Give list of programs that have given object among their targets.
+        """
+        return list(self._targeting_programs.get(obj, ()))
+
+    def get_triggered_callables(self, obj):
+        """
+            Give list of (program, attribute name) pairs of program Callables that have given object
+            among their triggers.
+        """
+        return [(program, name) for program in self.get_triggered_programs(obj) for name in program.callables
+                if obj in getattr(program, name).triggers]
+
+    def update_trigger_index(self, program, removed, added):
+        """
+            Update reverse index of triggers. Called by programs when their actual triggers change.
+        """
+        with self._dependency_lock:
+            self._update_index(self._triggered_programs, program, removed, added, listen=True)
+            self._propagation_ranks = None
+            if self._check_loops:
+                self._queue_loop_check()
+
+    def update_target_index(self, program, removed, added):
+        """
+            Update reverse index of targets. Called by programs when their actual targets change.
+        """
+        with self._dependency_lock:
+            self._update_index(self._targeting_programs, program, removed, added)
+            self._propagation_ranks = None
+            if self._check_loops:
+                self._queue_loop_check()
+
+    def get_propagation_rank(self, program):
+        """
+            Give rank of program in topological order of the graph where objects point to programs
+            that they trigger and programs to their targets: a program has higher rank than the
+            programs whose targets trigger it. Objects in cycles get ranks after the acyclic part.
+            Used by ordered propagation (:attr:`ordered_propagation`).
+        """
+        ranks = self._propagation_ranks
+        if ranks is None:
+            with self._dependency_lock:
+                ranks = self._propagation_ranks = self._compute_propagation_ranks()
+        return ranks.get(program, 0)
+
+    def _dependency_graph(self):
+        # Successors of each node in the graph where objects point to programs that they trigger
+        # and programs to their targets
+        successors = defaultdict(set)
+        for obj, programs in self._triggered_programs.items():
+            successors[obj].update(p for p in programs if p is not obj)
+        for obj, programs in self._targeting_programs.items():
+            for program in programs:
+                if program is not obj:
+                    successors[program].add(obj)
+        return successors
+
+    def _compute_propagation_ranks(self):
+        successors = self._dependency_graph()
+        indegree = defaultdict(int)
+        for nodes in successors.values():
+            for node in nodes:
+                indegree[node] += 1
+        ranks = {}
+        ready = deque(node for node in successors if not indegree[node])
+        for node in ready:
+            ranks[node] = 0
+        while ready:
+            node = ready.popleft()
+            for successor in successors.get(node, ()):
+                ranks[successor] = max(ranks.get(successor, 0), ranks[node] + 1)
+                indegree[successor] -= 1
+                if not indegree[successor]:
+                    ready.append(successor)
+        # Nodes in cycles (and after them) were not reached
+        cycle_rank = max(ranks.values(), default=0) + 1
+        for node, degree in indegree.items():
+            if degree:
+                ranks[node] = cycle_rank
+        return ranks
+
+    def find_feedback_loops(self):
+        """
+            Give feedback loops of the trigger/target graph, i.e. its strongly connected components,
+            as lists of objects. In a loop, programs change status of their own (direct or indirect)
+            triggers, for example by SetStatus on an actuator that is also among their triggers.
+        """
+        with self._dependency_lock:
+            return self._find_feedback_loops()
+
+    def _find_feedback_loops(self):
+        # Called with _dependency_lock held
+        successors = self._dependency_graph()
+
+        # Tarjan's algorithm, iteratively
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        loops = []
+        counter = 0
+        for root in list(successors):
+            if root in index:
+                continue
+            work = [(root, iter(successors[root]))]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(successors.get(child, ()))))
+                        break
+                    elif child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member is node:
+                                break
+                        if len(component) > 1:
+                            loops.append(sorted(component, key=operator.attrgetter('name')))
+        return sorted(loops, key=lambda loop: loop[0].name)
+
+    def check_feedback_loops(self):
+        """
+            Update :attr:`feedback_loops` and log a warning of each new loop. Called when programs
+            are wired: after bulk wiring and, after initialization, in the worker thread after
+            triggers or targets have changed (see :meth:`_queue_loop_check`).
+        """
+        with self._dependency_lock:
+            self._loop_check_pending = False
+            loops = [[obj.name for obj in loop] for loop in self._find_feedback_loops()]
+            new_loops = [loop for loop in loops if loop not in self.feedback_loops]
+            self.feedback_loops = loops
+        for loop in new_loops:
+            self.logger.warning('Feedback loop detected: %s. Consider setting oscillation_limit '
+                                'to stop possible oscillation.', ', '.join(loop))
+        return loops
+
+    def _queue_loop_check(self):
+        # Called with _dependency_lock held. Graph is checked once in the worker thread after a
+        # series of rewiring changes, not on each change in the thread that makes it.
+        if not self._loop_check_pending:
+            self._loop_check_pending = True
+            self.worker_thread.queue.put(DummyStatusWorkerTask(self.check_feedback_loops))
+
+    @contextmanager
+    def bulk_wiring(self):
+        """
+            Context manager that defers wiring and activation of programs whose Callables, triggers
+            or targets change inside it (see :meth:`defer_program`). Used by
+            :meth:`~automate.namespace.Namespace.set_system` when Callables of all objects are set up.
+
+            On exit, active condition of each deferred program is evaluated once, reverse indices
+            are updated and worker shards computed once, program stacks of targets are updated in
+            one pass per target and finally activation actions of activated programs are run.
+        """
+        if self._deferred_programs is not None:
+            yield
+            return
+        self._deferred_programs = {}
+        try:
+            yield
+            deferred = self._deferred_programs
+        finally:
+            self._deferred_programs = None
+        self._apply_deferred_programs(deferred)
+
+    def defer_program(self, program, old_triggers=None, old_targets=None, update=False):
+        """
+            Called by programs when their Callables, triggers or targets change. In bulk wiring
+            mode, records the state of the program before the change and returns ``True``; program
+            then skips updating indices and evaluating its conditions. Otherwise returns ``False``.
+        """
+        deferred = self._deferred_programs
+        if deferred is None:
+            return False
+        state = deferred.get(program)
+        if state is None:
+            state = deferred[program] = {'active': program.active}
+        if old_triggers is not None:
+            state.setdefault('triggers', old_triggers)
+        if old_targets is not None:
+            state.setdefault('targets', old_targets)
+        if update:
+            state['update'] = True
+        return True
+
+    def _apply_deferred_programs(self, deferred):
+        if not deferred:
+            return
+        self.logger.debug('Applying %d deferred programs', len(deferred))
+        trigger_changes = []
+        target_changes = []
+        for program, state in deferred.items():
+            program._reset_changed_triggers()
+            if 'triggers' in state:
+                old, new = state['triggers'], program.actual_triggers
+                trigger_changes.append((program, old - new, new - old))
+            if 'targets' in state:
+                old, new = state['targets'], program.actual_targets
+                target_changes.append((program, old - new, new - old))
+
+        # Active conditions are evaluated before indices are updated, so that activation of
+        # a program does not re-evaluate conditions of other deferred programs. Conditions that
+        # depend on targets of other programs see their status before activation, and are
+        # evaluated again when activation actions change it (through the updated indices).
+        order = list(deferred)
+        for program in order:
+            program.active = bool(program.active_condition.call(program))
+
+        with self._dependency_lock:
+            self._update_index_bulk(self._triggered_programs, trigger_changes, listen=True)
+            self._update_index_bulk(self._targeting_programs, target_changes)
+            self._propagation_ranks = None
+        for program, removed, added in trigger_changes + target_changes:
+            self.link_worker_shards(program, added)
+        self.check_feedback_loops()
+
+        activated = []
+        stacks = defaultdict(list)
+        for program in order:
+            state = deferred[program]
+            if program.active and not state['active']:
+                activated.append(program)
+                for target in program.actual_targets:
+                    stacks[target].append(program)
+            elif state['active'] and not program.active:
+                program.update_activation(False)
+            elif program.active:
+                old_targets = state.get('targets', program.actual_targets)
+                for target in old_targets - program.actual_targets:
+                    target.deactivate_program(program)
+                for target in program.actual_targets - old_targets:
+                    stacks[target].append(program)
+        for target, programs in stacks.items():
+            target.activate_programs(programs)
+
+        for program in activated:
+            program.run_activation_actions()
+        for program in order:
+            if deferred[program].get('update') and program.active and program not in activated \
+                    and bool(program.update_condition.call(program)):
+                program.on_update.cancel(program)
+                program.on_update.call(program, action='update')
+
+    def _update_index_bulk(self, index, changes, listen=False):
+        # Like _update_index, for many programs at once: each index entry is replaced only once
+        removed_by_obj = defaultdict(list)
+        added_by_obj = defaultdict(list)
+        for program, removed, added in changes:
+            for obj in removed:
+                removed_by_obj[obj].append(program)
+            for obj in added:
+                added_by_obj[obj].append(program)
+        for obj in set(removed_by_obj) | set(added_by_obj):
+            old_programs = index.get(obj, {})
+            programs = dict(old_programs)
+            for program in removed_by_obj.get(obj, ()):
+                programs.pop(program, None)
+            for program in added_by_obj.get(obj, ()):
+                programs[program] = None
+            if programs:
+                if not old_programs and listen:
+                    obj.on_trait_change(self._dispatch_status_change, 'status')
+                index[obj] = programs
+            elif index.pop(obj, None) is not None and listen:
+                obj.on_trait_change(self._dispatch_status_change, 'status', remove=True)
+
+    def _update_index(self, index, program, removed, added, listen=False):
+        for obj in removed:
+            programs = dict(index.get(obj, {}))
+            programs.pop(program, None)
+            if programs:
+                index[obj] = programs
+            elif index.pop(obj, None) is not None and listen:
+                obj.on_trait_change(self._dispatch_status_change, 'status', remove=True)
+        for obj in added:
+            if obj not in index and listen:
+                obj.on_trait_change(self._dispatch_status_change, 'status')
+            programs = dict(index.get(obj, {}))
+            programs[program] = None
+            index[obj] = programs
+
+    def _dispatch_status_change(self, obj, name, old, new):
+        if self.oscillation_limit and not self.get_worker(obj).register_change(obj):
+            return
+        for program in self._triggered_programs.get(obj, ()):
+            try:
+                program.trigger_status_changed(obj, name, old, new)
+            except SystemNotReady:
+                pass
+            except Exception as e:
+                if self.raven_client:
+                    self.raven_client.captureException()
+                self.logger.exception('Error when triggering %s by %s: %s', program, obj, e)
 
     def name_to_system_object(self, name):
         """
@@ -403,9 +1104,7 @@ class System(SystemBase):
         self.pre_exit_trigger = True
 
         self.logger.info("Shutting down %s, please wait a moment.", self.name)
-        for t in threading.enumerate():
-            if isinstance(t, TimerClass):
-                t.cancel()
+        self.scheduler.cancel_all()
         self.logger.debug('Timers cancelled')
 
         for i in self.objects:
@@ -416,9 +1115,14 @@ class System(SystemBase):
         for ser in (i for i in self.services if isinstance(i, AbstractUserService)):
             ser.cleanup_system()
         self.logger.debug('User services cleaned up')
-        if self.worker_thread.is_alive():
-            self.worker_thread.stop()
-        self.logger.debug('Worker thread really stopped')
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.stop()
+        self.logger.debug('Worker threads really stopped')
+        self.wait_state_saved()
+        if self.journal:
+            self.journal.close()
+        self.scheduler.stop()
 
         for ser in (i for i in self.services if isinstance(i, AbstractSystemService)):
             ser.cleanup_system()
@@ -427,6 +1131,8 @@ class System(SystemBase):
         if threads:
             self.logger.info('After cleanup, we have still the following threads '
                              'running: %s', ', '.join(threads))
+        if self.log_listener:
+            self._stop_async_logging()
 
     def cmd_exec(self, cmd):
         """
@@ -475,37 +1181,84 @@ class System(SystemBase):
 
     def __init__(self, load_state: 'List[SystemObject]'=None, load_config: 'Dict[str, Any]'=None,
                  **traits):
-        super().__init__(**traits)
+        report = self.startup_report = StartupReport()
+        with report.phase('traits'):
+            super().__init__(**traits)
+        self._triggered_programs = {}
+        self._targeting_programs = {}
+        self._dependency_lock = Lock('dependencylock')
+        if self.lock_profiling:
+            lock_profiler.enable()
         if not self.name:
             self.name = self.__class__.__name__
             if self.name == 'System':
                 self.name = os.path.split(sys.argv[0])[-1].replace('.py', '')
 
-        # Initialize Sentry / raven client, if is configured
-        if not self.raven_client and self.raven_dsn:
-            self.raven_client = raven.Client(self.raven_dsn, release=__version__,
-                                             tags={'automate-system': self.name})
-
-        self._initialize_logging()
-        self.worker_thread = StatusWorkerThread(name="Status worker thread", system=self)
+        with report.phase('logging'):
+            # Initialize Sentry / raven client, if is configured
+            if not self.raven_client and self.raven_dsn:
+                import raven
+                from . import __version__
+                self.raven_client = raven.Client(self.raven_dsn, release=__version__,
+                                                 tags={'automate-system': self.name})
+
+            self._initialize_logging()
+            if self.async_logging:
+                self._initialize_async_logging()
+        with report.phase('workers'):
+            self.workers = [StatusWorkerThread(name="Status worker thread" + (" %d" % i if i else ""), system=self,
+                                               coalesce=self.coalesce_status_changes,
+                                               batch_size=self.worker_batch_size,
+                                               ordered=self.ordered_propagation,
+                                               oscillation_limit=self.oscillation_limit,
+                                               oscillation_quarantine=self.oscillation_quarantine)
+                            for i in range(max(1, self.worker_threads))]
+            self.worker_thread = self.workers[0]
+            if self.state_journal and self.filename:
+                self.journal = StateJournal(self.filename + '.journal')
+            self.scheduler = Scheduler(system=self, num_threads=self.scheduler_threads)
+            self.scheduler.start()
         self.logger.info('Initializing services')
-        self._initialize_services()
+        with report.phase('services'):
+            self._initialize_services()
         self.logger.info('Initializing namespace')
         self._initialize_namespace(load_state)
 
         if load_config:
             self.logger.info('Loading config')
-            for obj_name, status in load_config.items():
-                if hasattr(self, obj_name):
-                    getattr(self, obj_name).status = status
+            with report.phase('config'):
+                for obj_name, status in load_config.items():
+                    if hasattr(self, obj_name):
+                        getattr(self, obj_name).status = status
+
+        if len(self.workers) > 1:
+            self.logger.info('Dividing objects between %d worker threads', len(self.workers))
+            with report.phase('worker shards'):
+                # Jobs queued so far are all in the first worker, process them before objects are moved
+                self.manual_flush()
+                self._worker_shards = {}
+                self.update_worker_shards()
 
         self.logger.info('Initialize user services')
-        self._setup_user_services()
+        with report.phase('user services'):
+            self._setup_user_services()
 
         if self.worker_autostart:
-            self.logger.info('Starting worker thread')
-            self.worker_thread.start()
-
+            self.logger.info('Starting worker threads')
+            with report.phase('start workers'):
+                for worker in self.workers:
+                    worker.start()
+
+        report.counts.update([
+            ('objects', len(self.objects)),
+            ('programs', len(self.programs)),
+            ('trigger links', sum(len(i) for i in self._triggered_programs.values())),
+            ('target links', sum(len(i) for i in self._targeting_programs.values())),
+            ('services', len(self.services)),
+        ])
+        self.logger.info('System initialized in %.3f s', report.total)
+        self.logger.debug(report.format())
+        self._check_loops = True
         self.post_init_trigger = True
 
     def _initialize_logging(self):
@@ -524,6 +1277,7 @@ class System(SystemBase):
         self.logger.setLevel(self.log_level)
 
         if self.raven_client:
+            from raven.handlers.logging import SentryHandler
             sentry_handler = SentryHandler(client=self.raven_client, level=logging.ERROR)
             root_logger.addHandler(sentry_handler)
 
@@ -544,17 +1298,87 @@ class System(SystemBase):
 
         self.logger.info('Logging setup ready')
 
+    def _initialize_async_logging(self):
+        from logging.handlers import QueueHandler, QueueListener
+
+        class _QueueHandler(QueueHandler):
+            def prepare(self, record):
+                # Message is merged with its arguments and traceback formatted here, as arguments
+                # may change (and traceback be cleared) before the listener thread handles the
+                # record. Formatting by handlers (colors, HTML) is left to the listener thread.
+                record = copy.copy(record)
+                record.msg = record.getMessage()
+                record.args = None
+                if record.exc_info:
+                    if not record.exc_text:
+                        record.exc_text = logging.Formatter().formatException(record.exc_info)
+                    record.exc_info = None
+                return record
+
+        class _DispatchHandler(logging.Handler):
+            def __init__(self, logger):
+                super().__init__()
+                self.logger = logger
+                self.handlers = []
+
+            def handle(self, record):
+                # As if record was propagated from self.logger
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                if self.logger.parent:
+                    self.logger.parent.callHandlers(record)
+
+        log_queue = queue.Queue()
+        self._log_dispatcher = _DispatchHandler(self.logger)
+        self._log_dispatcher.queue_handler = _QueueHandler(log_queue)
+        self.log_listener = QueueListener(log_queue, self._log_dispatcher)
+        self.logger.addHandler(self._log_dispatcher.queue_handler)
+        self.logger.propagate = False
+        self.log_listener.start()
+
+    def _stop_async_logging(self):
+        # Handle the remaining records and continue logging synchronously
+        dispatcher = self._log_dispatcher
+        self.logger.removeHandler(dispatcher.queue_handler)
+        self.log_listener.stop()
+        for handler in dispatcher.handlers:
+            self.logger.addHandler(handler)
+        self.logger.propagate = True
+        self._log_dispatcher = self.log_listener = None
+
+    def add_log_handler(self, handler):
+        """
+            Add handler to the system logger. If :attr:`async_logging` is enabled, handler is
+            called in the log listener thread.
+        """
+        if self._log_dispatcher:
+            self._log_dispatcher.handlers.append(handler)
+        else:
+            self.logger.addHandler(handler)
+
+    def flush_logs(self):
+        """
+            Wait until log listener has handled all queued log records (if :attr:`async_logging`
+            is enabled).
+        """
+        if self.log_listener:
+            self.log_listener.queue.join()
+
     def _initialize_namespace(self, load_state=None):
         self.namespace = Namespace(system=self)
         self.namespace.set_system(load_state)
 
         self.logger.info('Setup loggers per object')
-        for name, obj in self.namespace.items():
-            if isinstance(obj, SystemObject):
-                ctype = obj.__class__.__name__
-                obj.logger = self.logger.getChild('%s.%s' % (ctype, name))
+        with self.startup_report.phase('loggers'):
+            for name, obj in self.namespace.items():
+                if isinstance(obj, SystemObject):
+                    ctype = obj.__class__.__name__
+                    obj.logger = self.logger.getChild('%s.%s' % (ctype, name))
 
     def _initialize_services(self):
+        # Autoload services may be defined in extensions, so all extensions are loaded here
+        load_extensions()
         # Add default_services, if not already
         for servname in self.default_services:
             if servname not in self.service_names | self.exclude_services:
@@ -570,25 +1394,3 @@ class System(SystemBase):
             self.logger.info('...%s', ser.__class__.__name__)
             ser.setup_system(self)
 
-
-# Load extensions
-
-from . import services, sensors, actuators, callables
-print('Loading extensions')
-for entry_point in pkg_resources.iter_entry_points('automate.extension'):
-    print('Trying to load extension %s' % entry_point)
-    try:
-        ext_classes = entry_point.load(require=False)
-    except ImportError:
-        print('Loading extension %s failed. Perhaps missing requirements? Skipping.' % entry_point)
-        continue
-    for ext_class in ext_classes:
-        print('... %s' % ext_class.__name__)
-        if issubclass(ext_class, AbstractService):
-            setattr(services, ext_class.__name__, ext_class)
-        elif issubclass(ext_class, AbstractSensor):
-            setattr(sensors, ext_class.__name__, ext_class)
-        elif issubclass(ext_class, AbstractActuator):
-            setattr(actuators, ext_class.__name__, ext_class)
-        elif issubclass(ext_class, AbstractCallable):
-            setattr(callables, ext_class.__name__, ext_class)
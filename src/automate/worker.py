@@ -21,9 +21,13 @@
 # If you like Automate, please take a look at this page:
 # http://evankelista.net/automate/
 
+import heapq
+import itertools
 import queue
 import logging
 import threading
+import time
+from collections import OrderedDict, deque
 
 
 class StatusWorkerTask:
@@ -70,17 +74,115 @@ class DummyStatusWorkerTask:
         return '<Dummy %s %s %s>' % (self.func, self.args, self.kwargs)
 
 
+class StatusChangeTask(DummyStatusWorkerTask):
+
+    """
+        Status change of a particular StatusObject. If worker is in coalescing mode,
+        later change requests of the same object are merged into pending (coalescable)
+        task, instead of adding new tasks to the queue.
+    """
+
+    def __init__(self, object, func, args, kwargs=None, coalescable=True):
+        super().__init__(func, *args, **(kwargs or {}))
+        self.object = object
+        self.coalescable = coalescable
+
+    @property
+    def status(self):
+        return self.args[0]
+
+    def merge(self, other):
+        kwargs = dict(other.kwargs)
+        if self.kwargs.get('force', False):
+            kwargs['force'] = True
+        self.args = other.args
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return '<StatusChange %s %s %s>' % (self.object, self.args, self.kwargs)
+
+
 class StatusWorkerThread(threading.Thread):
 
     def _set_stop(self):
         self._stop_now = True
         self.logger.debug('Stop set')
 
-    def __init__(self, system=None, *args, **kwargs):
+    def __init__(self, system=None, *args, coalesce=False, batch_size=1, ordered=False, oscillation_limit=0,
+                 oscillation_quarantine=10., **kwargs):
         self.queue = queue.Queue()
         self._stop_now = False
         self.system = system
         self.logger = system.logger.getChild('StatusWorkerThread')
+
+        #: If True, keep at most one pending status change per object in the queue
+        self.coalesce = coalesce
+        # Pending coalescable tasks, by object
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+        #: Number of status changes put in queue
+        self.num_status_changes = 0
+        #: Number of status changes that were merged into already pending changes
+        self.num_coalesced = 0
+
+        #: Maximum number of jobs processed per wake-up (0: all that are available). If other than 1,
+        #: program trigger evaluations are postponed to the end of the batch, and each program is
+        #: evaluated only once per batch.
+        self.batch_size = batch_size
+        # Programs whose triggers have changed during the current batch, with the latest trigger
+        self._deferred_triggers = None
+
+        #: Number of processed batches
+        self.num_batches = 0
+        #: Number of program evaluations that were saved by batching
+        self.num_batched_triggers = 0
+
+        #: If True, status changes are propagated in waves: programs are evaluated in topological
+        #: order of the trigger/target graph (see :meth:`System.get_propagation_rank`), each at most
+        #: once per wave, and status changes caused by them are applied within the same wave.
+        #: Status of an object is changed at most once per wave: further changes (such as
+        #: reset of an event sensor) are postponed to the next wave.
+        self.ordered = ordered
+        # Programs waiting for evaluation in the current wave, as a heap of (rank, seq, program)
+        self._wave_heap = None
+        # Jobs put by this thread during the current wave
+        self._wave_jobs = None
+        # Programs evaluated in the current wave
+        self._wave_evaluated = None
+        # Objects whose status has changed (and triggered programs) in the current wave
+        self._wave_changed = None
+        # Programs triggered again after their evaluation in the current wave, evaluated in the next
+        self._next_wave = None
+        # Jobs carried over to the next wave (postponed status changes and next wave triggers).
+        # They are processed before the jobs in the queue, and they are counted in unfinished
+        # tasks of the queue until then.
+        self._carry_over = []
+        self._wave_counter = itertools.count()
+
+        #: Number of processed waves
+        self.num_waves = 0
+        #: Number of program evaluations that were saved by ordered propagation (triggers that
+        #: were merged into evaluation that was already pending in the same wave)
+        self.num_saved_evaluations = 0
+        #: Number of programs that were triggered again after their evaluation in a wave, and
+        #: were evaluated in the next wave
+        self.num_next_wave_triggers = 0
+        #: Number of status changes that were postponed to the next wave, because status of
+        #: the object had already changed in the wave
+        self.num_postponed_changes = 0
+
+        #: Maximum number of status changes per second of an object that triggers programs
+        #: (0: no limit). Objects that change more often are quarantined (see :meth:`register_change`).
+        self.oscillation_limit = oscillation_limit
+        #: Duration of quarantine, in seconds
+        self.oscillation_quarantine = oscillation_quarantine
+        # Times of the latest status changes, by object
+        self._change_times = {}
+        #: Quarantined objects, with the time when their quarantine ends
+        self.quarantined = {}
+        #: Number of status changes that did not trigger programs because object was quarantined
+        self.num_quarantined_changes = 0
         super().__init__(*args, **kwargs)
 
     def manual_flush(self):
@@ -92,20 +194,181 @@ class StatusWorkerThread(threading.Thread):
         while self.queue.queue:
             self.process_job()
 
-    def process_job(self):
-        job = self.queue.get()
+    def _run_job(self, job):
+        if self.coalesce and isinstance(job, StatusChangeTask):
+            with self._pending_lock:
+                if self._pending.get(job.object) is job:
+                    del self._pending[job.object]
         try:
             job.run()
         except Exception as e:
             if self.system.raven_client:
                 self.system.raven_client.captureException()
             self.logger.exception('Error occurred when executing job %s: %s', job, e)
+
+    def process_job(self):
+        job = self.queue.get()
+        self._run_job(job)
         self.queue.task_done()
 
+    def defer_trigger(self, program, trigger):
+        """
+            Called by programs when their trigger status has changed. If a batch is being processed
+            (in worker thread), evaluation is postponed to the end of the batch and True is returned.
+        """
+        deferred = self._deferred_triggers
+        if deferred is None or threading.current_thread() is not self:
+            return False
+        if self._wave_heap is not None:
+            self._defer_to_wave(program, trigger)
+            return True
+        if program in deferred:
+            self.num_batched_triggers += 1
+            # Keep the order of the latest change
+            del deferred[program]
+        deferred[program] = trigger
+        return True
+
+    def _defer_to_wave(self, program, trigger, changed=True):
+        deferred = self._deferred_triggers
+        if changed:
+            self._wave_changed.add(trigger)
+        if program in self._wave_evaluated:
+            self.num_next_wave_triggers += 1
+            self._next_wave[program] = trigger
+        elif program in deferred:
+            self.num_saved_evaluations += 1
+            deferred[program] = trigger
+        else:
+            deferred[program] = trigger
+            heapq.heappush(self._wave_heap, (self.system.get_propagation_rank(program),
+                                             next(self._wave_counter), program))
+
+    def register_change(self, obj):
+        """
+            Called when status of an object that triggers programs has changed. Returns False if
+            the object is quarantined, i.e. the change must not trigger programs. An object is put
+            in quarantine when it has changed more than :attr:`oscillation_limit` times within a
+            second. When quarantine ends, programs are triggered with the latest status of the object.
+        """
+        now = time.time()
+        if obj in self.quarantined:
+            self.num_quarantined_changes += 1
+            return False
+        times = self._change_times.get(obj)
+        if times is None:
+            times = self._change_times[obj] = deque(maxlen=self.oscillation_limit + 1)
+        times.append(now)
+        if len(times) <= self.oscillation_limit or now - times[0] >= 1.:
+            return True
+
+        times.clear()
+        self.quarantined[obj] = now + self.oscillation_quarantine
+        self.num_quarantined_changes += 1
+        obj.quarantined = True
+        self.logger.warning('%s changed status more than %d times per second (possible feedback loop), its '
+                            'changes do not trigger programs for %s seconds', obj, self.oscillation_limit,
+                            self.oscillation_quarantine)
+        self.system.scheduler.call_later(
+            self.oscillation_quarantine, self.put, args=(DummyStatusWorkerTask(self._release, obj),),
+            name='Quarantine of %s' % obj.name)
+        return False
+
+    def _release(self, obj):
+        self.quarantined.pop(obj, None)
+        obj.quarantined = False
+        self.logger.info('Quarantine of %s ended', obj)
+        self.system._dispatch_status_change(obj, 'status', None, obj.status)
+
+    def _get_jobs(self):
+        jobs, self._carry_over = self._carry_over, []
+        if not jobs:
+            jobs.append(self.queue.get())
+        with self.queue.mutex:
+            waiting = self.queue.queue
+            while waiting and (not self.batch_size or len(jobs) < self.batch_size):
+                jobs.append(waiting.popleft())
+        return jobs
+
+    def _evaluate(self, program, trigger):
+        try:
+            program.evaluate_conditions(trigger)
+        except Exception as e:
+            if self.system.raven_client:
+                self.system.raven_client.captureException()
+            self.logger.exception('Error occurred when evaluating %s: %s', program, e)
+
+    def process_wave(self):
+        """
+            Process a batch of jobs and the change wave caused by them: programs triggered in the
+            wave are evaluated in the order of their propagation rank, and jobs that are put
+            by the evaluations are run before the next program is evaluated. Jobs that would
+            change status of an object for the second time in the wave are carried over to the
+            next wave, before the jobs that are waiting in the queue.
+        """
+        jobs = self._get_jobs()
+        self._deferred_triggers = deferred = {}
+        self._wave_heap = heap = []
+        self._wave_jobs = wave_jobs = deque(jobs)
+        self._wave_evaluated = evaluated = set()
+        self._wave_changed = changed = set()
+        self._next_wave = next_wave = OrderedDict()
+        postponed = []
+        try:
+            while True:
+                while wave_jobs:
+                    job = wave_jobs.popleft()
+                    if getattr(job, 'object', None) in changed:
+                        postponed.append(job)
+                    else:
+                        self._run_job(job)
+                if not heap:
+                    break
+                rank, seq, program = heapq.heappop(heap)
+                evaluated.add(program)
+                self._evaluate(program, deferred.pop(program))
+        finally:
+            self._deferred_triggers = self._wave_heap = self._wave_jobs = None
+            self._wave_evaluated = self._wave_changed = self._next_wave = None
+
+        self.num_postponed_changes += len(postponed)
+        carry_over = postponed + [DummyStatusWorkerTask(self._defer_to_wave, program, trigger, changed=False)
+                                  for program, trigger in next_wave.items()]
+        if carry_over:
+            with self.queue.mutex:
+                self.queue.unfinished_tasks += len(carry_over)
+            self._carry_over = carry_over
+        self.num_waves += 1
+        for job in jobs:
+            self.queue.task_done()
+
+    def process_batch(self):
+        jobs = self._get_jobs()
+
+        self._deferred_triggers = deferred = OrderedDict()
+        try:
+            for job in jobs:
+                self._run_job(job)
+        finally:
+            self._deferred_triggers = None
+
+        for program, trigger in deferred.items():
+            self._evaluate(program, trigger)
+
+        self.num_batches += 1
+        for job in jobs:
+            self.queue.task_done()
+
     def run(self):
         self.logger.debug('StatusWorkerThread starting')
-        while not self._stop_now:
-            self.process_job()
+        # Jobs carried over from the last wave are processed also after stop, as they precede it
+        while not self._stop_now or self._carry_over:
+            if self.ordered:
+                self.process_wave()
+            elif self.batch_size == 1:
+                self.process_job()
+            else:
+                self.process_batch()
 
         self.logger.debug('StatusWorkerThread exiting, entries: %s', self.queue.queue)
 
@@ -120,7 +383,54 @@ class StatusWorkerThread(threading.Thread):
 
     def put(self, job):
         self.logger.debug('Putting now %s', id(job))
-        self.queue.put(job)
+        if self._wave_jobs is not None and threading.current_thread() is self:
+            if isinstance(job, StatusChangeTask):
+                self.num_status_changes += 1
+            self._wave_jobs.append(job)
+            return
+        if not isinstance(job, StatusChangeTask):
+            self.queue.put(job)
+            return
+
+        self.num_status_changes += 1
+        if not self.coalesce:
+            self.queue.put(job)
+            return
+
+        with self._pending_lock:
+            pending = self._pending.get(job.object)
+            if job.coalescable:
+                if pending is not None:
+                    pending.merge(job)
+                    self.num_coalesced += 1
+                    return
+                self._pending[job.object] = job
+            elif pending is not None:
+                # Following requests must not be merged into a task that precedes this one
+                del self._pending[job.object]
+            self.queue.put(job)
+
+    def move_jobs(self, objects, worker):
+        """
+            Move queued jobs of given objects to another worker (when worker threads are not running).
+        """
+        with self._pending_lock:
+            for obj in objects:
+                pending = self._pending.pop(obj, None)
+                if pending is not None:
+                    with worker._pending_lock:
+                        worker._pending[obj] = pending
+        with self.queue.mutex:
+            jobs = self.queue.queue
+            moved = [job for job in jobs if getattr(job, 'object', None) in objects]
+            if not moved:
+                return
+            self.queue.queue = deque(job for job in jobs if getattr(job, 'object', None) not in objects)
+            self.queue.unfinished_tasks -= len(moved)
+            if not self.queue.unfinished_tasks:
+                self.queue.all_tasks_done.notify_all()
+        for job in moved:
+            worker.queue.put(job)
 
     def stop(self):
         self.logger.debug('Stopping: pre-flush')
@@ -161,7 +161,7 @@ def test_lock(sysloader):
     flag = []
 
     def locktst():
-        assert l.context
+        assert l.locked()
         l.release()
         flag.append(1)
     c = s.prg.on_deactivate = Delay(0.2, Func(locktst))
@@ -174,6 +174,41 @@ def test_lock(sysloader):
     l.release() # final release.
 
 
+def test_lock_profiler():
+    import threading
+    from automate.lockprofile import LockProfiler, lock_profiler
+
+    l = Lock('profiled')
+    lock_profiler.reset()
+    with l:
+        pass
+    assert 'profiled' not in lock_profiler.stats
+
+    lock_profiler.enable()
+    try:
+        for i in range(2):
+            l.acquire()
+            threading.Timer(0.05, l.release).start()
+            with l:
+                pass
+    finally:
+        lock_profiler.disable()
+    stats = lock_profiler.stats['profiled']
+    assert stats.count == 2
+    assert 0.04 < stats.max < stats.total
+    assert sum(stats.histogram) == 2
+    stack, (count, total) = stats.top_waiters()[0]
+    assert count == 2
+    assert 'test_lock_profiler' in stack[-1]
+
+    report = lock_profiler.report()
+    assert report[0]['name'] == 'profiled'
+    assert (0.1, 2) in report[0]['histogram']
+    assert 'profiled: 2 waits' in lock_profiler.format()
+    assert LockProfiler().format() == 'No lock contention recorded'
+    lock_profiler.reset()
+
+
 def test_sysobject_callable(sysloader):
     class mysys(System):
         mysens = UserIntSensor(on_activate=Run('mycal'), priority=50)
@@ -302,3 +337,545 @@ def test_setup_system(sysloader):
 #    g.start()
 #    g.stop = True
 #    g.trigger()
+
+
+def test_scheduler_call_later(sysloader):
+    class mysys(System):
+        s = UserIntSensor()
+    s = sysloader.new_system(mysys)
+    called = []
+    handle = s.scheduler.call_later(0.1, called.append, args=(1,))
+    assert handle.is_alive()
+    assert handle in s.scheduler.pending
+    time.sleep(0.3)
+    assert called == [1]
+    assert not handle.is_alive()
+    assert handle not in s.scheduler.pending
+
+
+def test_scheduler_cancel(sysloader):
+    class mysys(System):
+        s = UserIntSensor()
+    s = sysloader.new_system(mysys)
+    called = []
+    handles = [s.scheduler.call_later(0.1, called.append, args=(i,)) for i in range(3)]
+    assert handles[1].cancel()
+    assert not handles[1].is_alive()
+    assert not handles[1].cancel()
+    time.sleep(0.3)
+    assert sorted(called) == [0, 2]
+
+
+def test_scheduler_order(sysloader):
+    class mysys(System):
+        s = UserIntSensor()
+    s = sysloader.new_system(mysys)
+    called = []
+    s.scheduler.call_later(0.2, called.append, args=(2,))
+    s.scheduler.call_later(0.1, called.append, args=(1,))
+    time.sleep(0.4)
+    assert called == [1, 2]
+
+
+def test_scheduler_cleanup_cancels():
+    class mysys(System):
+        s = UserIntSensor()
+    s = mysys(exclude_services=['TextUIService'])
+    called = []
+    handle = s.scheduler.call_later(0.1, called.append, args=(1,))
+    s.cleanup()
+    assert handle.cancelled
+    time.sleep(0.2)
+    assert not called
+    assert s.scheduler.call_later(0, called.append, args=(1,)).cancelled
+
+
+def test_coalesce_status_changes():
+    class mysys(System):
+        s1 = UserIntSensor()
+        s2 = UserIntSensor()
+    s = mysys(exclude_services=['TextUIService'], coalesce_status_changes=True, worker_autostart=False)
+    s.worker_thread.manual_flush()
+    worker = s.worker_thread
+    num_changes = worker.num_status_changes
+    for i in range(1, 101):
+        s.s1.status = i
+    s.s2.status = 5
+    s.s1.status = 200
+    assert worker.num_status_changes - num_changes == 102
+    assert worker.num_coalesced == 100
+    assert [job.object for job in worker.queue.queue] == [s.s1, s.s2]
+    worker.manual_flush()
+    assert s.s1.status == 200
+    assert s.s2.status == 5
+    s.s1.status = 201
+    assert len(worker.queue.queue) == 1
+    worker.manual_flush()
+    assert s.s1.status == 201
+    s.cleanup()
+
+
+def test_no_coalesce_by_default():
+    class mysys(System):
+        s1 = UserIntSensor()
+    s = mysys(exclude_services=['TextUIService'], worker_autostart=False)
+    s.worker_thread.manual_flush()
+    for i in range(1, 11):
+        s.s1.status = i
+    assert len(s.worker_thread.queue.queue) == 10
+    assert s.worker_thread.num_coalesced == 0
+    s.worker_thread.manual_flush()
+    assert s.s1.status == 10
+    s.cleanup()
+
+
+@pytest.mark.parametrize('batch_size, evaluations', [(1, 50), (0, 1), (10, 5)])
+def test_worker_batch(batch_size, evaluations):
+    import threading
+    from automate.worker import DummyStatusWorkerTask
+    called = []
+
+    class mysys(System):
+        s1 = UserIntSensor()
+        act = IntActuator()
+        prog = Program(triggers=[s1],
+                       on_update=Run(Func(called.append, TriggeredBy(), return_value=False),
+                                     SetStatus(act, s1)))
+    s = mysys(exclude_services=['TextUIService'], worker_batch_size=batch_size)
+    s.flush()
+    called.clear()
+    release = threading.Event()
+    s.worker_thread.put(DummyStatusWorkerTask(release.wait))
+    for i in range(1, 51):
+        s.s1.status = i
+    release.set()
+    s.flush()
+    assert len(called) == evaluations
+    assert set(called) == {s.s1}
+    assert s.act.status == 50
+    if batch_size != 1:
+        assert s.worker_thread.num_batched_triggers == 50 - evaluations
+    s.cleanup()
+
+
+@pytest.mark.parametrize('ordered, evaluations', [(False, 2), (True, 1)])
+def test_ordered_propagation(ordered, evaluations):
+    called = []
+
+    class mysys(System):
+        s1 = UserIntSensor()
+        mid = IntActuator()
+        out = IntActuator()
+        # Defined first, so that it is also first in trigger index of s1
+        prog_b = Program(triggers=[s1, mid],
+                         on_update=Run(Func(called.append, TriggeredBy(), return_value=False),
+                                       SetStatus(out, Add(s1, mid))))
+        prog_a = Program(on_update=SetStatus(mid, Mult(s1, 10)))
+    s = mysys(exclude_services=['TextUIService'], ordered_propagation=ordered)
+    s.flush()
+    assert s.get_propagation_rank(s.prog_a) < s.get_propagation_rank(s.mid) < s.get_propagation_rank(s.prog_b)
+    called.clear()
+    s.out.history.clear()
+    s.s1.status = 1
+    s.flush()
+    assert len(called) == evaluations
+    assert s.out.status == 11
+    assert [status for t, status in s.out.history] == ([1, 11] if not ordered else [11])
+    if ordered:
+        assert s.worker_thread.num_saved_evaluations >= 1
+        assert s.worker_thread.num_waves > 0
+    s.cleanup()
+
+
+def test_ordered_propagation_postponed_order():
+    import threading
+    from automate.worker import DummyStatusWorkerTask
+
+    class mysys(System):
+        s1 = UserIntSensor()
+        out = IntActuator()
+        prog = Program(on_update=SetStatus(out, s1))
+    s = mysys(exclude_services=['TextUIService'], ordered_propagation=True, worker_batch_size=2)
+    s.flush()
+    s.s1.history.clear()
+    started, release = threading.Event(), threading.Event()
+    s.worker_thread.put(DummyStatusWorkerTask(lambda: started.set() or release.wait()))
+    started.wait()
+    for i in (1, 2, 3):
+        s.s1.status = i
+    release.set()
+    s.flush()
+    # Change that is postponed to the next wave is applied before changes queued after it
+    assert s.worker_thread.num_postponed_changes == 2
+    assert [status for t, status in s.s1.history] == [1, 2, 3]
+    assert s.out.status == 3
+    s.cleanup()
+
+
+def test_ordered_propagation_stop():
+    from automate.worker import DummyStatusWorkerTask
+
+    class mysys(System):
+        s1 = UserIntSensor()
+        out = IntActuator()
+        prog = Program(on_update=SetStatus(out, s1))
+    s = mysys(exclude_services=['TextUIService'], ordered_propagation=True, worker_batch_size=0,
+              worker_autostart=False)
+    worker = s.worker_thread
+    s.s1.status = 1
+    s.s1.status = 2
+    worker.put(DummyStatusWorkerTask(worker._set_stop))
+    worker.start()
+    worker.join(5)
+    # Change that was postponed to the next wave is not lost when worker stops after the wave
+    assert not worker.is_alive()
+    assert worker.num_postponed_changes == 1
+    assert s.s1.status == 2 and s.out.status == 2
+    assert not worker.queue.unfinished_tasks
+    s.cleanup()
+
+
+def test_feedback_loops():
+    class mysys(System):
+        s1 = UserBoolSensor()
+        act = BoolActuator()
+        act2 = BoolActuator()
+        prog = Program(triggers=[act], on_update=SetStatus(act, Not(act)))
+        prog2 = Program(on_update=SetStatus(act2, s1))
+    s = mysys(exclude_services=['TextUIService'], oscillation_limit=5, oscillation_quarantine=0.5)
+    assert s.feedback_loops == [['act', 'prog']]
+    assert [[obj.name for obj in loop] for loop in s.find_feedback_loops()] == [['act', 'prog']]
+
+    # Rewiring after initialization is checked too, once, in the worker thread
+    with s.pause_workers():
+        s.prog2.triggers = [s.act2]
+        s.prog2.triggers = [s.act2, s.s1]
+        assert s._loop_check_pending
+        assert s.feedback_loops == [['act', 'prog']]
+        checks = [i for i in s.worker_thread.queue.queue if getattr(i, 'func', None) == s.check_feedback_loops]
+        assert len(checks) == 1
+    s.flush()
+    assert not s._loop_check_pending
+    assert s.feedback_loops == [['act', 'prog'], ['act2', 'prog2']]
+    s.prog2.triggers = []
+    s.flush()
+    assert s.feedback_loops == [['act', 'prog']]
+
+    # Program keeps toggling act, until it is quarantined
+    s.flush()
+    worker = s.get_worker(s.act)
+    assert s.act.quarantined
+    assert s.act in worker.quarantined
+    assert worker.num_quarantined_changes > 0
+    num_changes = len(s.act.history)
+
+    # Other objects are not affected
+    s.s1.status = True
+    s.flush()
+    assert s.act2.status
+    assert not s.act2.quarantined
+
+    # After quarantine, programs are triggered again (and here, quarantined again)
+    time.sleep(0.7)
+    s.flush()
+    assert len(s.act.history) > num_changes
+    assert s.act.quarantined
+    s.cleanup()
+
+
+def test_async_logging():
+    import logging
+    import threading
+
+    class mysys(System):
+        s1 = UserBoolSensor()
+        act = BoolActuator()
+        prog = Program(on_update=SetStatus(act, s1))
+    s = mysys(exclude_services=['TextUIService'], async_logging=True)
+    threads = []
+
+    records = []
+
+    class ThreadHandler(logging.Handler):
+        def emit(self, record):
+            threads.append((threading.current_thread(), record.getMessage()))
+            records.append(record)
+    s.add_log_handler(ThreadHandler())
+
+    s.s1.status = True
+    s.flush()
+    assert threads
+    assert all(thread is not threading.current_thread() and thread not in s.workers for thread, msg in threads)
+    assert any('setting status to True' in msg for thread, msg in threads)
+    assert 'setting status to True' in s.request_service('LogStoreService').lastlog(html=False)
+
+    # Message is merged with its arguments and traceback formatted when logging, not in listener thread
+    items = ['a']
+    s.logger.warning('Items: %s', items)
+    items.append('b')
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        s.logger.warning('Failed', exc_info=True)
+    s.flush()
+    by_msg = {record.msg: record for record in records}
+    assert by_msg["Items: ['a']"].args is None
+    assert by_msg['Failed'].exc_info is None and 'ZeroDivisionError' in by_msg['Failed'].exc_text
+
+    logger = s.logger
+    s.cleanup()
+    assert s.log_listener is None
+    assert logger.propagate
+    assert not any(isinstance(h, logging.handlers.QueueHandler) for h in logger.handlers)
+    # Logger is shared with other systems of the same name
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+
+def test_log_ring():
+    import logging
+    from automate.services.logstore import LogRing
+    from colorlog import ColoredFormatter
+
+    ring = LogRing(10)
+    for i in range(25):
+        name = 'automate.sys.ArduinoService.0' if i % 3 == 0 else 'automate.sys.other'
+        level = logging.WARNING if i % 2 else logging.INFO
+        ring.handle(logging.LogRecord(name, level, __file__, 1, 'msg %d', (i,), None))
+    assert len(ring) == 10
+    msgs = lambda records: [r.getMessage() for r in records]
+    assert msgs(ring.records(3)) == ['msg 22', 'msg 23', 'msg 24']
+    assert msgs(ring.records(100)) == ['msg %d' % i for i in range(15, 25)]
+    assert msgs(ring.records(100, level=logging.WARNING)) == ['msg %d' % i for i in range(15, 25, 2)]
+    assert msgs(ring.records(100, name='ArduinoService')) == ['msg 15', 'msg 18', 'msg 21', 'msg 24']
+    assert msgs(ring.records(1, level=logging.WARNING, name='ArduinoService')) == ['msg 21']
+    assert ring.records(100, name='Arduino') == []
+    # Evicted records are removed from indices too
+    assert sum(len(i) for i in ring._by_level.values()) == sum(len(i) for i in ring._by_name.values()) == 10
+
+    record = ring.records(1)[0]
+    formatter = ColoredFormatter('%(name)s %(message)s')
+    assert LogRing.render(record, formatter, html=False) == 'automate.sys.ArduinoService.0 msg 24'
+    record.msg = 'changed'
+    assert LogRing.render(record, formatter, html=False) == 'automate.sys.ArduinoService.0 msg 24'
+
+
+def test_logstore_lastlog(sysloader):
+    import logging
+
+    class mysys(System):
+        s1 = UserBoolSensor()
+    s = sysloader.new_system(mysys)
+    logstore = s.request_service('LogStoreService')
+    s.s1.logger.warning('Warning from s1')
+    s.logger.info('Info from system')
+    assert 'Warning from s1' in logstore.lastlog(html=False)
+    assert 'Info from system' in logstore.lastlog(html=False)
+    log = logstore.lastlog(html=False, level=logging.WARNING)
+    assert 'Warning from s1' in log and 'Info from system' not in log
+    log = logstore.lastlog(html=False, name='s1')
+    assert 'Warning from s1' in log and 'Info from system' not in log
+
+    # Most recent line is rendered only if it is followed
+    assert logstore.most_recent_line == ''
+    lines = []
+
+    def follow(new):
+        lines.append(new)
+    logstore.subscribe_lines(follow)
+    s.s1.logger.warning('Followed warning')
+    assert 'Followed warning' in logstore.most_recent_line and len(lines) == 1
+    logstore.unsubscribe_lines(follow)
+    s.s1.logger.warning('Unfollowed warning')
+    assert 'Followed warning' in logstore.most_recent_line and len(lines) == 1
+
+
+def test_worker_shards():
+    import threading
+    from automate.worker import DummyStatusWorkerTask
+
+    class mysys(System):
+        s1 = UserIntSensor()
+        s2 = UserIntSensor()
+        act1 = IntActuator()
+        act2 = IntActuator()
+        prog1 = Program(on_update=SetStatus(act1, s1))
+        prog2 = Program(on_update=SetStatus(act2, s2))
+    s = mysys(exclude_services=['TextUIService'], worker_threads=2)
+    assert len(s.workers) == 2
+    w1, w2 = s.get_worker(s.s1), s.get_worker(s.s2)
+    assert w1 is not w2
+    assert s.get_worker(s.act1) is s.get_worker(s.prog1) is w1
+    assert s.get_worker(s.act2) is s.get_worker(s.prog2) is w2
+
+    # Blocked worker does not stop processing of independent objects
+    release = threading.Event()
+    w1.put(DummyStatusWorkerTask(release.wait))
+    s.s1.status = 1
+    s.s2.status = 2
+    w2.flush()
+    assert s.act2.status == 2
+    assert s.act1.status == 0
+    release.set()
+    s.flush()
+    assert s.act1.status == 1
+
+    # Connecting groups moves them into the same worker. Jobs that were queued in the previous
+    # worker are processed before jobs put in the new one.
+    old_worker = s.get_worker(s.s1)
+    release = threading.Event()
+    old_worker.put(DummyStatusWorkerTask(release.wait))
+    s.s1.status = 5
+    s.prog2.triggers.add(s.s1)
+    assert s.get_worker(s.s1) is s.get_worker(s.s2) is s.get_worker(s.act1)
+    new_worker = s.get_worker(s.s1)
+    assert new_worker is not old_worker
+    s.s1.status = 6
+    time.sleep(0.1)
+    release.set()
+    s.flush()
+    assert s.s1.status == 6
+    assert [status for t, status in s.s1.history][-2:] == [5, 6]
+
+    # Shards are not split, removing link keeps workers
+    s.prog2.triggers.remove(s.s1)
+    assert s.get_worker(s.s1) is new_worker
+    s.cleanup()
+
+
+def test_state_journal(tmpdir):
+    import os
+    filename = str(tmpdir.join('savefile.dmp'))
+
+    class mysys(System):
+        s1 = UserIntSensor()
+        s2 = UserFloatSensor(user_editable=True)
+        act = IntActuator()
+        prog = Program(on_update=SetStatus(act, s1))
+    s = mysys(exclude_services=['TextUIService', 'StatusSaverService'], filename=filename, state_journal=True)
+    s.flush()
+    s.save_state(wait=True)
+    assert s.journal.num_records == 0
+    assert os.path.getsize(filename + '.journal') == 0
+
+    s.s1.status = 1
+    s.s1.status = 2
+    s.s2.status = 1.5
+    s.flush()
+    assert s.act.status == 2
+    # Actuator status is not saved in state, so it is not journaled either
+    assert s.journal.num_records == 3
+    size = os.path.getsize(filename + '.journal')
+
+    def load():
+        obj_list, config = System.load_state_file(filename)
+        return {o._passed_arguments[1]['name']: o._passed_arguments[1] for o in obj_list}, config
+
+    states, config = load()
+    assert states['s1']['_status'] == 2
+    assert states['s2']['_status'] == 1.5
+    assert config['s2'] == 1.5
+    assert [status for t, status in states['s1']['history']] == [1, 2]
+
+    # Incomplete record at the end of journal is ignored
+    with open(filename + '.journal', 'ab') as f:
+        f.write(b'\x80\x04\x95')
+    assert load()[0]['s1']['_status'] == 2
+    with open(filename + '.journal', 'r+b') as f:
+        f.truncate(size)
+
+    s.save_state(wait=True)
+    assert s.journal.num_records == 0
+    assert os.path.getsize(filename + '.journal') == 0
+    assert load()[0]['s1']['_status'] == 2
+    s.cleanup()
+
+
+def test_save_state_snapshot(tmpdir):
+    filename = str(tmpdir.join('savefile.dmp'))
+
+    class mysys(System):
+        s1 = UserIntSensor(history_length=10)
+    s = mysys(exclude_services=['TextUIService', 'StatusSaverService'], filename=filename)
+    s.s1.status = 1
+    s.flush()
+
+    # Status changes after the snapshot are not included in the dump that is being written
+    s.save_state()
+    s.s1.status = 2
+    s.flush()
+    s.wait_state_saved()
+    assert s.last_snapshot_pause > 0
+
+    obj_list, config = System.load_state_file(filename)
+    state = {o._passed_arguments[1]['name']: o._passed_arguments[1] for o in obj_list}['s1']
+    assert state['_status'] == 1
+    assert [status for t, status in state['history']] == [1]
+    assert s.s1.status == 2
+    assert [status for t, status in s.s1.history] == [1, 2]
+    s.cleanup()
+
+
+def test_save_state_waits_running_job(tmpdir):
+    import threading
+    from automate.worker import DummyStatusWorkerTask
+    filename = str(tmpdir.join('savefile.dmp'))
+
+    class mysys(System):
+        s1 = UserIntSensor(history_length=10)
+    s = mysys(exclude_services=['TextUIService', 'StatusSaverService'], filename=filename)
+    started, release = threading.Event(), threading.Event()
+
+    def job():
+        started.set()
+        release.wait()
+        s.s1.history.append((time.time(), 5))
+    s.worker_thread.put(DummyStatusWorkerTask(job))
+    started.wait()
+    saver = threading.Thread(target=s.save_state, kwargs={'wait': True})
+    saver.start()
+    time.sleep(0.2)
+    # Snapshot is not taken while a job is being run
+    assert saver.is_alive()
+    release.set()
+    saver.join()
+
+    obj_list, config = System.load_state_file(filename)
+    state = {o._passed_arguments[1]['name']: o._passed_arguments[1] for o in obj_list}['s1']
+    assert [status for t, status in state['history']][-1] == 5
+    s.cleanup()
+
+
+def test_lazy_extensions():
+    import subprocess
+    import sys as _sys
+    code = 'import sys, automate.system; print(" ".join(sys.modules))'
+    modules = subprocess.check_output([_sys.executable, '-W', 'ignore', '-c', code],
+                                      universal_newlines=True).split()
+    for module in ('pkg_resources', 'raven', 'automate.extensions.webui', 'automate.extensions.rpc'):
+        assert module not in modules
+    import automate
+    import automate.services
+    with pytest.raises(AttributeError):
+        automate.services.NonExistingService
+    assert automate.__version__
+
+
+def test_startup_report(sysloader):
+    class S(System):
+        a = UserBoolSensor()
+        b = BoolActuator()
+        p = Program(active_condition=Value('a'), on_activate=SetStatus('b', 1))
+    s = sysloader.new_system(S)
+    report = s.startup_report
+    assert {'services', 'setup_system', 'setup_callables', 'user services'} <= set(report.phases)
+    assert report.total == pytest.approx(sum(report.phases.values()))
+    assert {'a', 'b', 'p'} <= set(report.object_times['setup_system'])
+    slowest = report.slowest('setup_callables', 2)
+    assert len(slowest) == 2 and slowest[0][1] >= slowest[1][1]
+    assert report.counts['trigger links'] == 1
+    assert report.counts['target links'] >= 1
+    d = report.as_dict(1)
+    assert len(d['slowest']['setup_system']) == 1
+    assert dict(d['phases']) == report.phases
+    assert 'setup_callables' in report.format()
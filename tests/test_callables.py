@@ -1313,6 +1313,83 @@ def test_logical(prog, x, r):
     assert x.call(prog) == r
 
 
+@pytest.mark.parametrize('x', [
+    And('sens', Or(0, 'act'), Not(Less('a2', 0))),
+    Or([0, 0], Value('sens')),
+    Sum('act', Product('a2', 2), Neg(1)),
+    Min('act', Max('a2', 1), 5),
+    Division('act', Inverse(Value(4))),
+    Equal(Value('act'), ORIGVAL),
+    More(Sum('act', 'a2'), 2.0),
+    IfElse('sens', 'act', Value('a2')),
+    Value(ToStr('act')),
+])
+def test_compiled(prog, x):
+    prog.on_deactivate = x
+    assert x.compiled(prog) == x.call(prog)
+    prog.system.sens.status = True
+    prog.system.flush()
+    assert x.compiled(prog) == x.call(prog)
+
+
+def test_compiled_subclass_call(prog):
+    class MyOr(Or):
+        def call(self, caller=None, **kwargs):
+            return not super().call(caller, **kwargs)
+
+    x = MyOr('sens')
+    prog.on_deactivate = x
+    assert x.compiled == x.call
+    assert x.compiled(prog) is True
+    prog.system.sens.status = True
+    prog.system.flush()
+    assert x.compiled(prog) is False
+
+
+def test_compiled_subclass_condition(sysloader):
+    class MyOr(Or):
+        def call(self, caller=None, **kwargs):
+            return not super().call(caller, **kwargs)
+
+    class ms(System):
+        s1 = UserBoolSensor()
+        p = Program(active_condition=MyOr(s1))
+
+    s = sysloader.new_system(ms)
+    assert s.p.active
+    s.s1.status = True
+    s.flush()
+    assert not s.p.active
+    s.s1.status = False
+    s.flush()
+    assert s.p.active
+
+
+def test_pure_builtins_only():
+    from automate.callables.builtin_callables import AbstractLogical
+
+    class MyLogical(AbstractLogical):
+        pass
+    assert not MyLogical.pure
+    assert And.pure and Or.pure and Value.pure
+    assert not Average.pure
+
+
+def test_str_without_system():
+    x = And(Value(1), Or(Value(2)))
+    assert str(x) == 'And(Value(1), Or(Value(2)))'
+
+
+def test_compiled_invalidated(prog):
+    prog.on_deactivate = x = And(Value(1), 1)
+    assert x.compiled(prog) is True
+    x._args[0]._args[0] = 0
+    assert x.compiled(prog) is False
+    x._args[0]._args[0] = 1
+    x._args.append(0)
+    assert x.compiled(prog) is False
+
+
 def test_logical2(prog):
     prog.on_deactivate = c = Neg(1, 1)
     with pytest.raises(RuntimeError):
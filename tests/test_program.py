@@ -283,3 +283,101 @@ def test_logicstr(mysys):
     mysys.p3.targets_str = '{a1}'
     assert mysys.p3.targets_str in ["TraitSetObject(['a1'])", "TraitSetObject({'a1'})"]
     assert mysys.p3.targets == {mysys.a1}
+
+
+def test_incremental_conditions(sysloader):
+    evaluated = []
+
+    class CountingValue(Value):
+        def compile(self):
+            func = super().compile()
+
+            def _counting(caller, **kwargs):
+                evaluated.append(self.obj)
+                return func(caller, **kwargs)
+            return _counting
+
+    class ms(System):
+        s1 = UserBoolSensor()
+        s2 = UserBoolSensor()
+        s3 = UserBoolSensor()
+        s4 = UserBoolSensor()
+        p = Program(active_condition=And(CountingValue(s1), Or(CountingValue(s2), CountingValue(s3)),
+                                         Not(s4)))
+
+    s = sysloader.new_system(ms)
+    assert not s.p.active
+    expected = lambda: s.s1.status and (s.s2.status or s.s3.status) and not s.s4.status
+    # First evaluation goes through all of the condition
+    s.s4.status = True
+    s.flush()
+    s.s4.status = False
+    s.flush()
+    for sensor, status in [(s.s1, True), (s.s2, True), (s.s3, True), (s.s2, False), (s.s4, True),
+                           (s.s4, False), (s.s3, False), (s.s2, True)]:
+        evaluated.clear()
+        sensor.status = status
+        s.flush()
+        assert s.p.active == expected()
+        assert set(evaluated) <= {sensor}
+
+
+def test_dependency_index(sysloader):
+    class ms(System):
+        s1 = UserBoolSensor()
+        s2 = UserBoolSensor()
+        a1 = BoolActuator()
+        p = Program(active_condition=Value(s1), on_activate=SetStatus(a1, True))
+
+    s = sysloader.new_system(ms)
+    assert s.get_triggered_programs(s.s1) == [s.p]
+    assert s.get_triggered_programs(s.s2) == []
+    assert s.p in s.get_targeting_programs(s.a1)
+    assert s.get_triggered_callables(s.s1) == [(s.p, 'active_condition')]
+
+    s.s1.status = True
+    s.flush()
+    assert s.a1.status == True
+
+    s.p.active_condition = Value(s.s2)
+    assert s.get_triggered_programs(s.s1) == []
+    assert s.get_triggered_programs(s.s2) == [s.p]
+    s.s2.status = True
+    s.flush()
+    assert s.p.active
+    s.s1.status = False
+    s.flush()
+    assert s.p.active
+
+
+def test_bulk_wiring(sysloader):
+    class ms(System):
+        trig = UserBoolSensor(default=True)
+        act = IntActuator()
+        p1 = Program(priority=1, active_condition=Value('trig'), on_activate=SetStatus('act', 1))
+        p2 = Program(priority=3, active_condition=Value('trig'), on_activate=SetStatus('act', 3))
+        p3 = Program(priority=2, active_condition=Value('trig'), on_activate=SetStatus('act', 2))
+        watch = Program(active_condition=Value('act'))
+
+    s = sysloader.new_system(ms)
+    assert s._deferred_programs is None
+    assert s.p1.active and s.p2.active and s.p3.active
+    assert s.act.program_stack == [s.act.default_program, s.p1, s.p3, s.p2]
+    assert s.act.status == 3
+    assert set(s.get_triggered_programs(s.trig)) == {s.p1, s.p2, s.p3}
+    assert s.get_triggered_programs(s.act) == [s.watch]
+    assert set(s.get_targeting_programs(s.act)) == {s.act.default_program, s.p1, s.p2, s.p3}
+
+    s.trig.status = False
+    s.flush()
+    assert not s.p1.active and not s.p2.active
+    assert s.act.program_stack == [s.act.default_program]
+    assert s.act.status == 0
+
+    with s.bulk_wiring():
+        s.p1.active_condition = Value(True)
+        s.p1.on_activate = SetStatus('act', 5)
+        assert not s.p1.active
+    assert s.p1.active
+    s.flush()
+    assert s.act.status == 5
@@ -24,7 +24,12 @@
 from automate import *
 import pytest, mock
 from pytest import approx
+from automate.history import SegmentedSeries, downsample_lttb, downsample_minmax
+import numpy as np
 from datetime import datetime
+import statistics
+import pickle
+import os
 
 
 def unix_time(dt):
@@ -108,6 +113,437 @@ def test_history_math(sysloader):
     assert s.integral(0,4) == approx(2)
 
 
+def test_ring_history(sysloader):
+    np = pytest.importorskip('numpy')
+    from automate.history import RingHistory
+
+    class HistoryTest(System):
+        f = UserFloatSensor(history_length=3)
+        i = UserIntSensor(history_length=3)
+        b = UserBoolSensor(history_length=3)
+    sys = sysloader.new_system(HistoryTest)
+
+    assert isinstance(sys.f.history, RingHistory)
+    assert isinstance(sys.i.history, RingHistory)
+    assert not isinstance(sys.b.history, RingHistory)
+
+    s = sys.f
+    s.history = [(i, i / 2) for i in range(5)]
+    assert isinstance(s.history, RingHistory)
+    assert list(s.history) == [(2., 1.), (3., 1.5), (4., 2.)]
+    assert s.history[-1] == (4., 2.)
+    assert s.times.base is not None and not s.times.flags.writeable
+    assert s.statuses.tolist() == [1., 1.5, 2.]
+    for i in range(5, 100):
+        s.history.append((i, i / 2))
+    assert len(s.history) == 3
+    assert s.times.tolist() == [97., 98., 99.]
+    assert s.status_at_time(98.5) == 49.
+
+    s.history_length = 2
+    assert list(s.history) == [(98., 49.), (99., 49.5)]
+
+    sys.i.status = 5
+    sys.flush()
+    assert sys.i.statuses.dtype == np.int64
+    assert sys.i.history[-1][1] == 5
+
+
+def test_object_history(sysloader):
+    import collections
+    from automate.history import ObjectHistory
+
+    class HistoryTest(System):
+        s = UserStrSensor(history_length=3)
+    sys = sysloader.new_system(HistoryTest)
+
+    s = sys.s
+    assert isinstance(s.history, ObjectHistory)
+    s.history = collections.deque([(i, str(i)) for i in range(5)], maxlen=3)
+    assert isinstance(s.history, ObjectHistory)
+    assert list(s.history) == [(2, '2'), (3, '3'), (4, '4')]
+    for i in range(5, 100):
+        s.history.append((i, str(i)))
+    assert len(s.history) == 3 and len(s.history._times) < 3 + 20
+    assert s.history[0] == (97, '97') and s.history[-1] == (99, '99')
+    assert s.history.bisect(98) == 2 and s.history.bisect(98, 'left') == 1
+    assert s.history_window(97.5, 100) == ([98, 99], ['98', '99'])
+    assert s.status_at_time(98.5) == '98'
+    assert s.history.pop() == (99, '99')
+    h = pickle.loads(pickle.dumps(s.history))
+    assert list(h) == [(97, '97'), (98, '98')] and h.maxlen == 3
+
+
+def test_history_snapshots():
+    from automate.history import ObjectHistory, RingHistory, RollupTier
+
+    ring = RingHistory(20, data=[(i, float(i)) for i in range(10)])
+    snap = ring.snapshot()
+    assert snap._times is ring._times
+    for i in range(10, 100):
+        ring.append((i, float(i)))
+    ring.pop()
+    ring.append((200, 1.))
+    assert list(snap) == [(float(i), float(i)) for i in range(10)]
+    assert pickle.loads(pickle.dumps(snap)).times.tolist() == list(range(10))
+    assert ring.times.tolist()[-2:] == [98., 200.]
+
+    objects = ObjectHistory(5, [(i, str(i)) for i in range(5)])
+    snap = objects.snapshot()
+    objects.pop()
+    objects.extend((i, str(i)) for i in range(10, 100))
+    assert list(pickle.loads(pickle.dumps(snap))) == [(i, str(i)) for i in range(5)]
+    assert snap.bisect(100) == 5
+    assert list(objects)[-1] == (99, '99')
+
+    tier = RollupTier(10, 5)
+    tier.add(0, 1.)
+    tier.add(5, 3.)
+    snap = tier.snapshot()
+    assert snap.buckets is tier.buckets
+    tier.add(7, 10.)
+    tier.add(25, 0.)
+    assert snap.window(0, 100) == [(0, 2, 1., 3., 1.)]
+    assert pickle.loads(pickle.dumps(snap)).buckets == snap.buckets
+
+
+def test_history_window_queries(sysloader):
+    pytest.importorskip('numpy')
+
+    class HistoryTest(System):
+        s = UserFloatSensor(history_length=300000)
+    sys = sysloader.new_system(HistoryTest)
+
+    s = sys.s
+    s.history = [(i, float(i % 2)) for i in range(300000)]
+    assert s.status_at_time(-1) == 0.
+    assert s.status_at_time(1000.5) == 0.
+    assert s.status_at_time(1001) == 1.
+    assert s.status_at_time(10**6) == 1.
+    assert s.integral(1000, 1004) == approx(2.)
+    assert s.integral(1000.5, 1001.5) == approx(0.5)
+    assert s.average(1000, 2000) == approx(0.5)
+    with mock.patch("time.time", new_callable=lambda *args: lambda *args: 299999):
+        assert s.stdev(3) == approx(statistics.stdev([0., 1., 0., 1.]))
+
+
+def test_ring_history_integral():
+    pytest.importorskip('numpy')
+    from automate.history import RingHistory
+    import random
+
+    def reference(history, t_a, t_b):
+        s_prev, t_prev, s_sum = 0., t_a, 0.
+        for t, s in history:
+            if t <= t_a:
+                s_prev = s
+            elif t <= t_b:
+                s_sum += s_prev * (t - t_prev)
+                s_prev, t_prev = s, t
+        return s_sum + s_prev * (t_b - t_prev)
+
+    h = RingHistory(50)
+    t = 0.
+    for i in range(500):
+        t += random.random()
+        h.append((t, random.random()))
+        if i % 37 == 1:
+            h.pop()
+        t_a = random.uniform(h[0][0] - 1, t)
+        t_b = random.uniform(t_a, t + 1)
+        assert h.integral(t_a, t_b) == approx(reference(h, t_a, t_b))
+    h2 = pickle.loads(pickle.dumps(h))
+    assert h2.integral(h[0][0], t) == approx(reference(h, h[0][0], t))
+
+
+def test_history_store(sysloader, tmpdir):
+    pytest.importorskip('numpy')
+    import os
+
+    class HistoryTest(System):
+        s = UserIntSensor(history_length=3)
+        b = UserBoolSensor()
+    sys = sysloader.new_system(HistoryTest, filename=str(tmpdir.join('savefile.dmp')),
+                               services=[HistoryStoreService(segment_size=4)])
+    s = sys.s
+    assert sys.b.history_store is None
+    for i in range(1, 11):
+        s.status = i
+        sys.flush()
+    store = s.history_store
+    assert len(store) == 10
+    assert len(os.listdir(str(tmpdir.join('savefile.dmp.history', 's')))) == 3
+    assert len(s.history) == 3
+
+    # Without start time, only in-memory history is read
+    assert s.history_window()[1].tolist() == [8, 9, 10]
+    times, statuses = s.history_window(0)
+    assert statuses.tolist() == list(range(1, 11))
+    assert s.status_at_time(times[1]) == 2
+    assert s.status_at_time(times[0] - 1) == 0
+    assert s.status_at_time(times[-1]) == 10
+    expected = sum(v * (t2 - t1) for v, t1, t2 in zip(range(1, 10), times, times[1:]))
+    assert s.integral(times[0], times[-1]) == approx(expected)
+
+    t, statuses = s.history_window(times[-2])
+    assert statuses.tolist() == [9, 10]
+
+    # Sample that is overwritten in memory is replaced in store too
+    s.history_frequency = 1000
+    s.status = 20
+    sys.flush()
+    assert len(store) == 10
+    assert s.history_window(0)[1].tolist()[-2:] == [9, 20]
+    s.history_frequency = 0
+
+    # Reopened store continues from existing segments
+    sys.request_service('HistoryStoreService').cleanup()
+    store = SegmentedSeries(str(tmpdir.join('savefile.dmp.history', 's')), 4)
+    store.append(times[-1] + 1, 11)
+    store.append(times[-1] + 1, 12)
+    assert len(store) == 11
+    assert store.status_at_time(times[-1] + 2) == 12
+    store.close()
+
+
+def test_segmented_series_empty_segment(tmpdir):
+    pytest.importorskip('numpy')
+    directory = str(tmpdir.join('s'))
+    store = SegmentedSeries(directory, 2)
+    for t in range(1, 4):
+        store.append(float(t), t * 10.)
+    store.close()
+    # Writing was interrupted right after a new segment was created
+    tmpdir.join('s', '%020.6f.seg' % 5).write('')
+    tmpdir.join('s', '%020.6f.seg' % 6).write('')
+    store = SegmentedSeries(directory, 2)
+    assert len(store) == 3
+    assert store.status_at_time(10) == 30.
+    assert store.status_at_time(0.5) == 0.
+    assert store.integral(0, 10) == approx(10 + 20 + 30 * 7)
+    store.append(10., 40.)
+    assert store.status_at_time(10) == 40.
+    store.close()
+    assert sorted(os.listdir(directory)) == ['%020.6f.seg' % t for t in (1, 3)]
+
+
+def test_compressed_history():
+    pytest.importorskip('numpy')
+    from automate.history import CompressedHistory, RingHistory
+    import random
+
+    compressed, ring = CompressedHistory(3000, chunk_size=64), RingHistory(3000)
+    t, value = 1.5e9, 20.
+    for i in range(5000):
+        t += 1. + (random.random() < 0.1) * 0.001
+        value = value + random.choice([-0.5, 0, 0, 0, 0.5])
+        compressed.append((round(t, 3), value))
+        ring.append((round(t, 3), value))
+        if i % 500 == 7:
+            assert compressed.pop() == ring.pop()
+    assert len(compressed) == len(ring) == 3000
+    assert list(compressed) == list(ring)
+    assert list(reversed(compressed)) == list(reversed(ring))
+    assert compressed[-1] == ring[-1] and compressed[100] == ring[100]
+    assert compressed.nbytes < 2 * len(compressed)
+    for i in range(100):
+        t_a = random.uniform(ring.times[0] - 10, ring.times[-1] + 10)
+        t_b = random.uniform(t_a, ring.times[-1] + 20)
+        assert compressed.bisect(t_a) == ring.bisect(t_a)
+        assert compressed.bisect(t_a, 'left') == ring.bisect(t_a, 'left')
+        assert compressed.window(t_a, t_b)[1].tolist() == ring.window(t_a, t_b)[1].tolist()
+        assert compressed.integral(t_a, t_b) == approx(ring.integral(t_a, t_b))
+    assert list(pickle.loads(pickle.dumps(compressed))) == list(compressed)
+    for i in range(-70, 70):
+        assert compressed[i] == ring[i]
+
+    # First and last entries are given without decoding chunks again
+    compressed._compress_tail()
+    compressed[0]
+    with mock.patch('automate.history._decode_chunk') as decode:
+        for i in range(10):
+            assert compressed[0] == ring[0] and compressed[-1] == ring[-1]
+    assert not decode.called
+
+    ints = CompressedHistory(10, 'int64', [(1, 1), (2, 5)])
+    assert list(ints) == [(1., 1), (2., 5)]
+
+
+def test_compressed_sensor_history(sysloader):
+    pytest.importorskip('numpy')
+    from automate.history import CompressedHistory
+
+    class HistoryTest(System):
+        s = UserFloatSensor(history_length=20, history_compression=True)
+    sys = sysloader.new_system(HistoryTest)
+    s = sys.s
+    assert isinstance(s.history, CompressedHistory)
+    s.history = [(0, 0.), (1, 1.), (2, 0.5)]
+    assert isinstance(s.history, CompressedHistory)
+    assert s.status_at_time(1.5) == 1.
+    assert s.integral(0, 3) == approx(1.5)
+    s.history_compression = False
+    assert list(s.history) == [(0, 0.), (1, 1.), (2, 0.5)]
+
+
+def test_rollup_tier():
+    from automate.history import RollupTier
+    import random
+
+    def reference(samples, t_a, t_b):
+        total, s_prev, t_prev = 0., 0., t_a
+        for t, s in samples:
+            if t <= t_a:
+                s_prev = s
+            elif t <= t_b:
+                total += s_prev * (t - t_prev)
+                s_prev, t_prev = s, t
+        return total + s_prev * (t_b - t_prev)
+
+    tier = RollupTier(10, 1000)
+    samples = [(i * 10. + 1000, random.random()) for i in range(200)]
+    for t, s in samples:
+        tier.add(t, s)
+    assert len(tier.buckets) == 200
+    for i in range(50):
+        t_a = random.randrange(990, 3100, 10)
+        t_b = random.randrange(t_a, 3100, 10)
+        assert tier.integral(t_a, t_b) == approx(reference(samples, t_a, t_b))
+    start, count, minimum, maximum, mean = tier.window(1000, 1010)[0]
+    assert (start, count, minimum, maximum) == (1000, 1, samples[0][1], samples[0][1])
+    assert mean == approx(samples[0][1])
+
+    tier = RollupTier(100, 5)
+    tier.add(0, 1.)
+    tier.add(1000, 2.)
+    assert tier.dropped
+    assert [b[0] for b in tier.buckets] == [600, 700, 800, 900, 1000]
+    assert tier.window(650, 950)[1] == (700, 0, 1., 1., 1.)
+
+    tier = RollupTier(10, 5)
+    for t, status in [(1, 5.), (3, 7.), (4, 2.), (13, 4.)]:
+        tier.add(t, status)
+    assert tier.extrema(0, 20) == [(3, 7.), (4, 2.), (10, 2.), (13, 4.)]
+    tier = pickle.loads(pickle.dumps(tier))
+    for bucket in tier.buckets:
+        del bucket[5:]
+    tier.__setstate__(tier.__dict__)
+    assert tier.extrema(0, 20) == [(0, 2.), (0, 7.), (10, 2.), (10, 4.)]
+
+
+def test_rollup_history(sysloader):
+    class HistoryTest(System):
+        s = UserFloatSensor(history_length=5, history_rollups=[(10, 1000), (1000, 10)])
+    sys = sysloader.new_system(HistoryTest)
+    s = sys.s
+    assert [(i.seconds, i.length) for i in s.rollups] == [(10, 1000), (1000, 10)]
+    samples = []
+    with mock.patch('time.time') as time_mock:
+        for i in range(1, 101):
+            time_mock.return_value = 1000. + 10 * i
+            samples.append((time_mock.return_value, float(i % 7)))
+            s.status = i % 7
+            sys.flush()
+    assert len(s.history) == 5
+    assert s.select_rollup(1010, 2000) is s.rollups[0]
+    assert s.select_rollup(0, 2000000) is s.rollups[1]
+    assert s.select_rollup(1990, 2000) is None
+    expected = sum(v * 10 for t, v in samples[:-1])
+    assert s.integral(1010, 2000) == approx(expected)
+    assert s.average(1010, 2000) == approx(expected / 990)
+    assert s.integral(0, 2000) == approx(expected)
+
+    # Buckets are counted from the data that the tier has, not from t_a
+    assert s.select_rollup(0, 2000, min_buckets=2) is s.rollups[0]
+    assert s.select_rollup(0, 3010, min_buckets=2) is s.rollups[1]
+    with mock.patch('time.time', return_value=2000.):
+        assert s.history_points()[1].tolist() == [v for t, v in samples[-5:]]
+    times, statuses = s.history_points(1010, 2000, method='minmax')
+    assert list(times) == sorted(times)
+    assert (times[:2].tolist(), statuses[:2].tolist()) == ([1010, 1020], [1., 2.])
+
+
+def test_downsampling():
+    times = np.arange(1000, dtype='float64')
+    values = np.sin(times / 50.)
+    values[500] = 10.
+    t, v = downsample_lttb(times, values, 50)
+    assert len(t) == 50
+    assert t[0] == 0 and t[-1] == 999
+    assert 10. in v
+    assert list(t) == sorted(t)
+    t, v = downsample_minmax(times, values, 50)
+    assert len(t) <= 50
+    assert 10. in v and values.min() in v
+    assert list(t) == sorted(t)
+    assert len(downsample_lttb(times[:10], values[:10], 50)[0]) == 10
+    assert len(downsample_minmax(times[:10], values[:10], 50)[0]) == 10
+
+
+def test_history_points(sysloader):
+    class HistoryTest(System):
+        s = UserFloatSensor(history_length=1000, history_rollups=[(10, 1000)])
+    sys = sysloader.new_system(HistoryTest)
+    s = sys.s
+    with mock.patch('time.time') as time_mock:
+        for i in range(1, 501):
+            time_mock.return_value = 1000. + i
+            s.status = i % 7
+            sys.flush()
+        times, statuses = s.history_points(1100, 1200)
+        assert len(times) == 101
+        times, statuses = s.history_points(1100, 1200, max_points=20)
+        assert len(times) == 20
+        assert times[0] == 1100 and times[-1] == 1200
+        times, statuses = s.history_points(1100, 1200, max_points=20, method='minmax')
+        assert len(times) <= 20
+        assert statuses.min() == 0 and statuses.max() == 6
+        s.history_length = 10
+        times, statuses = s.history_points(1100, 1500, max_points=10)
+        assert len(times) == 10
+        times, statuses = s.history_points(1100, 1500, max_points=200, method='minmax')
+        assert len(times) <= 2 * len(s.rollups[0].window(1100, 1500))
+        assert list(times) == sorted(times)
+        assert statuses.min() == 0 and statuses.max() == 6
+
+
+def test_history_grid(sysloader):
+    class HistoryTest(System):
+        f = UserFloatSensor(history_length=100)
+        b = UserBoolSensor(history_length=100)
+    sys = sysloader.new_system(HistoryTest)
+    sys.f.history.clear()
+    sys.b.history.clear()
+    sys.f.history.extend([(10., 1.), (20., 2.), (25., 3.)])
+    sys.b.history.extend([(15., True), (30., False)])
+    grid, series = sys.history_grid(['f', 'b'], 5, 35, step=5)
+    assert list(grid) == [5, 10, 15, 20, 25, 30, 35]
+    assert list(series['f']) == [0, 1, 1, 2, 3, 3, 3]
+    assert list(series['b']) == [0, 0, 1, 1, 1, 0, 0]
+    for name in ('f', 'b'):
+        obj = getattr(sys, name)
+        assert list(series[name]) == [float(obj.status_at_time(t) or 0) for t in grid]
+    grid, series = sys.history_grid(['f'], 21, 24, step=5)
+    assert list(grid) == [21] and list(series['f']) == [2]
+    with pytest.raises(ValueError):
+        sys.history_grid(['f'], 0, 10, step=0)
+    with pytest.raises(ValueError):
+        sys.history_grid(['f'], 0, 10, step=float('nan'))
+    with pytest.raises(ValueError):
+        sys.history_grid(['f'], 0, 10**9, step=1)
+    grid, series = sys.history_grid(['f'], 0, 30, max_points=4)
+    assert list(grid) == [0, 10, 20, 30] and list(series['f']) == [0, 1, 2, 3]
+
+
+def test_history_grid_non_numeric(sysloader):
+    class HistoryTest(System):
+        s = UserStrSensor(history_length=10)
+    sys = sysloader.new_system(HistoryTest)
+    sys.s.history.extend([(10., 'a'), (20., 'b')])
+    with pytest.raises(TypeError):
+        sys.history_grid(['s'], 0, 30, step=10)
+
+
 def test_history_integral(sysloader):
     class HistoryTest(System):
         s = UserFloatSensor(history_length=20, default=0)
@@ -123,7 +559,6 @@ def test_history_integral(sysloader):
     s2 = sys.s2
     assert s2.status == approx(0.)
     s.history.extend([(0, 0.), (1, 1.), (2, 0.5)])
-    s.integral.cache_clear()
     assert s.integral(0,3) == approx(1.5)
 
     sys.trig.status = 1
@@ -148,7 +583,6 @@ def test_full_integral(sysloader):
     s2 = sys.s2
     assert s2.status == approx(0.)
     s.history.extend([(0, 0.), (1, 1.), (2, 0.5)])
-    s.integral.cache_clear()
     with mock.patch("time.time", new_callable=lambda *args: lambda *args: 2):
         assert s.integral() == approx(1)
 